@@ -2,7 +2,12 @@
 
 import azure.functions as func
 
-from shared_code import cosmosdb_module, strava_helpers, user_helpers
+from shared_code import (
+    cosmosdb_module,
+    response_cache,
+    strava_helpers,
+    user_helpers,
+)
 
 bp = func.Blueprint()
 
@@ -44,8 +49,6 @@ async def callback_strava(req: func.HttpRequest) -> func.HttpResponse:
             mimetype="application/json",
             status_code=400,
         )
-    else:
-        user_settings = user_settings[0]
 
     # Get Strava authentication object
     auth_object = strava_helpers.initial_strava_auth(
@@ -53,9 +56,13 @@ async def callback_strava(req: func.HttpRequest) -> func.HttpResponse:
     )
 
     # Update user settings
-    user_settings["strava_authentication"] = auth_object
-    container = cosmosdb_module.cosmosdb_container("users")
-    container.upsert_item(user_settings)
+    cosmosdb_module.patch_cosmosdb_item(
+        userid,
+        "users",
+        cosmosdb_module.create_set_operations({"strava_authentication": auth_object}),
+    )
+    user_helpers.invalidate_user_settings(userid)
+    response_cache.invalidate_user(userid)
 
     return func.HttpResponse(
         body='{"result": "Success"}',
@@ -1,44 +1,242 @@
 """Function to query cosmosDB for container data"""
 
+import base64
+import datetime
+import io
 import json
 import logging
+import re
+from typing import Iterable
 
 import azure.functions as func
+from azure.cosmos import exceptions
 
-from shared_code import cosmosdb_module, user_helpers
+from shared_code import (
+    aggregate_helpers,
+    cosmosdb_module,
+    curve_helpers,
+    fitness_helpers,
+    http_helpers,
+    response_cache,
+    stream_codec,
+    stream_store,
+    user_helpers,
+    utils,
+    vo2max_helpers,
+)
 
 bp = func.Blueprint()
 
 
 @bp.route(route="data/activities", methods=["GET"])
 def list_activities(req: func.HttpRequest) -> func.HttpResponse:
-    """Main function"""
+    """
+    List the activities of the user.
+
+    Without a `pageSize` all activities are returned at once. With a `pageSize`
+    a page is returned together with the `continuationToken` of the next page,
+    pages are sorted on the start date, newest first unless `order=asc`.
+    Without a `pageSize` `order` sorts on the start date. `format=ndjson`
+    returns one activity per line, which is built page by page instead of from
+    one list. `view=summary` or a comma separated list of `fields` only selects
+    those fields in CosmosDB.
+    """
     logging.info("Getting container data")
 
     start_date = req.params.get("startDate")
     end_date = req.params.get("endDate")
+    page_size = req.params.get("pageSize")
+    continuation_token = req.params.get("continuationToken")
+    order = req.params.get("order")
+    output_format = req.params.get("format", "json")
 
-    query = "SELECT * FROM c WHERE c.userId = @userid"
-    if start_date:
-        query += " AND c.start_date >= @startDate"
-    if end_date:
-        query += " AND c.start_date <= @endDate"
+    try:
+        if (
+            (page_size is not None and not (page_size.isdigit() and int(page_size) > 0))
+            or order not in [None, "asc", "desc"]
+            or output_format not in ["json", "ndjson"]
+        ):
+            raise ValueError("Invalid pageSize, order or format")
+        if continuation_token:
+            decode_cursor(continuation_token)
+        projection = activity_projection(
+            req.params.get("view"), req.params.get("fields")
+        )
+    except ValueError as ex:
+        return http_helpers.json_response(req, {"result": str(ex)}, 400)
 
     userid = user_helpers.get_user(req)["userId"]
 
+    filters = "c.userId = @userid"
+    if start_date:
+        filters += " AND c.start_date >= @startDate"
+    if end_date:
+        filters += " AND c.start_date <= @endDate"
+    parameters = [
+        {"name": "@userid", "value": userid},
+        {"name": "@startDate", "value": start_date},
+        {"name": "@endDate", "value": end_date},
+    ]
+    generation = response_cache.user_generation(userid)
+    cached = response_cache.get_response(userid, "data/activities", dict(req.params))
+    if cached:
+        if http_helpers.etag_matches(req, cached.headers.get("ETag", "")):
+            return http_helpers.not_modified_response(dict(cached.headers))
+        return http_helpers.compress_response(req, cached)
+
     container = cosmosdb_module.cosmosdb_container("activities")
-    result = list(
-        container.query_items(
-            query=query,
-            parameters=[
-                {"name": "@userid", "value": userid},
-                {"name": "@startDate", "value": start_date},
-                {"name": "@endDate", "value": end_date},
-            ],
-            enable_cross_partition_query=True,
+
+    # Count and latest change of the result set, both answered from the index,
+    # `/userId` and `/_ts` are included in the activities indexing policy.
+    # Cross partition queries only merge aggregates selected with VALUE.
+    count_query = "SELECT VALUE COUNT(1) FROM c"
+    count_query += f" WHERE {filters}"
+    last_modified_query = "SELECT VALUE MAX(c._ts) FROM c"
+    last_modified_query += f" WHERE {filters}"
+    count = query_value(container, count_query, parameters)
+    last_modified = query_value(container, last_modified_query, parameters)
+    headers = http_helpers.cache_headers(
+        http_helpers.create_etag(
+            userid, count, last_modified, sorted(req.params.items())
+        ),
+        last_modified,
+    )
+    if http_helpers.etag_matches(req, headers["ETag"]):
+        return http_helpers.not_modified_response(headers)
+
+    query, parameters = activities_query(req, projection, filters, parameters)
+    options = {"max_item_count": min(int(page_size), 1000)} if page_size else {}
+    items = container.query_items(
+        query=query,
+        parameters=parameters,
+        enable_cross_partition_query=True,
+        **options,
+    )
+
+    response = activities_response(
+        items, output_format, int(page_size) if page_size else None
+    )
+    for name, value in headers.items():
+        response.headers[name] = value
+    response_cache.set_response(
+        userid, "data/activities", dict(req.params), response, generation
+    )
+    return http_helpers.compress_response(req, response)
+
+
+def query_value(container, query: str, parameters: list[dict]) -> object:
+    """Get the single value of a `SELECT VALUE` aggregate, None without results"""
+    return next(
+        iter(
+            container.query_items(
+                query=query,
+                parameters=parameters,
+                enable_cross_partition_query=True,
+            )
+        ),
+        None,
+    )
+
+
+def encode_cursor(item: dict) -> str:
+    """Create the opaque continuation token of the page after an activity"""
+    cursor = json.dumps([item["start_date"], item["id"]]).encode("utf-8")
+    return base64.urlsafe_b64encode(cursor).decode("ascii")
+
+
+def decode_cursor(continuation_token: str) -> tuple[str, str]:
+    """Get the start date and id of a continuation token, raises ValueError"""
+    try:
+        start_date, activity_id = json.loads(
+            base64.urlsafe_b64decode(continuation_token.encode("ascii"))
         )
+    except (ValueError, TypeError) as ex:
+        raise ValueError("Invalid continuationToken") from ex
+    if not isinstance(start_date, str) or not isinstance(activity_id, str):
+        raise ValueError("Invalid continuationToken")
+    return start_date, activity_id
+
+
+def activities_query(
+    req: func.HttpRequest, projection: str, filters: str, parameters: list[dict]
+) -> tuple[str, list[dict]]:
+    """Create the query of list_activities, a single page with a `pageSize`"""
+    page_size = req.params.get("pageSize")
+    order = req.params.get("order")
+    if not page_size:
+        query = f"SELECT {projection} FROM c WHERE {filters}"  # noqa: S608
+        if order:
+            query += f" ORDER BY c.start_date {order.upper()}"
+        return query, parameters
+
+    # The continuation token is built from the start date of the last item
+    if projection != "*" and 'c["start_date"]' not in projection:
+        projection += ', c["start_date"]'
+    continuation_token = req.params.get("continuationToken")
+    return page_query(
+        f"SELECT TOP @pageSize {projection} FROM c WHERE {filters}",  # noqa: S608
+        parameters,
+        order or "desc",
+        int(page_size),
+        decode_cursor(continuation_token) if continuation_token else None,
     )
 
+
+def page_query(
+    query: str,
+    parameters: list[dict],
+    order: str,
+    page_size: int,
+    cursor: tuple[str, str] | None,
+) -> tuple[str, list[dict]]:
+    """
+    Create the query of a page of activities sorted on start date and id.
+
+    Cross partition ORDER BY queries do not return continuation tokens, so a page
+    continues after the start date and id of the last activity of the previous
+    page instead. The id breaks ties between activities that start at the same
+    time.
+    """
+    comparison = "<" if order == "desc" else ">"
+    parameters = [*parameters, {"name": "@pageSize", "value": page_size}]
+    if cursor:
+        query += (
+            f" AND (c.start_date {comparison} @cursorDate"
+            f" OR (c.start_date = @cursorDate AND c.id {comparison} @cursorId))"
+        )
+        parameters += [
+            {"name": "@cursorDate", "value": cursor[0]},
+            {"name": "@cursorId", "value": cursor[1]},
+        ]
+    query += f" ORDER BY c.start_date {order.upper()}, c.id {order.upper()}"
+    return query, parameters
+
+
+def activities_response(
+    items: Iterable[dict],
+    output_format: str,
+    page_size: int | None,
+) -> func.HttpResponse:
+    """Create the response of list_activities"""
+    if page_size:
+        result = [remove_system_keys(item) for item in items]
+        continuation_token = (
+            encode_cursor(result[-1]) if len(result) == page_size else None
+        )
+        if output_format == "ndjson":
+            return ndjson_response(result, continuation_token)
+        return func.HttpResponse(
+            body=http_helpers.dumps(
+                {"items": result, "continuationToken": continuation_token}
+            ),
+            mimetype="application/json",
+            status_code=200,
+        )
+
+    if output_format == "ndjson":
+        return ndjson_response(remove_system_keys(item) for item in items)
+
+    result = list(items)
     if not result:
         return func.HttpResponse(
             body="{[]}",
@@ -54,8 +252,385 @@ def list_activities(req: func.HttpRequest) -> func.HttpResponse:
         "_ts",
     ]
     for key in keys_to_pop:
-        result[0].pop(key)
+        result[0].pop(key, None)
+
+    return func.HttpResponse(
+        body=http_helpers.dumps(result), mimetype="application/json", status_code=200
+    )
+
+
+@bp.route(route="data/activities/user_input", methods=["POST"])
+def update_user_input(req: func.HttpRequest) -> func.HttpResponse:
+    """Update the user input of an activity"""
+    logging.info("Updating user input")
+
+    activity_id = req.params.get("activityId")
+    if not activity_id:
+        return func.HttpResponse(
+            body='{"result": "Missing activityId"}',
+            mimetype="application/json",
+            status_code=400,
+        )
+
+    try:
+        data = json.loads(req.get_body().decode("utf-8"))
+    except Exception as ex:
+        logging.error(ex)
+        return func.HttpResponse(
+            body='{"result": "Invalid json body"}',
+            mimetype="application/json",
+            status_code=400,
+        )
+
+    invalid_response = utils.validate_json(data, "user_input")
+    if invalid_response:
+        return invalid_response
+
+    userid = user_helpers.get_user(req)["userId"]
+
+    activity = cosmosdb_module.get_cosmosdb_item(
+        activity_id, "activities", ["_rid", "_self", "_attachments", "_ts"]
+    )
+    if not activity or activity["userId"] != userid:
+        return func.HttpResponse(
+            body='{"result": "Activity not found"}',
+            mimetype="application/json",
+            status_code=404,
+        )
+
+    include_in_vo2max_estimate = activity["user_input"]["include_in_vo2max_estimate"]
+
+    try:
+        activity = cosmosdb_module.patch_cosmosdb_item(
+            activity_id,
+            "activities",
+            cosmosdb_module.create_set_operations({"user_input": data}),
+            activity["_etag"],
+        )
+    except exceptions.CosmosAccessConditionFailedError:
+        return func.HttpResponse(
+            body='{"result": "Activity was modified, please retry"}',
+            mimetype="application/json",
+            status_code=409,
+        )
+
+    if data["include_in_vo2max_estimate"] != include_in_vo2max_estimate:
+        vo2max_helpers.update_vo2max(activity)
+    response_cache.invalidate_user(userid)
 
     return func.HttpResponse(
-        body=json.dumps(result), mimetype="application/json", status_code=200
+        body='{"result": "done"}',
+        mimetype="application/json",
+        status_code=200,
     )
+
+
+@bp.route(route="data/fitness", methods=["GET"])
+def get_fitness(req: func.HttpRequest) -> func.HttpResponse:
+    """Get the fitness/fatigue (CTL/ATL/TSB) time series up to today"""
+    logging.info("Getting fitness data")
+
+    start_date = req.params.get("startDate")
+    end_date = req.params.get("endDate")
+
+    userid = user_helpers.get_user(req)["userId"]
+
+    document = cosmosdb_module.get_cosmosdb_item(
+        fitness_helpers.fitness_document_id(userid), "metrics"
+    )
+
+    if not document:
+        return func.HttpResponse(
+            body="[]",
+            mimetype="application/json",
+            status_code=200,
+        )
+
+    # A changed load type preference is applied before the next calculation
+    tss_type = user_helpers.get_user_settings(userid)["preferences"][
+        "preferred_tss_type"
+    ]
+    if document["tss_type"] != tss_type:
+        document = fitness_helpers.set_tss_type(userid, tss_type)
+
+    series = fitness_helpers.extend_series(
+        document["series"], datetime.date.today().isoformat()
+    )
+    series = filter_by_date(series, start_date, end_date)
+
+    return http_helpers.json_response(req, series)
+
+
+@bp.route(route="data/vo2max", methods=["GET"])
+def get_vo2max(req: func.HttpRequest) -> func.HttpResponse:
+    """Get the rolling VO2 max trend"""
+    logging.info("Getting VO2 max trend")
+
+    start_date = req.params.get("startDate")
+    end_date = req.params.get("endDate")
+
+    userid = user_helpers.get_user(req)["userId"]
+
+    document = cosmosdb_module.get_cosmosdb_item(
+        vo2max_helpers.vo2max_document_id(userid), "metrics"
+    )
+
+    if not document:
+        return func.HttpResponse(
+            body="[]",
+            mimetype="application/json",
+            status_code=200,
+        )
+
+    trend = filter_by_date(document["trend"], start_date, end_date)
+
+    return http_helpers.json_response(req, trend)
+
+
+@bp.route(route="data/curves", methods=["GET"])
+def get_curves(req: func.HttpRequest) -> func.HttpResponse:
+    """Get the all-time or season mean-maximal curves of an activity `type`"""
+    logging.info("Getting mean-maximal curves")
+
+    season = req.params.get("season")
+    activity_type = req.params.get("type", "Run")
+
+    userid = user_helpers.get_user(req)["userId"]
+
+    document = cosmosdb_module.get_cosmosdb_item(
+        curve_helpers.curves_document_id(userid), "metrics"
+    )
+
+    if not document:
+        return func.HttpResponse(
+            body="{}",
+            mimetype="application/json",
+            status_code=200,
+        )
+
+    envelopes = document.get("types", {}).get(
+        activity_type, curve_helpers.default_type_envelopes()
+    )
+    envelope = envelopes["seasons"].get(season, {}) if season else envelopes["all_time"]
+
+    return http_helpers.json_response(req, curve_helpers.envelope_to_curves(envelope))
+
+
+@bp.route(route="data/streams", methods=["GET"])
+def get_streams(req: func.HttpRequest) -> func.HttpResponse:
+    """
+    Get a selection of the streams of an activity.
+
+    Query parameters are `activityId`, a comma separated list of `columns`, a
+    `startTime`/`endTime` or `startDistance`/`endDistance` range, a `resolution`
+    in samples and a `format` of `json` for plain value lists or `encoded` for the
+    compact stored encoding.
+    """
+    logging.info("Getting activity streams")
+
+    activity_id = req.params.get("activityId")
+    if not activity_id:
+        return func.HttpResponse(
+            body='{"result": "Missing activityId"}',
+            mimetype="application/json",
+            status_code=400,
+        )
+
+    try:
+        columns, value_range, resolution, output_format = parse_stream_params(req)
+    except ValueError as ex:
+        return http_helpers.json_response(req, {"result": str(ex)}, 400)
+
+    userid = user_helpers.get_user(req)["userId"]
+
+    streams = stream_store.query_streams(
+        activity_id, userid, columns, value_range, resolution
+    )
+
+    if streams is None:
+        return func.HttpResponse(
+            body='{"result": "Streams not found"}',
+            mimetype="application/json",
+            status_code=404,
+        )
+
+    output = streams
+    if output_format == "encoded":
+        output = {
+            name: stream_codec.encode_column(name, values)
+            for name, values in streams.items()
+        }
+
+    return http_helpers.json_response(
+        req,
+        {
+            "activityId": activity_id,
+            "format": output_format,
+            "length": max((len(values) for values in streams.values()), default=0),
+            "columns": output,
+        },
+    )
+
+
+def parse_stream_params(req: func.HttpRequest) -> tuple:
+    """Parse the stream selection parameters, raises ValueError when invalid"""
+    columns = req.params.get("columns")
+    columns = columns.split(",") if columns else None
+    if columns and not set(columns) <= set(stream_codec.column_specs()):
+        raise ValueError("Invalid columns")
+
+    try:
+        start_time, end_time, start_distance, end_distance = get_number_params(
+            req, ["startTime", "endTime", "startDistance", "endDistance"]
+        )
+        (resolution,) = get_number_params(req, ["resolution"], int)
+    except ValueError as ex:
+        raise ValueError("Invalid range or resolution") from ex
+
+    value_range = ("time", start_time, end_time)
+    if start_distance is not None or end_distance is not None:
+        if start_time is not None or end_time is not None:
+            raise ValueError("Invalid range or resolution")
+        value_range = ("distance", start_distance, end_distance)
+
+    if resolution is not None and resolution < 2:
+        raise ValueError("Invalid range or resolution")
+
+    output_format = req.params.get("format", "json")
+    if output_format not in ["json", "encoded"]:
+        raise ValueError("Invalid format")
+
+    return columns, value_range, resolution, output_format
+
+
+def get_number_params(
+    req: func.HttpRequest, names: list[str], number_type: type = float
+) -> list:
+    """Get optional numeric query parameters, raises ValueError when invalid"""
+    values = [req.params.get(name) for name in names]
+    return [None if value is None else number_type(value) for value in values]
+
+
+@bp.route(route="data/aggregates", methods=["GET"])
+def get_aggregates(req: func.HttpRequest) -> func.HttpResponse:
+    """Get the activity totals per day, week, month or year"""
+    logging.info("Getting activity totals")
+
+    bucket_size = req.params.get("bucket", "week")
+    activity_type = req.params.get("type")
+    start_date = req.params.get("startDate")
+    end_date = req.params.get("endDate")
+
+    current_year = datetime.date.today().year
+    try:
+        start_year = int(start_date[:4]) if start_date else current_year
+        end_year = int(end_date[:4]) if end_date else current_year
+    except ValueError:
+        start_year, end_year = current_year, current_year - 1
+
+    if bucket_size not in aggregate_helpers.bucket_sizes() or not (
+        0 <= end_year - start_year <= max_aggregate_years()
+    ):
+        return func.HttpResponse(
+            body='{"result": "Invalid bucket or date range"}',
+            mimetype="application/json",
+            status_code=400,
+        )
+
+    userid = user_helpers.get_user(req)["userId"]
+
+    entries = []
+    for year in range(start_year, end_year + 1):
+        entries += aggregate_helpers.get_year_entries(userid, str(year))
+    entries = filter_by_date(entries, start_date, end_date)
+
+    return http_helpers.json_response(
+        req, aggregate_helpers.sum_buckets(entries, bucket_size, activity_type)
+    )
+
+
+def max_aggregate_years() -> int:
+    """Maximum number of years in a single aggregates request"""
+    return 50
+
+
+def activity_views() -> dict[str, list[str] | None]:
+    """Fields of the predefined activity views, None selects the full document"""
+    return {
+        "detail": None,
+        "summary": [
+            "id",
+            "userId",
+            "name",
+            "type",
+            "sport_type",
+            "start_date",
+            "start_date_local",
+            "distance",
+            "moving_time",
+            "elapsed_time",
+            "total_elevation_gain",
+            "average_speed",
+            "average_heartrate",
+            "hr_trimp",
+            "pace_trimp",
+            "simplified_polyline",
+        ],
+    }
+
+
+def activity_projection(view: str | None, fields: str | None) -> str:
+    """Create the SELECT projection of a view or field list, raises ValueError"""
+    if view and fields:
+        raise ValueError("Use either view or fields")
+    if view and view not in activity_views():
+        raise ValueError("Invalid view")
+
+    selected = fields.split(",") if fields else activity_views().get(view)
+    if selected is None:
+        return "*"
+    if not all(re.fullmatch(r"[A-Za-z_][A-Za-z0-9_]*", field) for field in selected):
+        raise ValueError("Invalid fields")
+
+    # Bracket access, fields such as `value` or `order` are reserved keywords
+    return ", ".join(
+        ["c.id", *[f'c["{field}"]' for field in selected if field != "id"]]
+    )
+
+
+def remove_system_keys(item: dict) -> dict:
+    """Remove the CosmosDB system keys of an item"""
+    for key in ["_rid", "_self", "_etag", "_attachments", "_ts"]:
+        item.pop(key, None)
+    return item
+
+
+def ndjson_response(
+    items: Iterable[dict], continuation_token: str | None = None
+) -> func.HttpResponse:
+    """Create a newline delimited JSON response, serializing one item at a time"""
+    body = io.BytesIO()
+    for item in items:
+        body.write(http_helpers.dumps(item))
+        body.write(b"\n")
+
+    headers = {}
+    if continuation_token:
+        headers["x-continuation-token"] = continuation_token
+    return func.HttpResponse(
+        body=body.getvalue(),
+        mimetype="application/x-ndjson",
+        status_code=200,
+        headers=headers,
+    )
+
+
+def filter_by_date(
+    entries: list[dict], start_date: str | None, end_date: str | None
+) -> list[dict]:
+    """Filter daily entries on an optional start and end date"""
+    if start_date:
+        entries = [entry for entry in entries if entry["date"] >= start_date[:10]]
+    if end_date:
+        entries = [entry for entry in entries if entry["date"] <= end_date[:10]]
+    return entries
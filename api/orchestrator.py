@@ -3,12 +3,18 @@
 import contextlib
 import json
 import logging
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
 import azure.durable_functions as df
 import azure.functions as func
 
-from shared_code import aio_helper, user_helpers
+from shared_code import (
+    aio_helper,
+    http_helpers,
+    orchestration_index,
+    response_cache,
+    user_helpers,
+)
 
 bp = df.Blueprint()
 
@@ -31,6 +37,8 @@ async def orchestrator_start(
     userid = user_helpers.get_user(req)["userId"]
 
     instance_id = await client.start_new(function_name, None, [userid])
+    orchestration_index.add_instance(userid, instance_id)
+    response_cache.invalidate_user(userid)
 
     logging.info("Started orchestration with ID = '%s'.", instance_id)
 
@@ -46,9 +54,7 @@ async def orchestrator_terminate(
     instance_id = req.params.get("instanceId", None)
 
     if not instance_id:
-        return func.HttpResponse(
-            json.dumps({"error": "Missing instanceId"}), status_code=400
-        )
+        return http_helpers.json_response(req, {"error": "Missing instanceId"}, 400)
 
     userid = user_helpers.get_user(req)["userId"]
     logging.info(f"Terminating orchestration with ID {instance_id}")
@@ -57,38 +63,27 @@ async def orchestrator_terminate(
     try:
         status = status.to_json()
     except AttributeError:
-        return func.HttpResponse(
-            json.dumps({"status": "Instance not found"}),
-            status_code=404,
-            mimetype="application/json",
-        )
+        return http_helpers.json_response(req, {"status": "Instance not found"}, 404)
 
-    if userid not in status.get("input", ""):
-        return func.HttpResponse(
-            json.dumps({"status": "Not authorized to terminate this instance"}),
-            status_code=401,
-            mimetype="application/json",
+    if not is_authorized(userid, instance_id, status):
+        return http_helpers.json_response(
+            req, {"status": "Not authorized to terminate this instance"}, 401
         )
 
     if status["runtimeStatus"] in ["Completed", "Failed", "Terminated"]:
-        return func.HttpResponse(
-            json.dumps({"status": "Instance already terminated"}),
-            status_code=200,
-            mimetype="application/json",
+        return http_helpers.json_response(
+            req, {"status": "Instance already terminated"}
         )
 
     try:
         await client.terminate(instance_id, "Killed by user")
     except Exception:
-        return func.HttpResponse(
-            json.dumps({"status": "Error terminating instance"}),
-            status_code=500,
-            mimetype="application/json",
+        return http_helpers.json_response(
+            req, {"status": "Error terminating instance"}, 500
         )
-    return func.HttpResponse(
-        json.dumps({"status": "Termination request send to instance"}),
-        status_code=200,
-        mimetype="application/json",
+    response_cache.invalidate_user(userid)
+    return http_helpers.json_response(
+        req, {"status": "Termination request send to instance"}
     )
 
 
@@ -101,9 +96,7 @@ async def orchestrator_purge(
     instance_id = req.params.get("instanceId", None)
 
     if not instance_id:
-        return func.HttpResponse(
-            json.dumps({"error": "Missing instanceId"}), status_code=400
-        )
+        return http_helpers.json_response(req, {"error": "Missing instanceId"}, 400)
 
     userid = user_helpers.get_user(req)["userId"]
 
@@ -113,37 +106,25 @@ async def orchestrator_purge(
     try:
         status = status.to_json()
     except AttributeError:
-        return func.HttpResponse(
-            json.dumps({"status": "Instance not found"}),
-            status_code=404,
-            mimetype="application/json",
-        )
+        return http_helpers.json_response(req, {"status": "Instance not found"}, 404)
 
-    if userid not in status.get("input", ""):
-        return func.HttpResponse(
-            json.dumps({"status": "Not authorized to purge this instance"}),
-            status_code=401,
-            mimetype="application/json",
+    if not is_authorized(userid, instance_id, status):
+        return http_helpers.json_response(
+            req, {"status": "Not authorized to purge this instance"}, 401
         )
 
     try:
         status = await client.purge_instance_history(instance_id)
     except Exception:
-        return func.HttpResponse(
-            json.dumps({"status": "Error purging instance"}),
-            status_code=500,
-            mimetype="application/json",
+        return http_helpers.json_response(
+            req, {"status": "Error purging instance"}, 500
         )
+    response_cache.invalidate_user(userid)
     if status.instances_deleted > 0:
-        return func.HttpResponse(
-            json.dumps({"status": "Instance purged"}),
-            status_code=200,
-            mimetype="application/json",
-        )
-    return func.HttpResponse(
-        json.dumps({"status": "Instance could not be purged"}),
-        status_code=500,
-        mimetype="application/json",
+        orchestration_index.remove_instance(userid, instance_id)
+        return http_helpers.json_response(req, {"status": "Instance purged"})
+    return http_helpers.json_response(
+        req, {"status": "Instance could not be purged"}, 500
     )
 
 
@@ -155,29 +136,62 @@ async def orchestrator_list(
     """List all orchestrations"""
     logging.info("Getting all orchestrations")
 
-    output = []
     days = req.params.get("days", None)
-    end_date = datetime.today()
 
     if not days:
-        return func.HttpResponse(json.dumps({"error": "Missing days"}), status_code=400)
+        return http_helpers.json_response(req, {"error": "Missing days"}, 400)
 
     userid = user_helpers.get_user(req)["userId"]
 
+    generation = response_cache.user_generation(userid)
+    cached = response_cache.get_response(userid, "orchestrator/list", {"days": days})
+    if cached:
+        return http_helpers.compress_response(req, cached)
+
+    now = datetime.now(timezone.utc)
+    cutoff = now - timedelta(days=int(days))
+    index = orchestration_index.get_index(userid)
+
+    # Instances in the index, only the unfinished ones are looked up
+    indexed = [
+        instance
+        for instance in (index or {}).get("instances", {}).values()
+        if instance["createdTime"] >= orchestration_index.format_time(cutoff)
+    ]
+    refreshed = await aio_helper.gather_with_concurrency(
+        10, *[refresh_instance(instance, client) for instance in indexed]
+    )
+    finished = [
+        new
+        for old, new in zip(indexed, refreshed)
+        if new != old
+        and new["runtimeStatus"] in orchestration_index.terminal_statuses()
+    ]
+    if finished:
+        orchestration_index.set_instances(userid, finished)
+
+    # Instances started before the index existed are found by scanning the task hub
     tasks = []
-    for i in range(int(days)):
-        start_date = end_date - timedelta(days=i + 1)
-        end_date = end_date - timedelta(days=i)
+    end_date = orchestration_index.parse_time(index["since"]) if index else now
+    while end_date > cutoff:
+        start_date = max(end_date - timedelta(days=1), cutoff)
         tasks.append(get_orchestrations(start_date, end_date, client, userid))
+        end_date = start_date
+    scanned = await aio_helper.gather_with_concurrency(10, *tasks)
 
-    output = await aio_helper.gather_with_concurrency(10, *tasks)
-    output = [item for sublist in output for item in sublist]
-
-    output.sort(key=lambda x: x["createdTime"], reverse=True)
+    instances = {instance["instanceId"]: instance for instance in refreshed}
+    for sublist in scanned:
+        for instance in sublist:
+            instances.setdefault(instance["instanceId"], instance)
+    output = sorted(instances.values(), key=lambda x: x["createdTime"], reverse=True)
 
-    return func.HttpResponse(
-        json.dumps(output), status_code=200, mimetype="application/json"
+    response = func.HttpResponse(
+        body=http_helpers.dumps(output), status_code=200, mimetype="application/json"
     )
+    response_cache.set_response(
+        userid, "orchestrator/list", {"days": days}, response, generation
+    )
+    return http_helpers.compress_response(req, response)
 
 
 async def get_orchestrations(
@@ -194,18 +208,38 @@ async def get_orchestrations(
     for instance in instances:
         instance = instance.to_json()
         if instance["name"] == "orch_gather_data" and userid in instance["input"]:
-            instance["createdTime"] = instance["createdTime"].replace("T", " ")
-            instance["lastUpdatedTime"] = instance["lastUpdatedTime"].replace("T", " ")
-            instance["createdTime"] = instance["createdTime"].replace(".000000Z", "")
-            instance["lastUpdatedTime"] = instance["lastUpdatedTime"].replace(
-                ".000000Z", ""
-            )
-            instance.pop("customStatus", None)
-            instance.pop("history", None)
-            instance.pop("name", None)
-            instance.pop("input", None)
-            output.append(instance)
-            with contextlib.suppress(Exception):
-                instance["output"] = json.loads(instance["output"])
+            output.append(format_instance(instance))
 
     return output
+
+
+def format_instance(instance: dict) -> dict:
+    """Format the status of an instance for orchestrator/list"""
+    instance = dict(instance)
+    for key in ["createdTime", "lastUpdatedTime"]:
+        instance[key] = instance[key].replace("T", " ").replace(".000000Z", "")
+    for key in ["customStatus", "history", "name", "input"]:
+        instance.pop(key, None)
+    with contextlib.suppress(Exception):
+        instance["output"] = json.loads(instance["output"])
+    return instance
+
+
+async def refresh_instance(
+    instance: dict, client: df.DurableOrchestrationClient
+) -> dict:
+    """Get the current status of an indexed instance that may still change"""
+    if instance["runtimeStatus"] in orchestration_index.terminal_statuses():
+        return instance
+
+    status = await client.get_status(instance["instanceId"])
+    try:
+        return format_instance(status.to_json())
+    except (AttributeError, KeyError):
+        return instance
+
+
+def is_authorized(userid: str, instance_id: str, status: dict) -> bool:
+    """Check if an instance belongs to a user"""
+    index = orchestration_index.get_index(userid) or {"instances": {}}
+    return instance_id in index["instances"] or userid in status.get("input", "")
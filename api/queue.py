@@ -1,12 +1,17 @@
 """"Queue api"""
 
 
-import json
 import logging
 
 import azure.functions as func
 
-from shared_code import cosmosdb_module, queue_helpers, user_helpers
+from shared_code import (
+    calculators,
+    cosmosdb_module,
+    http_helpers,
+    queue_helpers,
+    user_helpers,
+)
 
 bp = func.Blueprint()
 
@@ -37,6 +42,10 @@ def queue_activities(req: func.HttpRequest) -> func.HttpResponse:
     userid = user_helpers.get_user(req)["userId"]
 
     query = "SELECT * FROM c WHERE c.userId = @userid"
+    parameters = [
+        {"name": "@userid", "value": userid},
+        {"name": "@activityId", "value": activity_id},
+    ]
     if activity_id:
         query += " AND c.id = @activityId"
     if not overwrite:
@@ -44,14 +53,12 @@ def queue_activities(req: func.HttpRequest) -> func.HttpResponse:
             case "enrichment-queue":
                 query += " AND c.full_data = false"
             case "calculate-fields-queue":
-                query += (
-                    " AND c.full_data = true AND c.custom_fields_calculated = false"
-                )
-
-    parameters = [
-        {"name": "@userid", "value": userid},
-        {"name": "@activityId", "value": activity_id},
-    ]
+                (
+                    outdated_filter,
+                    outdated_parameters,
+                ) = calculators.outdated_calculations_filter()
+                query += f" AND c.full_data = true AND {outdated_filter}"
+                parameters += outdated_parameters
 
     container = cosmosdb_module.cosmosdb_container("activities")
     activities = list(
@@ -62,10 +69,12 @@ def queue_activities(req: func.HttpRequest) -> func.HttpResponse:
         )
     )
 
+    if queue_name == "calculate-fields-queue" and not overwrite:
+        for activity in activities:
+            activity["calculators"] = calculators.get_outdated_calculators(activity)
+
     queue_helpers.add_activity_to_enrichment_queue(activities, queue_name)
 
     result = {"queued": len(activities)}
 
-    return func.HttpResponse(
-        body=json.dumps(result), mimetype="application/json", status_code=200
-    )
+    return http_helpers.json_response(req, result)
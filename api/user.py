@@ -4,7 +4,13 @@ import logging
 
 import azure.functions as func
 
-from shared_code import cosmosdb_module, schemas, user_helpers, utils
+from shared_code import (
+    cosmosdb_module,
+    http_helpers,
+    response_cache,
+    user_helpers,
+    utils,
+)
 
 bp = func.Blueprint()
 
@@ -16,6 +22,13 @@ def get_user(req: func.HttpRequest) -> func.HttpResponse:
 
     userid = user_helpers.get_user(req)["userId"]
 
+    generation = response_cache.user_generation(userid)
+    cached = response_cache.get_response(userid, "user", {})
+    if cached:
+        if http_helpers.etag_matches(req, cached.headers.get("ETag", "")):
+            return http_helpers.not_modified_response(dict(cached.headers))
+        return http_helpers.compress_response(req, cached)
+
     container = cosmosdb_module.cosmosdb_container("users")
     result = list(
         container.query_items(
@@ -34,6 +47,12 @@ def get_user(req: func.HttpRequest) -> func.HttpResponse:
             status_code=400,
         )
 
+    headers = http_helpers.cache_headers(
+        http_helpers.create_etag(result[0]["_etag"]), result[0]["_ts"]
+    )
+    if http_helpers.etag_matches(req, headers["ETag"]):
+        return http_helpers.not_modified_response(headers)
+
     keys_to_pop = [
         "_rid",
         "_self",
@@ -45,9 +64,14 @@ def get_user(req: func.HttpRequest) -> func.HttpResponse:
     for key in keys_to_pop:
         result[0].pop(key)
 
-    return func.HttpResponse(
-        body=json.dumps(result[0]), mimetype="application/json", status_code=200
+    response = func.HttpResponse(
+        body=http_helpers.dumps(result[0]),
+        mimetype="application/json",
+        status_code=200,
+        headers=headers,
     )
+    response_cache.set_response(userid, "user", {}, response, generation)
+    return http_helpers.compress_response(req, response)
 
 
 @bp.route(route="user", methods=["POST"])
@@ -63,14 +87,17 @@ async def post_user(req: func.HttpRequest) -> func.HttpResponse:
             status_code=400,
         )
 
-    if utils.validate_json(data, schemas.user_data()):
-        return utils.validate_json(data, schemas.user_data())
+    invalid_response = utils.validate_json(data, "user_data")
+    if invalid_response:
+        return invalid_response
 
     userid = user_helpers.get_user(req)["userId"]
     data["id"] = userid
 
     container = cosmosdb_module.cosmosdb_container("users")
     container.upsert_item(data)
+    user_helpers.invalidate_user_settings(userid)
+    response_cache.invalidate_user(userid)
 
     return func.HttpResponse(
         body='{"result": "done"}',
@@ -1,13 +1,22 @@
 """Calculate custom fields for activities"""
 
-import bisect
 import logging
-from functools import partial
-from statistics import mean
 
 import azure.functions as func
 
-from shared_code import cosmosdb_module, queue_helpers, trimp_helpers, user_helpers
+from shared_code import (
+    aggregate_helpers,
+    calculators,
+    cosmosdb_module,
+    curve_helpers,
+    fitness_helpers,
+    queue_helpers,
+    response_cache,
+    stream_cache,
+    stream_store,
+    user_helpers,
+    vo2max_helpers,
+)
 
 bp = func.Blueprint()
 
@@ -24,7 +33,8 @@ def calculate_fields(
     """Calculate custom fields"""
     msg = queue.get_json()
     activity_id, user_id = msg["activity_id"], msg["user_id"]
-    logging.info(f"Calculating values for {activity_id} and user {user_id}")
+    calculator_names = calculators.resolve_calculators(msg.get("calculators"))
+    logging.info(f"Calculating {calculator_names} for {activity_id} and user {user_id}")
 
     # Get user settings
     user_settings = user_helpers.get_user_settings(user_id)
@@ -35,100 +45,69 @@ def calculate_fields(
         {"name": "@user_id", "value": user_id},
     ]
     query = "SELECT * FROM c WHERE c.id = @activity_id AND c.userId = @user_id"
-    activity = cosmosdb_module.get_cosmosdb_items(query, parameters, "activities")
-    stream = cosmosdb_module.get_cosmosdb_items(query, parameters, "streams")
+    activity = cosmosdb_module.get_cosmosdb_items(
+        query, parameters, "activities", ["_rid", "_self", "_attachments", "_ts"]
+    )
+    stream = {}
+    columns = calculators.get_stream_columns(calculator_names)
+    if columns:
+        # Prefer the cleaned 1 Hz streams, activities enriched before they were
+        # stored only have the raw streams and cleaned streams stored before a
+        # calculator was added miss its columns
+        stream = stream_cache.read_streams(
+            stream_store.clean_document_id(activity_id), user_id, columns
+        )
+        if stream is None or not set(columns) <= set(stream):
+            stream = stream_cache.read_streams(activity_id, user_id, columns)
 
-    if not activity or not stream:
+    if not activity or stream is None:
         logging.error(
             f"No activity or stream found with id {activity_id} and user {user_id}"
         )
         return
 
     # Calculate custom fields
-    activity = calculate_custom_fields(activity[0], stream[0], user_settings)
-
-    # Update activity
-    container = cosmosdb_module.cosmosdb_container("activities")
-    cosmosdb_module.container_function_with_back_off(
-        partial(
-            container.upsert_item,
-            activity,
-        )
+    activity = calculate_custom_fields(
+        activity[0], stream, user_settings, calculator_names
     )
 
+    # Update only the calculated fields, a concurrent change of the activity fails
+    # the patch and the message is retried on the fresh activity
+    fields = calculators.get_activity_fields(calculator_names)
+    fields += ["calculation_versions", "custom_fields_calculated"]
+    cosmosdb_module.patch_cosmosdb_item(
+        activity["id"],
+        "activities",
+        cosmosdb_module.create_set_operations(
+            {field: activity.get(field) for field in fields}
+        ),
+        activity.pop("_etag"),
+    )
 
-def calculate_custom_fields(activity: dict, stream: dict, user_settings: dict) -> dict:
+    # Update materialized user metrics
+    if {"hr_trimp", "pace_trimp"}.intersection(calculator_names):
+        fitness_helpers.update_fitness(activity, user_settings)
+        aggregate_helpers.update_aggregates(activity)
+    if "vo2max_estimate" in calculator_names:
+        vo2max_helpers.update_vo2max(activity)
+    if "mean_max_curves" in calculator_names:
+        curve_helpers.update_curves(activity)
+    response_cache.invalidate_user(user_id)
+
+
+def calculate_custom_fields(
+    activity: dict,
+    stream: dict,
+    user_settings: dict,
+    calculator_names: list[str] | None = None,
+) -> dict:
     """Calculate custom fields"""
-    # Calculate Reserves
-    total_time = 0
-    if activity["has_heartrate"]:
-        for lap in activity["laps"]:
-            start_time = total_time
-            elapsed_time = lap["elapsed_time"]
-            total_time += elapsed_time
-            lap["start_index"] = bisect.bisect_left(stream["time"]["data"], start_time)
-            lap["end_index"] = bisect.bisect_left(stream["time"]["data"], total_time)
-            heart_rate_data = stream["heartrate"]["data"][
-                lap["start_index"] : lap["end_index"]
-            ]
-            lap["average_heartrate"] = mean(heart_rate_data)
-            lap["hr_reserve"] = trimp_helpers.calculate_hr_reserve(
-                lap["average_heartrate"],
-                user_settings["heart_rate"]["resting"],
-                user_settings["heart_rate"]["max"],
-            )
-
-        activity["hr_reserve"] = trimp_helpers.calculate_hr_reserve(
-            activity["average_heartrate"],
-            user_settings["heart_rate"]["resting"],
-            user_settings["heart_rate"]["max"],
-        )
+    if calculator_names is None:
+        calculator_names = calculators.resolve_calculators()
 
-    if activity["type"] == "Run":
-        for lap in activity["laps"]:
-            lap["pace_reserve"] = trimp_helpers.calculate_pace_reserve(
-                lap["average_speed"],
-                user_settings["pace"]["threshold"],
-            )
-
-        activity["pace_reserve"] = trimp_helpers.calculate_pace_reserve(
-            activity["average_speed"],
-            user_settings["pace"]["threshold"],
-        )
-
-    # Calculate TRIMP
-    if activity["has_heartrate"]:
-        for lap in activity["laps"]:
-            lap["hr_trimp"] = trimp_helpers.calculate_hr_trimp(
-                lap["moving_time"],
-                lap["hr_reserve"],
-                user_settings["gender"],
-                True,
-            )
-        activity["hr_trimp"] = sum([lap["hr_trimp"] for lap in activity["laps"]])
-
-    if activity["type"] == "Run":
-        for lap in activity["laps"]:
-            lap["pace_trimp"] = trimp_helpers.calculate_pace_trimp(
-                lap["moving_time"],
-                lap["pace_reserve"],
-                user_settings["gender"],
-                True,
-            )
-        activity["pace_trimp"] = sum([lap["pace_trimp"] for lap in activity["laps"]])
-
-    # Calculate VO2Max
-    if activity["has_heartrate"]:
-        activity["hr_max_percentage"] = trimp_helpers.calculate_hr_max_percentage(
-            activity["average_heartrate"],
-            user_settings["heart_rate"]["max"],
-        )
-        activity["vo2max_estimate"] = trimp_helpers.calculate_vo2max_estimate(
-            activity["distance"],
-            activity["moving_time"],
-            activity["hr_max_percentage"],
-            True,
-        )
+    activity = calculators.run_calculators(
+        activity, stream, user_settings, calculator_names
+    )
 
     # Set activity as calculated
     activity["custom_fields_calculated"] = True
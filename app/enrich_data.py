@@ -6,9 +6,19 @@ import time
 from functools import partial
 
 import azure.functions as func
-from stravalib.exc import ObjectNotFound, RateLimitExceeded
 
-from shared_code import cosmosdb_module, queue_helpers, strava_helpers, user_helpers
+from shared_code import (
+    aggregate_helpers,
+    calculators,
+    cosmosdb_module,
+    queue_helpers,
+    response_cache,
+    strava_helpers,
+    stream_cache,
+    stream_helpers,
+    stream_store,
+    user_helpers,
+)
 
 bp = func.Blueprint()
 
@@ -21,6 +31,8 @@ def enrich_activity(
     queue: func.QueueMessage,
 ) -> None:
     """Enrich activity function"""
+    from stravalib.exc import ObjectNotFound, RateLimitExceeded
+
     # Get message
     msg = queue.get_json()
     activity_id, user_id = msg["activity_id"], msg["user_id"]
@@ -62,11 +74,9 @@ def enrich_activity(
         handle_rate_limit_exceeded()
 
     # Cleanup activity and streams data
-    for key, value in streams.items():
-        streams[key] = value.dict()
-    streams["id"] = activity_id
-    streams["userId"] = user_id
+    streams = {key: value.dict() for key, value in streams.items()}
     activity = strava_helpers.cleanup_activity(activity, user_id, True, False)
+    activity["simplified_polyline"] = stream_helpers.simplified_polyline(streams)
 
     # Add activity and streams data to cosmosdb6
     container = cosmosdb_module.cosmosdb_container("activities")
@@ -76,13 +86,17 @@ def enrich_activity(
             activity,
         )
     )
-    container = cosmosdb_module.cosmosdb_container("streams")
-    cosmosdb_module.container_function_with_back_off(
-        partial(
-            container.upsert_item,
-            streams,
-        )
+    aggregate_helpers.update_aggregates(activity)
+    stream_store.write_streams(activity_id, user_id, streams)
+    stream_store.write_streams(
+        stream_store.clean_document_id(activity_id),
+        user_id,
+        stream_helpers.clean_streams(clean_stream_selection(streams)),
+        levels=False,
     )
+    stream_cache.invalidate(activity_id)
+    stream_cache.invalidate(stream_store.clean_document_id(activity_id))
+    response_cache.invalidate_user(user_id)
 
     # Add activity to calculate_fields queue
     queue_helpers.add_activity_to_enrichment_queue([activity], "calculate-fields-queue")
@@ -101,6 +115,12 @@ def enrich_activity_poison_queue(
     queue_helpers.handle_poison_message(queue, "enrichment-queue")
 
 
+def clean_stream_selection(streams: dict) -> dict:
+    """Select the streams the calculators read, only those are stored cleaned"""
+    columns = calculators.get_stream_columns(calculators.resolve_calculators())
+    return {name: stream for name, stream in streams.items() if name in columns}
+
+
 def handle_rate_limit_exceeded():
     """Handle rate limit exceeded"""
 
@@ -4,7 +4,14 @@ import logging
 
 import azure.durable_functions as df
 
-from shared_code import cosmosdb_module, queue_helpers, strava_helpers, user_helpers
+from shared_code import (
+    cosmosdb_module,
+    orchestration_index,
+    queue_helpers,
+    response_cache,
+    strava_helpers,
+    user_helpers,
+)
 
 bp = df.Blueprint()
 
@@ -48,7 +55,13 @@ def orch_gather_data(context: df.DurableOrchestrationContext):
         "add_activity_to_enrichment_queue", [activities, "enrichment-queue"]
     )
 
-    return {"status": "success", "ActivitiesAdded": len(activities)}
+    # step 5: record the result in the orchestration index of the user
+    result = {"status": "success", "ActivitiesAdded": len(activities)}
+    yield context.call_activity(
+        "complete_orchestration", [userid, context.instance_id, result]
+    )
+
+    return result
 
 
 @bp.activity_trigger(input_name="payload")
@@ -124,3 +137,15 @@ def add_activity_to_enrichment_queue(payload: str) -> dict:
     status = queue_helpers.add_activity_to_enrichment_queue(activities, queue_name)
 
     return status
+
+
+@bp.activity_trigger(input_name="payload")
+def complete_orchestration(payload: str) -> dict:
+    """Mark an orchestration as completed in the orchestration index"""
+
+    userid, instance_id, result = payload
+
+    orchestration_index.complete_instance(userid, instance_id, result)
+    response_cache.invalidate_user(userid)
+
+    return {"status": "Done"}
@@ -5,7 +5,7 @@ from functools import partial
 
 import azure.durable_functions as df
 
-from shared_code import aio_helper, cosmosdb_module
+from shared_code import aio_helper, cosmosdb_module, response_cache
 
 bp = df.Blueprint()
 
@@ -53,5 +53,7 @@ async def output_to_cosmosdb(payload: str) -> str:
         )
 
     await aio_helper.gather_with_concurrency(50, *tasks)
+    for user_id in {item["userId"] for item in items if "userId" in item}:
+        response_cache.invalidate_user(user_id)
 
     return '{"status": "Done"}'
@@ -1,8 +1,18 @@
 """Module contains all the timer functions for the application"""
 
+import datetime
+import logging
+
 import azure.functions as func
 
-from shared_code import cosmosdb_module, queue_helpers
+from shared_code import (
+    calculators,
+    cosmosdb_module,
+    get_config,
+    queue_helpers,
+    response_cache,
+    stream_store,
+)
 
 bp = func.Blueprint()
 
@@ -23,11 +33,60 @@ def enqueue_non_enriched_activities(timer: func.TimerRequest) -> None:
 @bp.timer_trigger(
     schedule="0 0 0 * * *", arg_name="timer", run_on_startup=False, use_monitor=False
 )
-def enqueue_non_calculated_activities(timer: func.TimerRequest) -> None:
-    """Will add any none enriched activities to the enrichment queue"""
+def enqueue_outdated_activities(timer: func.TimerRequest) -> None:
+    """Will add any activities with outdated custom fields to the calculate queue"""
+    outdated_filter, parameters = calculators.outdated_calculations_filter()
+    query = (
+        "SELECT c.id, c.userId, c.calculation_versions FROM c WHERE c.full_data = true"
+    )
+    query += f" AND {outdated_filter}"
+    container = cosmosdb_module.cosmosdb_container("activities")
+    activities = container.query_items(
+        query=query,
+        parameters=parameters,
+        enable_cross_partition_query=True,
+    )
+    queue_helpers.add_activity_to_enrichment_queue(
+        (
+            {**activity, "calculators": calculators.get_outdated_calculators(activity)}
+            for activity in activities
+        ),
+        "calculate-fields-queue",
+    )
+
+
+@bp.timer_trigger(
+    schedule="0 0 2 * * *", arg_name="timer", run_on_startup=False, use_monitor=False
+)
+def archive_old_streams(timer: func.TimerRequest) -> None:
+    """Will move the streams of old activities to the archive"""
+    settings = get_config.get_stream_archive()
+    if not settings["directory"]:
+        logging.info("Stream archive is not configured, skipping")
+        return
+
+    cutoff = datetime.datetime.now(datetime.timezone.utc) - datetime.timedelta(
+        days=settings["age_days"]
+    )
     container = cosmosdb_module.cosmosdb_container("activities")
     activities = container.query_items(
-        query="SELECT * FROM c WHERE c.custom_fields_calculated = false AND c.full_data = true",
+        query="SELECT c.id, c.userId FROM c WHERE c.full_data = true"
+        " AND c.start_date < @cutoff"
+        " AND (NOT IS_DEFINED(c.streams_archived) OR c.streams_archived = false)",
+        parameters=[
+            {"name": "@cutoff", "value": cutoff.strftime("%Y-%m-%dT%H:%M:%SZ")}
+        ],
         enable_cross_partition_query=True,
     )
-    queue_helpers.add_activity_to_enrichment_queue(activities, "calculate-fields-queue")
+
+    archived = 0
+    for activity in activities:
+        if stream_store.archive_streams(activity["id"], activity["userId"]):
+            cosmosdb_module.patch_cosmosdb_item(
+                activity["id"],
+                "activities",
+                cosmosdb_module.create_set_operations({"streams_archived": True}),
+            )
+            response_cache.invalidate_user(activity["userId"])
+            archived += 1
+    logging.info(f"Archived the streams of {archived} activities")
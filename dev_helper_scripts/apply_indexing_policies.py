@@ -0,0 +1,73 @@
+"""Apply the indexing policies to existing containers and create missing ones."""
+
+import logging
+import os
+import sys
+
+from azure.cosmos import PartitionKey, exceptions
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(SCRIPT_DIR))
+
+from shared_code import cosmosdb_containers, cosmosdb_module  # noqa: E402
+
+
+def normalized_paths(policy: dict) -> dict:
+    """
+    Get the paths of an indexing policy without the defaults CosmosDB adds.
+
+    The policy read from CosmosDB includes the index kinds of every included path,
+    so only the paths and the composite index orders are compared.
+    """
+    return {
+        "includedPaths": sorted(
+            path["path"] for path in policy.get("includedPaths", [])
+        ),
+        "excludedPaths": sorted(
+            path["path"] for path in policy.get("excludedPaths", [])
+        ),
+        "compositeIndexes": sorted(
+            [(path["path"], path.get("order", "ascending")) for path in composite_index]
+            for composite_index in policy.get("compositeIndexes", [])
+        ),
+    }
+
+
+def main():
+    """Apply the indexing policies to existing containers and create missing ones."""
+    cosmosdb_database = cosmosdb_module.cosmosdb_database()
+    for container in cosmosdb_containers.container_definitions():
+        try:
+            current_policy = (
+                cosmosdb_database.get_container_client(container["name"])
+                .read()
+                .get("indexingPolicy", {})
+            )
+        except exceptions.CosmosResourceNotFoundError:
+            logging.info(f"Creating container {container['name']}")
+            cosmosdb_database.create_container(
+                id=container["name"],
+                partition_key=PartitionKey(path=container["partition_key"]),
+                indexing_policy=container["indexing_policy"],
+            )
+            continue
+
+        if normalized_paths(current_policy) == normalized_paths(
+            container["indexing_policy"]
+        ):
+            logging.info(f"Indexing policy of {container['name']} is up to date")
+            continue
+
+        # The container stays available, Cosmos rebuilds the index in the background
+        logging.info(f"Replacing indexing policy of {container['name']}")
+        cosmosdb_database.replace_container(
+            container["name"],
+            partition_key=PartitionKey(path=container["partition_key"]),
+            indexing_policy=container["indexing_policy"],
+        )
+
+    logging.info("Done")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""Profile the import time of the function app."""
+
+import argparse
+import os
+import subprocess
+import sys
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+PROJECT_DIR = os.path.dirname(SCRIPT_DIR)
+
+
+def lazy_modules() -> list[str]:
+    """Modules that must not be imported when the function app starts"""
+    return ["stravalib", "jsonschema", "azure.storage.queue"]
+
+
+def profile_imports(module: str) -> list[dict]:
+    """Import a module in a new interpreter with -X importtime"""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],  # noqa: S603
+        cwd=PROJECT_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+
+    imports = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        self_us, cumulative_us, name = line.removeprefix("import time:").split("|")
+        if not self_us.strip().isdigit():
+            continue
+        imports.append(
+            {
+                "name": name.strip(),
+                "depth": (len(name) - len(name.lstrip())) // 2,
+                "self_ms": int(self_us) / 1000,
+                "cumulative_ms": int(cumulative_us) / 1000,
+            }
+        )
+    return imports
+
+
+def main():
+    """Print the slowest imports and check the total against a budget."""
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--module", default="function_app")
+    parser.add_argument("--top", type=int, default=20)
+    parser.add_argument(
+        "--max-ms", type=float, help="Fail when the import takes longer than this"
+    )
+    args = parser.parse_args()
+
+    imports = profile_imports(args.module)
+    total = next(
+        (item["cumulative_ms"] for item in imports if item["name"] == args.module), 0
+    )
+    loaded = {item["name"] for item in imports}
+
+    print(f"{args.module}: {total:.1f} ms")  # noqa: T201
+    print(f"{'cumulative ms':>14} {'self ms':>9}  module")  # noqa: T201
+    for item in sorted(imports, key=lambda item: -item["cumulative_ms"])[: args.top]:
+        print(  # noqa: T201
+            f"{item['cumulative_ms']:>14.1f} {item['self_ms']:>9.1f}  {item['name']}"
+        )
+
+    eager = [module for module in lazy_modules() if module in loaded]
+    if eager:
+        print(f"Imported at startup: {', '.join(eager)}")  # noqa: T201
+    if eager or (args.max_ms and total > args.max_ms):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -9,7 +9,7 @@ from azure.cosmos import PartitionKey
 SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
 sys.path.append(os.path.dirname(SCRIPT_DIR))
 
-from shared_code import cosmosdb_module  # noqa: E402
+from shared_code import cosmosdb_containers, cosmosdb_module  # noqa: E402
 
 
 def main():
@@ -18,28 +18,7 @@ def main():
     delete_critical_containers_user_input = input(
         "Do you want to delete critical containers? (default is False) [y/N]: "
     ).lower()
-    containers = [
-        {
-            "name": "activities",
-            "partition_key": "/id",
-            "critical": False,
-        },
-        {
-            "name": "streams",
-            "partition_key": "/id",
-            "critical": False,
-        },
-        {
-            "name": "users",
-            "partition_key": "/id",
-            "critical": True,
-        },
-        {
-            "name": "notifications",
-            "partition_key": "/id",
-            "critical": False,
-        },
-    ]
+    containers = cosmosdb_containers.container_definitions()
 
     if delete_critical_containers_user_input == "y":
         delete_critical_containers = True
@@ -57,6 +36,7 @@ def main():
         cosmosdb_database.create_container(
             id=container["name"],
             partition_key=PartitionKey(path=container["partition_key"]),
+            indexing_policy=container["indexing_policy"],
         )
 
     logging.info("Done")
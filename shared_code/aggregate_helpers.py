@@ -0,0 +1,161 @@
+"""Helper functions for the per-user activity totals"""
+
+from datetime import date, timedelta
+
+from shared_code import cosmosdb_module
+
+
+def aggregate_fields() -> list[str]:
+    """Activity fields that are summed in the totals"""
+    return [
+        "distance",
+        "moving_time",
+        "elapsed_time",
+        "total_elevation_gain",
+        "hr_trimp",
+        "pace_trimp",
+    ]
+
+
+def bucket_sizes() -> list[str]:
+    """Supported bucket sizes"""
+    return ["day", "week", "month", "year"]
+
+
+def aggregates_document_id(user_id: str, year: str) -> str:
+    """Id of the aggregates document of a user and year"""
+    return f"aggregates_{user_id}_{year}"
+
+
+def default_aggregates_document(user_id: str, year: str) -> dict:
+    """Empty aggregates document"""
+    return {
+        "id": aggregates_document_id(user_id, year),
+        "userId": user_id,
+        "type": "aggregates",
+        "year": year,
+        "activities": {},
+    }
+
+
+def update_aggregates_document(document: dict, activity: dict) -> dict:
+    """Set the contribution of an activity, replacing a previous version"""
+    document["activities"][activity["id"]] = {
+        "date": activity["start_date_local"][:10],
+        "type": activity.get("type"),
+        **{field: activity.get(field) or 0 for field in aggregate_fields()},
+    }
+    return document
+
+
+def update_aggregates(activity: dict) -> dict:
+    """
+    Update the aggregates of a user with an activity.
+
+    A new document of a year is seeded with the activities already stored for that
+    year, so it does not only hold the activities updated after it was created.
+    """
+    user_id = activity["userId"]
+    year = activity["start_date_local"][:4]
+
+    return cosmosdb_module.update_cosmosdb_item(
+        aggregates_document_id(user_id, year),
+        "metrics",
+        lambda document: update_aggregates_document(document, activity),
+        lambda: query_year_document(user_id, year),
+    )
+
+
+def get_bucket(day: str, bucket_size: str) -> str:
+    """Get the bucket of a date, weeks start on Monday"""
+    match bucket_size:
+        case "day":
+            return day
+        case "week":
+            current = date.fromisoformat(day)
+            return (current - timedelta(days=current.weekday())).isoformat()
+        case "month":
+            return day[:7]
+        case "year":
+            return day[:4]
+        case _:
+            raise ValueError(f"Unknown bucket size {bucket_size}")
+
+
+def sum_buckets(
+    entries: list[dict],
+    bucket_size: str,
+    activity_type: str | None = None,
+) -> list[dict]:
+    """
+    Sum daily or per-activity entries into buckets.
+
+    Parameters
+    ----------
+    entries : list[dict]
+        Entries with a `date`, `type`, optional `count` and the aggregate fields.
+    bucket_size : str
+        One of `bucket_sizes()`.
+    activity_type : str | None, optional
+        Only sum entries of this activity type (default is None).
+
+    Returns
+    -------
+    list[dict]
+        The totals per bucket, sorted by bucket.
+    """
+    buckets = {}
+    for entry in entries:
+        if activity_type and entry["type"] != activity_type:
+            continue
+        key = get_bucket(entry["date"], bucket_size)
+        bucket = buckets.setdefault(
+            key,
+            {"bucket": key, "count": 0, **{field: 0 for field in aggregate_fields()}},
+        )
+        bucket["count"] += entry.get("count", 1)
+        for field in aggregate_fields():
+            bucket[field] += entry.get(field) or 0
+
+    return [buckets[key] for key in sorted(buckets)]
+
+
+def query_year_document(user_id: str, year: str) -> dict:
+    """Build the aggregates document of a year from the stored activities"""
+    fields = ", ".join(f"c.{field}" for field in aggregate_fields())
+    query = f"SELECT c.id, c.start_date_local, c.type, {fields}"  # noqa: S608
+    query += (
+        " FROM c WHERE c.userId = @userid AND STARTSWITH(c.start_date_local, @year)"
+    )
+    activities = cosmosdb_module.get_cosmosdb_items(
+        query,
+        [
+            {"name": "@userid", "value": user_id},
+            {"name": "@year", "value": year},
+        ],
+        "activities",
+    )
+    document = default_aggregates_document(user_id, year)
+    for activity in activities:
+        update_aggregates_document(document, activity)
+    return document
+
+
+def get_year_entries(user_id: str, year: str) -> list[dict]:
+    """
+    Get the entries of a year from its aggregates document.
+
+    A year without a document is built from the activities and stored, so it is
+    only scanned once.
+    """
+    document = cosmosdb_module.get_cosmosdb_item(
+        aggregates_document_id(user_id, year), "metrics"
+    )
+    if not document:
+        document = cosmosdb_module.update_cosmosdb_item(
+            aggregates_document_id(user_id, year),
+            "metrics",
+            lambda current: current,
+            lambda: query_year_document(user_id, year),
+        )
+    return list(document["activities"].values())
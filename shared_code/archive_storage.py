@@ -0,0 +1,43 @@
+"""Compressed archive of cold documents, a local filesystem stand-in for blob storage"""
+
+import json
+import lzma
+import os
+from pathlib import Path
+
+from shared_code import get_config
+
+
+def archive_directory() -> Path:
+    """Root directory of the archive"""
+    directory = get_config.get_stream_archive()["directory"]
+    if not directory:
+        raise ValueError("STREAM_ARCHIVE_DIRECTORY is not configured")
+    return Path(directory)
+
+
+def archive_key(user_id: str, activity_id: str) -> str:
+    """Key of the archived streams of an activity"""
+    return f"{user_id}/{activity_id}.json.xz"
+
+
+def write_archive(key: str, documents: list[dict]) -> None:
+    """Compress and write documents, replacing an existing archive atomically"""
+    path = archive_directory() / key
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary_path = path.with_name(f"{path.name}.tmp")
+    temporary_path.write_bytes(lzma.compress(json.dumps(documents).encode("utf-8")))
+    os.replace(temporary_path, path)
+
+
+def read_archive(key: str) -> list[dict] | None:
+    """Read archived documents, None when the archive does not exist"""
+    path = archive_directory() / key
+    if not path.exists():
+        return None
+    return json.loads(lzma.decompress(path.read_bytes()))
+
+
+def delete_archive(key: str) -> None:
+    """Delete an archive"""
+    (archive_directory() / key).unlink(missing_ok=True)
@@ -0,0 +1,83 @@
+"""Process local caches"""
+
+from collections import OrderedDict
+from typing import Callable
+
+
+class LRUCache:
+    """
+    Least recently used cache bounded by the total size of its values.
+
+    Parameters
+    ----------
+    max_size : int
+        The maximum total size of the cached values.
+    size_function : Callable[[object], int], optional
+        Get the size of a value, every value counts as 1 by default.
+    on_evict : Callable[[object, object], None] | None, optional
+        Called with the key and value of every evicted entry (default is None).
+    """
+
+    def __init__(
+        self,
+        max_size: int,
+        size_function: Callable[[object], int] = lambda _: 1,
+        on_evict: Callable[[object, object], None] | None = None,
+    ):
+        """Create an empty cache"""
+        self.max_size = max_size
+        self.size_function = size_function
+        self.on_evict = on_evict
+        self.size = 0
+        self._entries = OrderedDict()
+
+    def __contains__(self, key: object) -> bool:
+        """Check if a key is cached without marking it as used"""
+        return key in self._entries
+
+    def __len__(self) -> int:
+        """Number of cached values"""
+        return len(self._entries)
+
+    def get(self, key: object, default: object = None) -> object:
+        """Get a value and mark it as most recently used"""
+        if key not in self._entries:
+            return default
+        self._entries.move_to_end(key)
+        return self._entries[key][0]
+
+    def set(self, key: object, value: object) -> None:
+        """Add or replace a value, evicting the least recently used values"""
+        self.pop(key)
+        size = self.size_function(value)
+        if size > self.max_size:
+            if self.on_evict:
+                self.on_evict(key, value)
+            return
+
+        self._entries[key] = (value, size)
+        self.size += size
+        while self.size > self.max_size:
+            evicted_key, (evicted_value, evicted_size) = self._entries.popitem(
+                last=False
+            )
+            self.size -= evicted_size
+            if self.on_evict:
+                self.on_evict(evicted_key, evicted_value)
+
+    def values(self) -> list:
+        """Get the cached values from least to most recently used"""
+        return [value for value, _ in self._entries.values()]
+
+    def pop(self, key: object, default: object = None) -> object:
+        """Remove a value without calling `on_evict`"""
+        if key not in self._entries:
+            return default
+        value, size = self._entries.pop(key)
+        self.size -= size
+        return value
+
+    def clear(self) -> None:
+        """Remove all values without calling `on_evict`"""
+        self._entries.clear()
+        self.size = 0
@@ -0,0 +1,246 @@
+"""Registry of the calculators for the custom activity fields"""
+
+from typing import Callable
+
+import numpy as np
+
+from shared_code import stream_helpers, trimp_helpers
+
+
+def calculate_hr_reserve(activity: dict, stream: dict, user_settings: dict) -> None:
+    """
+    Calculate the HR reserve of the laps and the activity.
+
+    The heart rate of a lap is selected by its time, so it works on both the raw and
+    the cleaned 1 Hz streams. The `start_index` and `end_index` of the laps are left
+    as Strava returns them, relative to the raw streams served by data/streams.
+    """
+    if not activity["has_heartrate"]:
+        return
+
+    total_time = 0
+    for lap in activity["laps"]:
+        start_time = total_time
+        elapsed_time = lap["elapsed_time"]
+        total_time += elapsed_time
+        start_index = int(np.searchsorted(stream["time"], start_time))
+        end_index = int(np.searchsorted(stream["time"], total_time))
+        heart_rate_data = stream["heartrate"][start_index:end_index]
+        if heart_rate_data.size:
+            lap["average_heartrate"] = float(heart_rate_data.mean())
+        lap["hr_reserve"] = trimp_helpers.calculate_hr_reserve(
+            lap["average_heartrate"],
+            user_settings["heart_rate"]["resting"],
+            user_settings["heart_rate"]["max"],
+        )
+
+    activity["hr_reserve"] = trimp_helpers.calculate_hr_reserve(
+        activity["average_heartrate"],
+        user_settings["heart_rate"]["resting"],
+        user_settings["heart_rate"]["max"],
+    )
+
+
+def calculate_pace_reserve(activity: dict, stream: dict, user_settings: dict) -> None:
+    """Calculate the pace reserve of the laps and the activity"""
+    if activity["type"] != "Run":
+        return
+
+    for lap in activity["laps"]:
+        lap["pace_reserve"] = trimp_helpers.calculate_pace_reserve(
+            lap["average_speed"],
+            user_settings["pace"]["threshold"],
+        )
+
+    activity["pace_reserve"] = trimp_helpers.calculate_pace_reserve(
+        activity["average_speed"],
+        user_settings["pace"]["threshold"],
+    )
+
+
+def calculate_hr_trimp(activity: dict, stream: dict, user_settings: dict) -> None:
+    """Calculate the HR TRIMP of the laps and the activity"""
+    if not activity["has_heartrate"]:
+        return
+
+    for lap in activity["laps"]:
+        lap["hr_trimp"] = trimp_helpers.calculate_hr_trimp(
+            lap["moving_time"],
+            lap["hr_reserve"],
+            user_settings["gender"],
+            True,
+        )
+    activity["hr_trimp"] = sum([lap["hr_trimp"] for lap in activity["laps"]])
+
+
+def calculate_pace_trimp(activity: dict, stream: dict, user_settings: dict) -> None:
+    """Calculate the pace TRIMP of the laps and the activity"""
+    if activity["type"] != "Run":
+        return
+
+    for lap in activity["laps"]:
+        lap["pace_trimp"] = trimp_helpers.calculate_pace_trimp(
+            lap["moving_time"],
+            lap["pace_reserve"],
+            user_settings["gender"],
+            True,
+        )
+    activity["pace_trimp"] = sum([lap["pace_trimp"] for lap in activity["laps"]])
+
+
+def calculate_vo2max_estimate(
+    activity: dict, stream: dict, user_settings: dict
+) -> None:
+    """Calculate the VO2 max estimate of the activity"""
+    if not activity["has_heartrate"]:
+        return
+
+    activity["hr_max_percentage"] = trimp_helpers.calculate_hr_max_percentage(
+        activity["average_heartrate"],
+        user_settings["heart_rate"]["max"],
+    )
+    activity["vo2max_estimate"] = trimp_helpers.calculate_vo2max_estimate(
+        activity["distance"],
+        activity["moving_time"],
+        activity["hr_max_percentage"],
+        True,
+    )
+
+
+def calculate_mean_max_curves(
+    activity: dict, stream: dict, user_settings: dict
+) -> None:
+    """Calculate the mean-maximal curves of the activity"""
+    activity["mean_max_curves"] = stream_helpers.calculate_mean_max_curves(stream)
+
+
+def calculators() -> dict[str, dict]:
+    """
+    Registry of the calculators.
+
+    Calculators run in the order they are registered. Bump the version of a
+    calculator whenever its formula changes, the sweep then recalculates only that
+    field and the fields that depend on it.
+
+    Returns
+    -------
+    dict[str, dict]
+        The calculators by name, with the version, the calculate function, the
+        calculators it depends on, the stream columns it reads and the activity
+        fields it writes.
+    """
+    return {
+        "hr_reserve": {
+            "version": 1,
+            "function": calculate_hr_reserve,
+            "depends_on": [],
+            "columns": ["time", "heartrate"],
+            "fields": ["hr_reserve", "laps"],
+        },
+        "pace_reserve": {
+            "version": 1,
+            "function": calculate_pace_reserve,
+            "depends_on": [],
+            "columns": [],
+            "fields": ["pace_reserve", "laps"],
+        },
+        "hr_trimp": {
+            "version": 1,
+            "function": calculate_hr_trimp,
+            "depends_on": ["hr_reserve"],
+            "columns": [],
+            "fields": ["hr_trimp", "laps"],
+        },
+        "pace_trimp": {
+            "version": 1,
+            "function": calculate_pace_trimp,
+            "depends_on": ["pace_reserve"],
+            "columns": [],
+            "fields": ["pace_trimp", "laps"],
+        },
+        "vo2max_estimate": {
+            "version": 1,
+            "function": calculate_vo2max_estimate,
+            "depends_on": [],
+            "columns": [],
+            "fields": ["hr_max_percentage", "vo2max_estimate"],
+        },
+        "mean_max_curves": {
+            "version": 2,
+            "function": calculate_mean_max_curves,
+            "depends_on": [],
+            "columns": ["time", "distance", "velocity_smooth", "heartrate"],
+            "fields": ["mean_max_curves"],
+        },
+    }
+
+
+def resolve_calculators(names: list[str] | None = None) -> list[str]:
+    """Get the calculators to run, including everything that depends on them"""
+    registry = calculators()
+    if names is None:
+        return list(registry)
+
+    selected = set(names)
+    for name, calculator in registry.items():
+        if selected.intersection(calculator["depends_on"]):
+            selected.add(name)
+
+    return [name for name in registry if name in selected]
+
+
+def get_stream_columns(names: list[str]) -> list[str]:
+    """Get the stream columns the calculators read"""
+    registry = calculators()
+    columns = []
+    for name in names:
+        columns += [
+            column for column in registry[name]["columns"] if column not in columns
+        ]
+    return columns
+
+
+def get_activity_fields(names: list[str]) -> list[str]:
+    """Get the activity fields the calculators write"""
+    registry = calculators()
+    fields = []
+    for name in names:
+        fields += [field for field in registry[name]["fields"] if field not in fields]
+    return fields
+
+
+def run_calculators(
+    activity: dict, stream: dict, user_settings: dict, names: list[str]
+) -> dict:
+    """Run the calculators and record their versions on the activity"""
+    registry = calculators()
+    versions = activity.setdefault("calculation_versions", {})
+    for name in names:
+        function: Callable = registry[name]["function"]
+        function(activity, stream, user_settings)
+        versions[name] = registry[name]["version"]
+    return activity
+
+
+def get_outdated_calculators(activity: dict) -> list[str]:
+    """Get the calculators whose stored version is behind"""
+    versions = activity.get("calculation_versions") or {}
+    return [
+        name
+        for name, calculator in calculators().items()
+        if versions.get(name, 0) < calculator["version"]
+    ]
+
+
+def outdated_calculations_filter() -> tuple[str, list[dict]]:
+    """Query filter for activities with at least one outdated field"""
+    conditions = []
+    parameters = []
+    for name, calculator in calculators().items():
+        conditions.append(
+            f"NOT IS_DEFINED(c.calculation_versions.{name})"
+            f" OR c.calculation_versions.{name} < @{name}_version"
+        )
+        parameters.append({"name": f"@{name}_version", "value": calculator["version"]})
+
+    return f"({' OR '.join(conditions)})", parameters
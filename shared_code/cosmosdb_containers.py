@@ -0,0 +1,92 @@
+"""Declarative definitions of the CosmosDB containers"""
+
+
+def indexing_policy(
+    included_paths: list[str], composite_indexes: list[list[tuple[str, str]]] = []
+) -> dict:
+    """
+    Create an indexing policy that only indexes the given paths.
+
+    Parameters
+    ----------
+    included_paths : list[str]
+        The queried paths, for example `/userId/?`.
+    composite_indexes : list[list[tuple[str, str]]], optional
+        The composite indexes as lists of (path, order) pairs (default is []).
+
+    Returns
+    -------
+    dict
+        The CosmosDB indexing policy.
+    """
+    return {
+        "indexingMode": "consistent",
+        "automatic": True,
+        "includedPaths": [{"path": path} for path in included_paths],
+        "excludedPaths": [{"path": "/*"}, {"path": '/"_etag"/?'}],
+        "compositeIndexes": [
+            [{"path": path, "order": order} for path, order in composite_index]
+            for composite_index in composite_indexes
+        ],
+    }
+
+
+def container_definitions() -> list[dict]:
+    """
+    Definitions of all containers.
+
+    Only the paths used in query filters and ORDER BY clauses are indexed. Point
+    reads and queries on `/id` within its partition don't need an index, so the
+    streams, users and metrics containers index nothing.
+    """
+    return [
+        {
+            "name": "activities",
+            "partition_key": "/id",
+            "critical": False,
+            "indexing_policy": indexing_policy(
+                [
+                    "/userId/?",
+                    "/start_date/?",
+                    "/start_date_local/?",
+                    "/type/?",
+                    "/full_data/?",
+                    "/custom_fields_calculated/?",
+                    "/calculation_versions/*",
+                    "/streams_archived/?",
+                    # MAX(c._ts) of the data/activities version check
+                    "/_ts/?",
+                ],
+                [
+                    [("/userId", "ascending"), ("/start_date", "ascending")],
+                    [("/userId", "ascending"), ("/start_date", "descending")],
+                    # ORDER BY c.start_date, c.id of the activity pages
+                    [("/start_date", "ascending"), ("/id", "ascending")],
+                ],
+            ),
+        },
+        {
+            "name": "streams",
+            "partition_key": "/id",
+            "critical": False,
+            "indexing_policy": indexing_policy(["/activityId/?"]),
+        },
+        {
+            "name": "users",
+            "partition_key": "/id",
+            "critical": True,
+            "indexing_policy": indexing_policy([]),
+        },
+        {
+            "name": "notifications",
+            "partition_key": "/id",
+            "critical": False,
+            "indexing_policy": indexing_policy(["/userId/?", "/timestamp/?"]),
+        },
+        {
+            "name": "metrics",
+            "partition_key": "/id",
+            "critical": False,
+            "indexing_policy": indexing_policy([]),
+        },
+    ]
@@ -2,11 +2,13 @@
 
 
 import asyncio
+import copy
 import logging
 import random
 import time
 from typing import Callable
 
+from azure.core import MatchConditions
 from azure.cosmos import cosmos_client, exceptions
 
 from shared_code import get_config
@@ -120,3 +122,120 @@ def get_cosmosdb_items(
         [d.pop(key_to_pop, None) for d in items]
 
     return items
+
+
+def get_cosmosdb_item(
+    item_id: str,
+    container_name: str,
+    keys_to_pop: list = ["_rid", "_self", "_etag", "_attachments", "_ts"],
+) -> dict | None:
+    """Get a single CosmosDB item with a point read"""
+    container_client = cosmosdb_container(container_name)
+    try:
+        item = container_client.read_item(item=item_id, partition_key=item_id)
+    except exceptions.CosmosResourceNotFoundError:
+        return None
+
+    for key_to_pop in keys_to_pop:
+        item.pop(key_to_pop, None)
+
+    return item
+
+
+def update_cosmosdb_item(
+    item_id: str,
+    container_name: str,
+    update_function: Callable[[dict], dict],
+    default_item: dict | Callable[[], dict],
+    max_retries: int = 10,
+) -> dict:
+    """
+    Read, update and write a single CosmosDB item with optimistic concurrency
+
+    The item is written back guarded by the `_etag` it was read with. When another
+    writer changed the item in the meantime the update is retried on a fresh copy,
+    so concurrent queue messages for the same user don't overwrite each other.
+    Retries back off exponentially with jitter, so writers contending for the same
+    item spread out instead of conflicting again right away. A callable
+    `default_item` is only called when the item does not exist yet.
+    """
+    container_client = cosmosdb_container(container_name)
+    retry_count = 0
+    delay = random.uniform(0.0, 0.2)
+    max_delay = 5
+    while True:
+        try:
+            item = container_client.read_item(item=item_id, partition_key=item_id)
+        except exceptions.CosmosResourceNotFoundError:
+            item = None
+
+        try:
+            if item is None:
+                item = update_function(
+                    default_item()
+                    if callable(default_item)
+                    else copy.deepcopy(default_item)
+                )
+                return container_client.create_item(item)
+            etag = item["_etag"]
+            item = update_function(item)
+            return container_client.replace_item(
+                item=item_id,
+                body=item,
+                etag=etag,
+                match_condition=MatchConditions.IfNotModified,
+            )
+        except (
+            exceptions.CosmosAccessConditionFailedError,
+            exceptions.CosmosResourceExistsError,
+        ) as err:
+            if retry_count >= max_retries:
+                logging.error("Max retries reached")
+                raise err
+            logging.debug(
+                f"Item {item_id} was modified concurrently, retrying in {delay} seconds"
+            )
+            time.sleep(delay)
+            delay = min(delay * 2, max_delay) + random.uniform(0, 1) * min(
+                retry_count, 1
+            )
+            retry_count += 1
+
+
+def create_set_operations(fields: dict) -> list[dict]:
+    """Create patch operations that set top level fields"""
+    return [
+        {"op": "set", "path": f"/{field}", "value": value}
+        for field, value in fields.items()
+    ]
+
+
+def patch_cosmosdb_item(
+    item_id: str,
+    container_name: str,
+    operations: list[dict],
+    etag: str | None = None,
+) -> dict:
+    """
+    Patch a single CosmosDB item with partial document update operations
+
+    Cosmos accepts at most 10 operations per patch, larger updates are sent in
+    batches. When an `_etag` is given every batch is guarded by the `_etag` of the
+    previous write, so a concurrent update raises CosmosAccessConditionFailedError
+    instead of being overwritten.
+    """
+    container_client = cosmosdb_container(container_name)
+    item = None
+    for i in range(0, len(operations), 10):
+        kwargs = {}
+        if etag:
+            kwargs = {"etag": etag, "match_condition": MatchConditions.IfNotModified}
+        item = container_client.patch_item(
+            item=item_id,
+            partition_key=item_id,
+            patch_operations=operations[i : i + 10],
+            **kwargs,
+        )
+        if etag:
+            etag = item["_etag"]
+    return item
@@ -0,0 +1,141 @@
+"""Helper functions for the mean-maximal curve envelopes"""
+
+from shared_code import cosmosdb_module
+
+
+def curve_types() -> list[str]:
+    """Curves that are kept in the envelopes"""
+    return ["speed", "heartrate"]
+
+
+def curves_document_id(user_id: str) -> str:
+    """Id of the mean-maximal curves document of a user"""
+    return f"curves_{user_id}"
+
+
+def default_curves_document(user_id: str) -> dict:
+    """Empty mean-maximal curves document"""
+    return {
+        "id": curves_document_id(user_id),
+        "userId": user_id,
+        "type": "curves",
+        "types": {},
+    }
+
+
+def default_type_envelopes() -> dict:
+    """Empty all-time and season envelopes of an activity type"""
+    return {"all_time": {}, "seasons": {}}
+
+
+def kept_values() -> int:
+    """Best values kept per duration, the runner-ups take over from a lowered best"""
+    return 3
+
+
+def grid_durations(total_seconds: int) -> list[int]:
+    """
+    Fixed durations in seconds shorter than `total_seconds`.
+
+    Every 5 seconds up to 2 minutes, every 15 seconds up to 10 minutes, every minute
+    up to an hour and every 5 minutes after that.
+    """
+    durations = [
+        *range(5, 120, 5),
+        *range(120, 600, 15),
+        *range(600, 3600, 60),
+        *range(3600, total_seconds, 300),
+    ]
+    return [duration for duration in durations if duration < total_seconds]
+
+
+def best_entries(best_values: dict, duration: str) -> list[dict]:
+    """Get the best entries of a duration, documents before runner-ups hold one"""
+    entries = best_values.get(duration, [])
+    return entries if isinstance(entries, list) else [entries]
+
+
+def merge_curves(envelope: dict, curves: dict, activity_id: str, day: str) -> dict:
+    """
+    Merge the curves of an activity into an envelope.
+
+    Only the fixed grid durations are merged, the value over the full activity
+    stays on the activity so the envelope does not grow with every activity.
+    Every duration keeps the `kept_values()` best values and the activities they
+    came from. A recalculated activity replaces its own entry, so when its best
+    value drops the runner-up takes over. Only when more activities than kept
+    drop their values can a lower value than the true best be shown.
+    """
+    for curve_type in curve_types():
+        if curve_type not in curves:
+            continue
+        best_values = envelope.setdefault(curve_type, {})
+        longest = max([*curves["durations"], *map(int, best_values)], default=0)
+        grid = set(grid_durations(longest + 1))
+        for duration in [key for key in best_values if int(key) not in grid]:
+            del best_values[duration]
+
+        for duration, value in zip(curves["durations"], curves[curve_type]):
+            if duration not in grid:
+                continue
+            entries = [
+                entry
+                for entry in best_entries(best_values, str(duration))
+                if entry["activity_id"] != activity_id
+            ]
+            entries.append({"value": value, "activity_id": activity_id, "date": day})
+            entries.sort(key=lambda entry: entry["value"], reverse=True)
+            best_values[str(duration)] = entries[: kept_values()]
+    return envelope
+
+
+def update_curves_document(document: dict, activity: dict) -> dict:
+    """
+    Update the envelopes of the activity type with the curves of an activity.
+
+    Every activity type has its own envelopes, the speeds of a ride are no pace
+    of a run. Documents from before the split mixed all types, they are dropped
+    and rebuilt by the recalculation of the curves.
+    """
+    if "types" not in document:
+        document.pop("all_time", None)
+        document.pop("seasons", None)
+        document["types"] = {}
+
+    curves = activity.get("mean_max_curves")
+    if not curves:
+        return document
+
+    day = activity["start_date_local"][:10]
+    season = day[:4]
+    envelopes = document["types"].setdefault(activity["type"], default_type_envelopes())
+    merge_curves(envelopes["all_time"], curves, activity["id"], day)
+    merge_curves(
+        envelopes["seasons"].setdefault(season, {}), curves, activity["id"], day
+    )
+
+    return document
+
+
+def envelope_to_curves(envelope: dict) -> dict:
+    """Convert an envelope to lists sorted by duration"""
+    output = {}
+    for curve_type, best_values in envelope.items():
+        durations = sorted(best_values, key=int)
+        output[curve_type] = [
+            {"duration": int(duration), **best_entries(best_values, duration)[0]}
+            for duration in durations
+        ]
+    return output
+
+
+def update_curves(activity: dict) -> dict:
+    """Update the mean-maximal curve envelopes of a user with an activity"""
+    user_id = activity["userId"]
+
+    return cosmosdb_module.update_cosmosdb_item(
+        curves_document_id(user_id),
+        "metrics",
+        lambda document: update_curves_document(document, activity),
+        default_curves_document(user_id),
+    )
@@ -0,0 +1,196 @@
+"""Helper functions for the fitness/fatigue (CTL/ATL/TSB) time series"""
+
+from datetime import date, timedelta
+
+from shared_code import cosmosdb_module
+
+
+def time_constants() -> dict:
+    """Time constants in days of the exponentially weighted loads"""
+    return {
+        "ctl": 42,
+        "atl": 7,
+    }
+
+
+def fitness_document_id(user_id: str) -> str:
+    """Id of the fitness document of a user"""
+    return f"fitness_{user_id}"
+
+
+def default_fitness_document(user_id: str, tss_type: str) -> dict:
+    """Empty fitness document"""
+    return {
+        "id": fitness_document_id(user_id),
+        "userId": user_id,
+        "type": "fitness",
+        "tss_type": tss_type,
+        "activities": {},
+        "series": [],
+    }
+
+
+def get_activity_date(activity: dict) -> str:
+    """Get the local date of an activity"""
+    return activity["start_date_local"][:10]
+
+
+def calculate_training_load(
+    daily_loads: dict[str, float],
+    start_date: str,
+    end_date: str,
+    initial_ctl: float = 0.0,
+    initial_atl: float = 0.0,
+) -> list[dict]:
+    """
+    Calculate the training load series.
+
+    Parameters
+    ----------
+    daily_loads : dict[str, float]
+        The summed load per local date (YYYY-MM-DD).
+    start_date : str
+        The first date of the series to calculate.
+    end_date : str
+        The last date of the series to calculate.
+    initial_ctl : float, optional
+        The chronic training load of the day before `start_date` (default is 0).
+    initial_atl : float, optional
+        The acute training load of the day before `start_date` (default is 0).
+
+    Returns
+    -------
+    list[dict]
+        One entry per day with the load, chronic training load (fitness), acute
+        training load (fatigue) and training stress balance (form).
+
+    References
+    ----------
+        - https://fellrnr.com/wiki/Modeling_Human_Performance
+    """
+    constants = time_constants()
+    ctl, atl = initial_ctl, initial_atl
+    current = date.fromisoformat(start_date)
+    last = date.fromisoformat(end_date)
+
+    series = []
+    while current <= last:
+        day = current.isoformat()
+        load = daily_loads.get(day, 0.0)
+        tsb = ctl - atl
+        ctl = ctl + (load - ctl) / constants["ctl"]
+        atl = atl + (load - atl) / constants["atl"]
+        series.append(
+            {
+                "date": day,
+                "load": load,
+                "ctl": ctl,
+                "atl": atl,
+                "tsb": tsb,
+            }
+        )
+        current += timedelta(days=1)
+
+    return series
+
+
+def update_fitness_document(document: dict, activity: dict, tss_type: str) -> dict:
+    """Update the fitness document with a calculated activity"""
+    activities = document["activities"]
+    activity_date = get_activity_date(activity)
+    recalculate_from = activity_date
+
+    previous = activities.get(activity["id"])
+    if previous:
+        recalculate_from = min(recalculate_from, previous["date"])
+
+    activities[activity["id"]] = {
+        "date": activity_date,
+        "hr_trimp": activity.get("hr_trimp"),
+        "pace_trimp": activity.get("pace_trimp"),
+    }
+
+    # A different load type invalidates the whole series
+    if document["tss_type"] != tss_type:
+        document["tss_type"] = tss_type
+        recalculate_from = min(value["date"] for value in activities.values())
+
+    return recalculate_series(document, recalculate_from)
+
+
+def recalculate_series(document: dict, recalculate_from: str) -> dict:
+    """Recalculate the series of the fitness document from a date onwards"""
+    tss_type = document["tss_type"]
+    daily_loads = {}
+    for value in document["activities"].values():
+        daily_loads[value["date"]] = daily_loads.get(value["date"], 0.0) + (
+            value[f"{tss_type}_trimp"] or 0.0
+        )
+    if not daily_loads:
+        document["series"] = []
+        return document
+
+    series = [entry for entry in document["series"] if entry["date"] < recalculate_from]
+    if series:
+        initial_ctl, initial_atl = series[-1]["ctl"], series[-1]["atl"]
+        start_date = (
+            date.fromisoformat(series[-1]["date"]) + timedelta(days=1)
+        ).isoformat()
+    else:
+        initial_ctl, initial_atl = 0.0, 0.0
+        start_date = min(daily_loads)
+
+    document["series"] = series + calculate_training_load(
+        daily_loads, start_date, max(daily_loads), initial_ctl, initial_atl
+    )
+
+    return document
+
+
+def set_tss_type_document(document: dict, tss_type: str) -> dict:
+    """Recalculate the whole series with another load type"""
+    if document["tss_type"] == tss_type:
+        return document
+    document["tss_type"] = tss_type
+    return recalculate_series(document, "")
+
+
+def set_tss_type(user_id: str, tss_type: str) -> dict:
+    """Recalculate the materialized fitness series of a user with another load type"""
+    return cosmosdb_module.update_cosmosdb_item(
+        fitness_document_id(user_id),
+        "metrics",
+        lambda document: set_tss_type_document(document, tss_type),
+        default_fitness_document(user_id, tss_type),
+    )
+
+
+def extend_series(series: list[dict], end_date: str) -> list[dict]:
+    """
+    Extend a series without load up to `end_date`.
+
+    The stored series ends at the last activity, the loads keep decaying on the
+    days after it.
+    """
+    if not series or series[-1]["date"] >= end_date:
+        return series
+
+    start_date = (
+        date.fromisoformat(series[-1]["date"]) + timedelta(days=1)
+    ).isoformat()
+    return series + calculate_training_load(
+        {}, start_date, end_date, series[-1]["ctl"], series[-1]["atl"]
+    )
+
+
+def update_fitness(activity: dict, user_settings: dict) -> dict:
+    """Update the materialized fitness series of a user with an activity"""
+    user_id = activity["userId"]
+    tss_type = user_settings["preferences"]["preferred_tss_type"]
+
+    return cosmosdb_module.update_cosmosdb_item(
+        fitness_document_id(user_id),
+        "metrics",
+        lambda document: update_fitness_document(document, activity, tss_type),
+        default_fitness_document(user_id, tss_type),
+    )
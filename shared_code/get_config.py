@@ -28,3 +28,51 @@ def get_strava_auth() -> dict[str, str]:
         "client_id": os.environ["STRAVA_CLIENT_ID"],
         "client_secret": os.environ["STRAVA_CLIENT_SECRET"],
     }
+
+
+def get_stream_cache() -> dict:
+    """Get stream cache settings, all settings are optional"""
+
+    load_dotenv()
+
+    return {
+        "max_memory_bytes": int(
+            os.environ.get("STREAM_CACHE_MAX_MEMORY_BYTES", 64 * 1024 * 1024)
+        ),
+        "max_disk_bytes": int(os.environ.get("STREAM_CACHE_MAX_DISK_BYTES", 0)),
+        "directory": os.environ.get("STREAM_CACHE_DIRECTORY"),
+    }
+
+
+def get_stream_archive() -> dict:
+    """Get stream archive settings, archiving is disabled without a directory"""
+
+    load_dotenv()
+
+    return {
+        "directory": os.environ.get("STREAM_ARCHIVE_DIRECTORY"),
+        "age_days": int(os.environ.get("STREAM_ARCHIVE_AGE_DAYS", 3 * 365)),
+    }
+
+
+def get_response_cache() -> dict:
+    """Get response cache settings, all settings are optional"""
+
+    load_dotenv()
+
+    return {
+        "max_bytes": int(os.environ.get("RESPONSE_CACHE_MAX_BYTES", 32 * 1024 * 1024)),
+        "ttl_seconds": int(os.environ.get("RESPONSE_CACHE_TTL_SECONDS", 30)),
+        "directory": os.environ.get("RESPONSE_CACHE_DIRECTORY"),
+    }
+
+
+def get_user_settings_cache() -> dict:
+    """Get user settings cache settings, all settings are optional"""
+
+    load_dotenv()
+
+    return {
+        "max_users": int(os.environ.get("USER_SETTINGS_CACHE_MAX_USERS", 1000)),
+        "ttl_seconds": int(os.environ.get("USER_SETTINGS_CACHE_TTL_SECONDS", 60)),
+    }
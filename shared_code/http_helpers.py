@@ -0,0 +1,150 @@
+"""Helper functions for HTTP responses"""
+
+import gzip
+import hashlib
+import json
+from email.utils import formatdate
+
+import azure.functions as func
+import brotli
+import orjson
+
+
+def create_etag(*parts: object) -> str:
+    """Create a strong ETag from the parts that identify a response version"""
+    digest = hashlib.sha256(
+        json.dumps(parts, sort_keys=True, default=str).encode("utf-8")
+    ).hexdigest()
+    return f'"{digest[:32]}"'
+
+
+def etag_matches(req: func.HttpRequest, etag: str) -> bool:
+    """Check if the If-None-Match header of a request matches the ETag"""
+    if_none_match = req.headers.get("If-None-Match")
+    if not if_none_match:
+        return False
+
+    # If-None-Match uses the weak comparison
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+
+def cache_headers(etag: str, last_modified: int | None = None) -> dict[str, str]:
+    """Headers that let clients revalidate a response"""
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if last_modified:
+        headers["Last-Modified"] = formatdate(last_modified, usegmt=True)
+    return headers
+
+
+def not_modified_response(headers: dict[str, str]) -> func.HttpResponse:
+    """Create a 304 response"""
+    return func.HttpResponse(status_code=304, headers=headers)
+
+
+def json_default(value: object) -> object:
+    """
+    Serialize the values orjson does not handle natively.
+
+    numpy values are recognized by their module, so numpy is not imported for
+    responses that do not contain any.
+    """
+    if type(value).__module__.partition(".")[0] == "numpy":
+        return value.tolist()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+def dumps(value: object) -> bytes:
+    """
+    Serialize a value to compact JSON.
+
+    Datetimes are written as RFC 3339 strings, numpy arrays and scalars as lists
+    and numbers, and NaN and infinity as null so the output is always valid JSON.
+    """
+    return orjson.dumps(
+        value,
+        default=json_default,
+        option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS,
+    )
+
+
+def compression_threshold() -> int:
+    """Minimum body size in bytes that is compressed"""
+    return 1024
+
+
+def accepted_encoding(req: func.HttpRequest) -> str | None:
+    """Get the preferred supported encoding of the Accept-Encoding header"""
+    qualities = {}
+    for part in req.headers.get("Accept-Encoding", "").split(","):
+        name, _, parameters = part.partition(";")
+        quality = 1.0
+        parameters = parameters.strip().replace(" ", "")
+        if parameters.startswith("q="):
+            try:
+                quality = float(parameters[2:])
+            except ValueError:
+                quality = 0.0
+        qualities[name.strip().lower()] = quality
+
+    for encoding in ["br", "gzip"]:
+        if qualities.get(encoding, qualities.get("*", 0.0)) > 0:
+            return encoding
+    return None
+
+
+def compress_response(
+    req: func.HttpRequest, response: func.HttpResponse
+) -> func.HttpResponse:
+    """
+    Compress a response with the encoding the client prefers.
+
+    Bodies below `compression_threshold` are returned as is. The ETag of a
+    compressed response is made weak, as its bytes differ from the uncompressed
+    representation while If-None-Match still matches it.
+    """
+    body = response.get_body()
+    encoding = accepted_encoding(req)
+    if (
+        encoding is None
+        or len(body) < compression_threshold()
+        or response.headers.get("Content-Encoding")
+    ):
+        return response
+
+    if encoding == "br":
+        body = brotli.compress(body, quality=4)
+    else:
+        body = gzip.compress(body, compresslevel=5, mtime=0)
+
+    headers = dict(response.headers)
+    headers["Content-Encoding"] = encoding
+    headers["Vary"] = "Accept-Encoding"
+    etag = response.headers.get("ETag")
+    if etag and not etag.startswith("W/"):
+        headers["ETag"] = f"W/{etag}"
+
+    return func.HttpResponse(
+        body=body,
+        status_code=response.status_code,
+        mimetype=response.mimetype,
+        headers=headers,
+    )
+
+
+def json_response(
+    req: func.HttpRequest,
+    value: object,
+    status_code: int = 200,
+    headers: dict[str, str] | None = None,
+) -> func.HttpResponse:
+    """Create a JSON response, compressed when the client accepts it"""
+    return compress_response(
+        req,
+        func.HttpResponse(
+            body=dumps(value),
+            mimetype="application/json",
+            status_code=status_code,
+            headers=headers,
+        ),
+    )
@@ -0,0 +1,139 @@
+"""Per-user index of orchestration instances"""
+
+from datetime import datetime, timedelta, timezone
+
+from shared_code import cosmosdb_module
+
+
+def terminal_statuses() -> list[str]:
+    """Runtime statuses of orchestrations that will not change anymore"""
+    return ["Completed", "Failed", "Terminated"]
+
+
+def retention_days() -> int:
+    """Days instances are kept in the index, this bounds the document size"""
+    return 365
+
+
+def time_format() -> str:
+    """Format of the times in the index, the same as orchestrator/list returns"""
+    return "%Y-%m-%d %H:%M:%S"
+
+
+def format_time(moment: datetime) -> str:
+    """Format a time in UTC"""
+    return moment.astimezone(timezone.utc).strftime(time_format())
+
+
+def parse_time(value: str) -> datetime:
+    """Parse a time from the index"""
+    return datetime.strptime(value, time_format()).replace(tzinfo=timezone.utc)
+
+
+def index_document_id(user_id: str) -> str:
+    """Id of the orchestration index of a user"""
+    return f"orchestrations_{user_id}"
+
+
+def default_index_document(user_id: str) -> dict:
+    """Empty orchestration index, instances started before `since` are not in it"""
+    return {
+        "id": index_document_id(user_id),
+        "userId": user_id,
+        "type": "orchestrations",
+        "since": format_time(datetime.now(timezone.utc)),
+        "instances": {},
+    }
+
+
+def get_index(user_id: str) -> dict | None:
+    """Get the orchestration index of a user with a point read"""
+    return cosmosdb_module.get_cosmosdb_item(index_document_id(user_id), "metrics")
+
+
+def set_instances_document(document: dict, instances: list[dict]) -> dict:
+    """Set instances in the index and drop the ones past the retention"""
+    cutoff = format_time(datetime.now(timezone.utc) - timedelta(days=retention_days()))
+    for instance in instances:
+        document["instances"][instance["instanceId"]] = instance
+    document["instances"] = {
+        instance_id: instance
+        for instance_id, instance in document["instances"].items()
+        if instance["createdTime"] >= cutoff
+    }
+    return document
+
+
+def set_instances(user_id: str, instances: list[dict]) -> dict:
+    """
+    Add or update instances in the index of a user.
+
+    Parameters
+    ----------
+    user_id : str
+        The id of the user.
+    instances : list[dict]
+        The instances in the orchestrator/list format, keyed by `instanceId`.
+
+    Returns
+    -------
+    dict
+        The updated index.
+    """
+    return cosmosdb_module.update_cosmosdb_item(
+        index_document_id(user_id),
+        "metrics",
+        lambda document: set_instances_document(document, instances),
+        default_index_document(user_id),
+    )
+
+
+def add_instance(user_id: str, instance_id: str) -> dict:
+    """Add a just started instance to the index of a user"""
+    now = format_time(datetime.now(timezone.utc))
+    return set_instances(
+        user_id,
+        [
+            {
+                "instanceId": instance_id,
+                "runtimeStatus": "Pending",
+                "createdTime": now,
+                "lastUpdatedTime": now,
+                "output": None,
+            }
+        ],
+    )
+
+
+def complete_instance(user_id: str, instance_id: str, output: dict) -> dict:
+    """Mark an instance of a user as completed with its output"""
+
+    def update(document: dict) -> dict:
+        instance = document["instances"].get(instance_id)
+        if instance is not None:
+            instance["runtimeStatus"] = "Completed"
+            instance["lastUpdatedTime"] = format_time(datetime.now(timezone.utc))
+            instance["output"] = output
+        return document
+
+    return cosmosdb_module.update_cosmosdb_item(
+        index_document_id(user_id),
+        "metrics",
+        update,
+        default_index_document(user_id),
+    )
+
+
+def remove_instance(user_id: str, instance_id: str) -> dict:
+    """Remove a purged instance from the index of a user"""
+
+    def update(document: dict) -> dict:
+        document["instances"].pop(instance_id, None)
+        return document
+
+    return cosmosdb_module.update_cosmosdb_item(
+        index_document_id(user_id),
+        "metrics",
+        update,
+        default_index_document(user_id),
+    )
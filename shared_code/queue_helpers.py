@@ -5,15 +5,20 @@ import os
 import uuid
 from datetime import datetime
 from functools import partial
+from typing import TYPE_CHECKING
 
 from azure.functions import QueueMessage
-from azure.storage.queue import QueueClient, TextBase64EncodePolicy
 
 from shared_code import cosmosdb_module
 
+if TYPE_CHECKING:
+    from azure.storage.queue import QueueClient
+
+
+def create_queue_client(queue_name: str) -> "QueueClient":
+    """Create queue client, the storage SDK is imported on first use"""
+    from azure.storage.queue import QueueClient, TextBase64EncodePolicy
 
-def create_queue_client(queue_name: str) -> QueueClient:
-    """Create queue client"""
     account_url = os.environ["AZUREWEBJOBSSTORAGE"]
     queue_client = QueueClient.from_connection_string(
         conn_str=account_url,
@@ -28,9 +33,10 @@ def add_activity_to_enrichment_queue(activities: dict, queue_name: str) -> dict:
     queue_client = create_queue_client(queue_name)
 
     for activity in activities:
-        queue_client.send_message(
-            json.dumps({"activity_id": activity["id"], "user_id": activity["userId"]})
-        )
+        message = {"activity_id": activity["id"], "user_id": activity["userId"]}
+        if activity.get("calculators"):
+            message["calculators"] = activity["calculators"]
+        queue_client.send_message(json.dumps(message))
 
     return {"status": "success"}
 
@@ -0,0 +1,165 @@
+"""
+Per-user cache of HTTP responses.
+
+Responses are cached in process memory and, when `RESPONSE_CACHE_DIRECTORY` points
+to a directory shared by all instances, in that directory. Every user has a
+generation that the write paths increase, a cached response is only served while
+the generation it was created in is current. Writes in another process are only
+seen through the shared directory, without it entries expire after the TTL.
+"""
+
+import base64
+import contextlib
+import functools
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+import azure.functions as func
+
+from shared_code import cache_helpers, get_config
+
+
+@functools.cache
+def cache_state() -> dict:
+    """The memory cache, user generations and settings of this process"""
+    settings = get_config.get_response_cache()
+    return {
+        "memory": cache_helpers.LRUCache(
+            settings["max_bytes"], lambda entry: len(entry["body"])
+        ),
+        "generations": {},
+        "ttl_seconds": settings["ttl_seconds"],
+        "directory": Path(settings["directory"]) if settings["directory"] else None,
+    }
+
+
+def cache_key(user_id: str, endpoint: str, params: dict) -> str:
+    """Key of a response, the parameters are normalized by sorting them"""
+    normalized = json.dumps(sorted(params.items()))
+    digest = hashlib.sha256(f"{endpoint}?{normalized}".encode("utf-8")).hexdigest()
+    return f"{user_id}/{digest[:32]}"
+
+
+def generation_path(user_id: str) -> Path:
+    """File with the generation of a user in the shared directory"""
+    return cache_state()["directory"] / user_id / "generation"
+
+
+def user_generation(user_id: str) -> int:
+    """Get the generation of a user, it changes whenever the data of the user does"""
+    state = cache_state()
+    generation = state["generations"].get(user_id, 0)
+    if state["directory"]:
+        with contextlib.suppress(OSError, ValueError):
+            generation = max(generation, int(generation_path(user_id).read_text()))
+    return generation
+
+
+def invalidate_user(user_id: str) -> None:
+    """Invalidate all cached responses of a user"""
+    state = cache_state()
+    generation = user_generation(user_id) + 1
+    state["generations"][user_id] = generation
+
+    if state["directory"]:
+        path = generation_path(user_id)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        temporary_path = path.with_name(f"generation.{os.getpid()}.tmp")
+        temporary_path.write_text(str(generation))
+        os.replace(temporary_path, path)
+
+
+def read_shared_entry(key: str) -> dict | None:
+    """Read an entry from the shared directory"""
+    try:
+        entry = json.loads((cache_state()["directory"] / f"{key}.json").read_text())
+    except (OSError, ValueError):
+        return None
+    return {**entry, "body": base64.b64decode(entry["body"])}
+
+
+def write_shared_entry(key: str, entry: dict) -> None:
+    """Write an entry to the shared directory"""
+    path = cache_state()["directory"] / f"{key}.json"
+    path.parent.mkdir(parents=True, exist_ok=True)
+    temporary_path = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    temporary_path.write_text(
+        json.dumps({**entry, "body": base64.b64encode(entry["body"]).decode("ascii")})
+    )
+    os.replace(temporary_path, path)
+
+
+def get_response(user_id: str, endpoint: str, params: dict) -> func.HttpResponse | None:
+    """
+    Get a cached response.
+
+    Parameters
+    ----------
+    user_id : str
+        The id of the user.
+    endpoint : str
+        The route of the endpoint.
+    params : dict
+        The query parameters of the request.
+
+    Returns
+    -------
+    func.HttpResponse | None
+        The response, None when it is not cached, expired or the data of the user
+        changed since it was cached.
+    """
+    state = cache_state()
+    key = cache_key(user_id, endpoint, params)
+
+    entry = state["memory"].get(key)
+    if entry is None and state["directory"]:
+        entry = read_shared_entry(key)
+
+    if (
+        entry is None
+        or entry["generation"] != user_generation(user_id)
+        or time.time() - entry["created"] > state["ttl_seconds"]
+    ):
+        return None
+
+    state["memory"].set(key, entry)
+    return func.HttpResponse(
+        body=entry["body"],
+        status_code=entry["status_code"],
+        mimetype=entry["mimetype"],
+        headers=entry["headers"],
+    )
+
+
+def set_response(
+    user_id: str,
+    endpoint: str,
+    params: dict,
+    response: func.HttpResponse,
+    generation: int,
+) -> None:
+    """
+    Cache a successful response.
+
+    The `generation` must be read before the data of the response, so a write
+    that happens while the response is created invalidates it.
+    """
+    if response.status_code != 200:
+        return
+
+    state = cache_state()
+    key = cache_key(user_id, endpoint, params)
+    entry = {
+        "body": response.get_body(),
+        "status_code": response.status_code,
+        "mimetype": response.mimetype,
+        "headers": dict(response.headers),
+        "generation": generation,
+        "created": time.time(),
+    }
+    state["memory"].set(key, entry)
+    if state["directory"]:
+        write_shared_entry(key, entry)
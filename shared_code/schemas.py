@@ -90,3 +90,17 @@ def user_data() -> dict:
             "preferences",
         ],
     }
+
+
+def user_input() -> dict:
+    """Schema for the user input of an activity"""
+    return {
+        "type": "object",
+        "properties": {
+            "include_in_vo2max_estimate": {"type": "boolean"},
+            "tags": {"type": "array", "items": {"type": "string"}},
+            "notes": {"type": "string"},
+        },
+        "additionalProperties": False,
+        "required": ["include_in_vo2max_estimate", "tags", "notes"],
+    }
@@ -1,15 +1,23 @@
-"""Strava helper functions"""
+"""
+Strava helper functions
+
+stravalib is imported on first use, importing it takes longer than the rest of
+the function app and most functions never create a Strava client.
+"""
 
 import time
-from typing import Tuple
+from typing import TYPE_CHECKING, Tuple
 
-from stravalib.client import Client
+from shared_code import cosmosdb_module, get_config, response_cache, user_helpers
 
-from shared_code import cosmosdb_module, get_config
+if TYPE_CHECKING:
+    from stravalib.client import Client
 
 
 def initial_strava_auth(code: str) -> dict:
     """Initial strava authentication"""
+    from stravalib.client import Client
+
     client = Client()
     strava_auth = get_config.get_strava_auth()
 
@@ -28,6 +36,8 @@ def initial_strava_auth(code: str) -> dict:
 
 def refresh_strava_auth(refresh_token: str) -> dict:
     """Refresh strava authentication"""
+    from stravalib.client import Client
+
     client = Client()
     strava_auth = get_config.get_strava_auth()
 
@@ -44,9 +54,11 @@ def refresh_strava_auth(refresh_token: str) -> dict:
     return auth_object
 
 
-def create_strava_client(user_settings: object) -> Tuple[Client, dict, bool]:
+def create_strava_client(user_settings: object) -> Tuple["Client", dict, bool]:
     """Create strava client"""
 
+    from stravalib.client import Client
+
     auth_object = user_settings["strava_authentication"]
 
     client = Client()
@@ -57,7 +69,15 @@ def create_strava_client(user_settings: object) -> Tuple[Client, dict, bool]:
             auth_object["refresh_token"],
         )
         user_settings["strava_authentication"] = auth_object
-        cosmosdb_module.cosmosdb_container("users").upsert_item(user_settings)
+        cosmosdb_module.patch_cosmosdb_item(
+            user_settings["id"],
+            "users",
+            cosmosdb_module.create_set_operations(
+                {"strava_authentication": auth_object}
+            ),
+        )
+        user_helpers.invalidate_user_settings(user_settings["id"])
+        response_cache.invalidate_user(user_settings["id"])
 
     client.access_token = auth_object["access_token"]
 
@@ -107,6 +127,10 @@ def cleanup_activity(
             "vo2_max_percentage": None,
             "estimated_vo2_max": None,
         },
+        "mean_max_curves": None,
+        "simplified_polyline": None,
+        "streams_archived": False,
+        "calculation_versions": {},
         "user_input": {
             "include_in_vo2max_estimate": True,
             "tags": [],
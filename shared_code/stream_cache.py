@@ -0,0 +1,213 @@
+"""Process local cache of decoded activity streams"""
+
+import functools
+import hashlib
+import logging
+import shutil
+import tempfile
+from pathlib import Path
+
+import numpy as np
+
+from shared_code import cache_helpers, get_config, stream_store
+
+
+def entry_size(entry: dict) -> int:
+    """Size in bytes of the decoded columns of a cache entry"""
+    return sum(values.nbytes for values in entry["columns"].values())
+
+
+def spilled_entry_size(entry: dict) -> int:
+    """Size in bytes of the columns of a spilled entry on disk"""
+    return entry["size"]
+
+
+def entry_path(activity_id: str, etag: str) -> Path:
+    """Directory of a spilled cache entry"""
+    version = hashlib.sha256(etag.encode("utf-8")).hexdigest()[:16]
+    return caches()["directory"] / f"{activity_id}_{version}"
+
+
+def spill_entry(activity_id: str, entry: dict) -> None:
+    """
+    Write an entry evicted from memory to disk.
+
+    Columns that were memory-mapped from an earlier spill of the same version are
+    already on disk and are not written again, so no mapped file is overwritten.
+    The disk cache only keeps the column names, not the mapped arrays.
+    """
+    disk_cache = caches()["disk"]
+    if disk_cache.max_size <= 0:
+        return
+
+    path = entry_path(activity_id, entry["etag"])
+    try:
+        path.mkdir(parents=True, exist_ok=True)
+        for name, values in entry["columns"].items():
+            if not (path / f"{name}.npy").exists():
+                np.save(path / f"{name}.npy", values)
+    except OSError as err:
+        logging.warning(f"Could not spill streams of {activity_id}: {err}")
+        remove_files(path)
+        return
+
+    disk_cache.set(
+        activity_id,
+        {
+            **{key: value for key, value in entry.items() if key != "columns"},
+            "columns": list(entry["columns"]),
+            "size": entry_size(entry),
+            "path": path,
+        },
+    )
+
+
+def remove_files(path: Path) -> None:
+    """Remove the files of a spilled entry, the cache no longer maps them"""
+    shutil.rmtree(path, ignore_errors=True)
+
+
+def remove_spilled_entry(_activity_id: str, entry: dict) -> None:
+    """Remove a spilled entry from disk"""
+    remove_files(entry["path"])
+
+
+def load_spilled_entry(entry: dict) -> dict | None:
+    """Memory-map the columns of a spilled entry"""
+    try:
+        return {
+            **{
+                key: value
+                for key, value in entry.items()
+                if key not in ["path", "size"]
+            },
+            "columns": {
+                name: np.load(entry["path"] / f"{name}.npy", mmap_mode="r")
+                for name in entry["columns"]
+            },
+        }
+    except OSError:
+        return None
+
+
+@functools.cache
+def caches() -> dict:
+    """The memory and disk caches of this process and the spill directory"""
+    settings = get_config.get_stream_cache()
+    return {
+        "directory": Path(settings["directory"] or tempfile.gettempdir())
+        / "stream_cache",
+        "memory": cache_helpers.LRUCache(
+            settings["max_memory_bytes"], entry_size, spill_entry
+        ),
+        "disk": cache_helpers.LRUCache(
+            settings["max_disk_bytes"], spilled_entry_size, remove_spilled_entry
+        ),
+    }
+
+
+def get_entry(activity_id: str, etag: str) -> dict | None:
+    """
+    Get the cache entry of a stream version.
+
+    A spilled entry is memory-mapped and moved back to the memory cache. Its files
+    stay on disk while it is in memory, so the mapped arrays remain valid and a
+    next spill does not have to write them again.
+    """
+    memory_cache, disk_cache = caches()["memory"], caches()["disk"]
+
+    cached_etag = (
+        memory_cache.get(activity_id) or disk_cache.get(activity_id) or {}
+    ).get("etag")
+    if cached_etag is None:
+        return None
+    if cached_etag != etag:
+        invalidate(activity_id)
+        return None
+
+    entry = memory_cache.get(activity_id)
+    if entry is None:
+        spilled = disk_cache.pop(activity_id)
+        entry = load_spilled_entry(spilled)
+        if entry is None:
+            remove_spilled_entry(activity_id, spilled)
+            return None
+        memory_cache.set(activity_id, entry)
+    return entry
+
+
+def invalidate(activity_id: str) -> None:
+    """Remove the cached streams of an activity"""
+    # Only keep the etag, the mapped arrays are released before the files are removed
+    etag = (caches()["memory"].pop(activity_id) or {}).get("etag")
+    if etag:
+        remove_files(entry_path(activity_id, etag))
+    spilled = caches()["disk"].pop(activity_id)
+    if spilled:
+        remove_spilled_entry(activity_id, spilled)
+
+
+def clear() -> None:
+    """Remove all cached streams"""
+    caches()["memory"].clear()
+    caches()["disk"].clear()
+    remove_files(caches()["directory"])
+
+
+def read_streams(
+    activity_id: str, user_id: str, columns: list[str] | None = None
+) -> dict[str, np.ndarray] | None:
+    """
+    Read the streams of an activity through the process local cache.
+
+    Entries are keyed by activity id and the `_etag` of the stream document, so a
+    cached version is only used while it is current. Checking the `_etag` is a
+    small projection, the columns are only read and decoded on a miss. Columns
+    missing from an entry are read and added to it.
+
+    Parameters
+    ----------
+    activity_id : str
+        The id of the activity.
+    user_id : str
+        The id of the user, streams of other users are not returned.
+    columns : list[str] | None, optional
+        The columns to read, all columns when None (default is None).
+
+    Returns
+    -------
+    dict[str, np.ndarray] | None
+        The decoded columns, None when the activity has no streams. The arrays are
+        shared with the cache and must not be modified.
+    """
+    version = stream_store.read_stream_version(activity_id)
+    if not version or version["userId"] != user_id:
+        return None
+
+    entry = get_entry(activity_id, version["_etag"]) or {
+        "etag": version["_etag"],
+        "user_id": user_id,
+        "complete": False,
+        "requested": set(),
+        "columns": {},
+    }
+
+    if columns is None:
+        missing = None if not entry["complete"] else []
+    else:
+        missing = [column for column in columns if column not in entry["requested"]]
+
+    if missing is None or missing:
+        output = stream_store.read_streams(activity_id, user_id, missing)
+        if output is None:
+            return None
+        entry = {
+            **entry,
+            "complete": entry["complete"] or missing is None,
+            "requested": entry["requested"] | set(missing or output),
+            "columns": {**entry["columns"], **output},
+        }
+        caches()["memory"].set(activity_id, entry)
+
+    names = entry["columns"] if columns is None else columns
+    return {name: entry["columns"][name] for name in names if name in entry["columns"]}
@@ -0,0 +1,254 @@
+"""Compact columnar encoding of activity streams"""
+
+import base64
+import zlib
+
+import numpy as np
+
+
+def stream_format() -> str:
+    """Format name of encoded stream documents"""
+    return "columnar-v1"
+
+
+def column_specs() -> dict[str, dict]:
+    """
+    Encoding of the stream columns.
+
+    Values are quantized to `scale` before they are delta encoded, the scale is
+    chosen below the precision Strava reports the stream in. GPS tracks are stored
+    as a Google polyline so map clients can use them without decoding.
+    """
+    return {
+        "time": {"scale": 1, "kind": "int"},
+        "distance": {"scale": 0.1, "kind": "float"},
+        "altitude": {"scale": 0.1, "kind": "float"},
+        "velocity_smooth": {"scale": 0.001, "kind": "float"},
+        "heartrate": {"scale": 1, "kind": "int"},
+        "cadence": {"scale": 1, "kind": "int"},
+        "watts": {"scale": 1, "kind": "int"},
+        "temp": {"scale": 1, "kind": "int"},
+        "moving": {"scale": 1, "kind": "bool"},
+        "grade_smooth": {"scale": 0.1, "kind": "float"},
+        "latlng": {"scale": 0.000001, "kind": "polyline"},
+    }
+
+
+def smallest_int_dtype(values: np.ndarray) -> np.dtype:
+    """Get the smallest signed integer type that holds the values"""
+    if values.size == 0:
+        return np.dtype("<i1")
+    low, high = values.min(), values.max()
+    for dtype in ["<i1", "<i2", "<i4"]:
+        info = np.iinfo(dtype)
+        if info.min <= low and high <= info.max:
+            return np.dtype(dtype)
+    return np.dtype("<i8")
+
+
+def pack(values: np.ndarray) -> str:
+    """Compress and base64 encode an array"""
+    return base64.b64encode(zlib.compress(values.tobytes(), 6)).decode("ascii")
+
+
+def unpack(data: str, dtype: str) -> np.ndarray:
+    """Decode a packed array, the result is a read-only view of the buffer"""
+    return np.frombuffer(zlib.decompress(base64.b64decode(data)), dtype=dtype)
+
+
+def encode_polyline(latlng: np.ndarray, precision: int = 5) -> str:
+    """
+    Encode coordinates with the Google polyline algorithm.
+
+    Parameters
+    ----------
+    latlng : np.ndarray
+        The [lat, lng] pairs in degrees.
+    precision : int, optional
+        The number of decimals to keep (default is 5).
+
+    Returns
+    -------
+    str
+        The encoded polyline.
+
+    References
+    ----------
+        - https://developers.google.com/maps/documentation/utilities/polylinealgorithm
+    """
+    quantized = np.round(np.asarray(latlng).reshape(-1, 2) * 10**precision)
+    quantized = quantized.astype(np.int64)
+    deltas = np.diff(quantized, axis=0, prepend=np.zeros((1, 2), dtype=np.int64))
+    zigzag = (deltas << 1) ^ (deltas >> 63)
+
+    chars = []
+    for value in zigzag.ravel().tolist():
+        while value >= 0x20:
+            chars.append(chr((0x20 | (value & 0x1F)) + 63))
+            value >>= 5
+        chars.append(chr(value + 63))
+    return "".join(chars)
+
+
+def decode_polyline(polyline: str, precision: int = 5) -> np.ndarray:
+    """Decode a Google polyline to [lat, lng] pairs"""
+    chunks = np.frombuffer(polyline.encode("ascii"), dtype=np.uint8) - 63
+    if chunks.size == 0:
+        return np.zeros((0, 2))
+
+    chunks = chunks.astype(np.int64)
+    ends = np.flatnonzero((chunks & 0x20) == 0)
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    value_index = np.repeat(np.arange(len(ends)), ends - starts + 1)
+    shifts = 5 * (np.arange(len(chunks)) - starts[value_index])
+    values = np.add.reduceat((chunks & 0x1F) << shifts, starts)
+
+    deltas = np.where(values & 1, ~(values >> 1), values >> 1)
+    return np.cumsum(deltas.reshape(-1, 2), axis=0) / 10**precision
+
+
+def encode_column(name: str, data: list) -> dict:
+    """
+    Encode a single stream column.
+
+    Parameters
+    ----------
+    name : str
+        The stream type, this selects the quantization.
+    data : list
+        The values of the stream, `latlng` is a list of [lat, lng] pairs.
+
+    Returns
+    -------
+    dict
+        The encoded column. Null samples are stored as a `missing` mask and decode
+        to NaN, or False for boolean columns.
+    """
+    spec = column_specs().get(name, {"scale": 0.001, "kind": "float"})
+    missing = None
+    if spec["kind"] != "polyline" and any(value is None for value in data):
+        missing = np.array([value is None for value in data])
+        values = fill_missing(np.array(data, dtype=np.float64), missing)
+    else:
+        values = np.asarray(data)
+    shape = list(values.shape)
+
+    if spec["kind"] == "polyline":
+        precision = round(-np.log10(spec["scale"]))
+        return {
+            "encoding": "polyline",
+            "shape": shape,
+            "precision": precision,
+            "data": encode_polyline(values, precision),
+        }
+
+    if spec["kind"] == "bool":
+        column = {
+            "encoding": "zlib",
+            "dtype": "|u1",
+            "shape": shape,
+            "data": pack(values.astype(np.uint8)),
+        }
+    else:
+        quantized = np.round(values / spec["scale"]).astype(np.int64)
+        deltas = np.diff(quantized, axis=0, prepend=np.zeros_like(quantized[:1]))
+        dtype = smallest_int_dtype(deltas)
+        column = {
+            "encoding": "delta-zlib",
+            "dtype": dtype.str,
+            "shape": shape,
+            "scale": spec["scale"],
+            "kind": spec["kind"],
+            "data": pack(deltas.astype(dtype)),
+        }
+
+    if missing is not None:
+        column["missing"] = pack(missing.astype(np.uint8))
+    return column
+
+
+def fill_missing(values: np.ndarray, missing: np.ndarray) -> np.ndarray:
+    """Fill missing samples with the previous value so they add no deltas"""
+    previous = np.maximum.accumulate(np.where(missing, 0, np.arange(len(values))))
+    return np.nan_to_num(values[previous], nan=0.0)
+
+
+def decode_column(column: dict) -> np.ndarray:
+    """Decode a stream column, legacy columns with a `data` list are supported"""
+    match column.get("encoding"):
+        case None:
+            return np.asarray(column["data"])
+        case "zlib":
+            values = unpack(column["data"], column["dtype"]).astype(bool)
+        case "polyline":
+            values = decode_polyline(column["data"], column["precision"])
+        case "delta-zlib":
+            deltas = unpack(column["data"], column["dtype"]).reshape(column["shape"])
+            values = np.cumsum(deltas, axis=0, dtype=np.int64)
+            if column["kind"] == "float":
+                values = values / round(1 / column["scale"])
+        case encoding:
+            raise ValueError(f"Unknown stream encoding {encoding}")
+
+    values = values.reshape(column["shape"])
+    if "missing" in column:
+        missing = unpack(column["missing"], "|u1").astype(bool)
+        values = (
+            values & ~missing
+            if values.dtype == bool
+            else np.where(missing, np.nan, values)
+        )
+    return values
+
+
+def encode_streams(streams: dict) -> dict:
+    """
+    Encode the streams of an activity.
+
+    Parameters
+    ----------
+    streams : dict
+        The streams by type, each with the Strava `data` list.
+
+    Returns
+    -------
+    dict
+        The encoded document body, every column is stored as a top level field so
+        readers can project single columns.
+    """
+    document = {"format": stream_format(), "length": 0}
+    for name, stream in streams.items():
+        document[name] = encode_column(name, stream["data"])
+        document["length"] = max(document["length"], len(stream["data"]))
+    return document
+
+
+def is_column(value: object) -> bool:
+    """Check if a document field is a stream column"""
+    return isinstance(value, dict) and "data" in value
+
+
+def decode_streams(document: dict, columns: list[str] | None = None) -> dict:
+    """
+    Decode the columns of a stream document.
+
+    Parameters
+    ----------
+    document : dict
+        The stream document, either encoded or in the legacy Strava format.
+    columns : list[str] | None, optional
+        The columns to decode, all columns when None (default is None).
+
+    Returns
+    -------
+    dict
+        The decoded columns by stream type.
+    """
+    if columns is None:
+        columns = [key for key, value in document.items() if is_column(value)]
+
+    return {
+        column: decode_column(document[column])
+        for column in columns
+        if is_column(document.get(column))
+    }
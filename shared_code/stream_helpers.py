@@ -0,0 +1,428 @@
+"""Helper functions for processing activity streams"""
+
+import numpy as np
+
+from shared_code import curve_helpers, stream_codec
+
+
+def curve_durations(total_seconds: int) -> list[int]:
+    """
+    Durations in seconds to calculate mean-maximal values for.
+
+    The fixed `curve_helpers.grid_durations` ending with the full activity.
+    """
+    durations = curve_helpers.grid_durations(total_seconds)
+    if total_seconds >= 5:
+        durations.append(total_seconds)
+    return durations
+
+
+def resample_to_seconds(time: np.ndarray, values: np.ndarray) -> np.ndarray:
+    """Linearly resample values onto a 1 Hz grid starting at the first sample"""
+    grid = np.arange(time[0], time[-1] + 1)
+    return np.interp(grid, time, values)
+
+
+def calculate_mean_max(cumulative: np.ndarray, durations: list[int]) -> list[float]:
+    """
+    Calculate the mean-maximal values of a 1 Hz series.
+
+    Parameters
+    ----------
+    cumulative : np.ndarray
+        The cumulative sum of the 1 Hz series, starting with 0.
+    durations : list[int]
+        The durations in seconds.
+
+    Returns
+    -------
+    list[float]
+        The best average over each duration.
+    """
+    return [
+        float(np.max(cumulative[duration:] - cumulative[:-duration]) / duration)
+        for duration in durations
+    ]
+
+
+def calculate_mean_max_curves(stream: dict[str, np.ndarray]) -> dict | None:
+    """
+    Calculate the mean-maximal speed and heart rate curves of an activity.
+
+    The streams are resampled to 1 Hz so every window is a difference of two
+    cumulative values, which makes each duration a single vectorized pass.
+
+    Parameters
+    ----------
+    stream : dict[str, np.ndarray]
+        The decoded stream columns of the activity.
+
+    Returns
+    -------
+    dict | None
+        The durations with the best average speed (m/s) and heart rate (bpm) over
+        each of them, None when the activity has no time stream.
+    """
+    if "time" not in stream or len(stream["time"]) < 2:
+        return None
+
+    time = stream["time"].astype(np.float64)
+    durations = curve_durations(int(time[-1] - time[0]))
+    if not durations:
+        return None
+
+    curves = {"durations": durations}
+
+    if "distance" in stream:
+        distance = resample_to_seconds(time, stream["distance"])
+        curves["speed"] = calculate_mean_max(distance - distance[0], durations)
+    elif "velocity_smooth" in stream:
+        velocity = resample_to_seconds(time, stream["velocity_smooth"])
+        curves["speed"] = calculate_mean_max(
+            np.concatenate(([0.0], np.cumsum(velocity))), durations
+        )
+
+    if "heartrate" in stream:
+        heartrate = resample_to_seconds(time, stream["heartrate"])
+        curves["heartrate"] = calculate_mean_max(
+            np.concatenate(([0.0], np.cumsum(heartrate))), durations
+        )
+
+    return curves
+
+
+def lttb_indices(x: np.ndarray, ys: list[np.ndarray], threshold: int) -> np.ndarray:
+    """
+    Select the samples to keep with Largest-Triangle-Three-Buckets.
+
+    Every value column is scaled to [0, 1] and the triangle areas of the columns
+    are summed, so one set of indices preserves the shape of all columns and they
+    stay aligned on the same time axis.
+
+    Parameters
+    ----------
+    x : np.ndarray
+        The x axis of the samples, usually time.
+    ys : list[np.ndarray]
+        The value columns.
+    threshold : int
+        The number of samples to keep.
+
+    Returns
+    -------
+    np.ndarray
+        The sorted indices of the samples to keep.
+
+    References
+    ----------
+        - https://skemman.is/bitstream/1946/15343/3/SS_MSthesis.pdf
+    """
+    length = len(x)
+    if threshold >= length or threshold < 3:
+        return np.arange(length)
+
+    x = x.astype(np.float64)
+    scaled = []
+    for y in ys:
+        y = y.astype(np.float64)
+        value_range = np.ptp(y)
+        scaled.append((y - y.min()) / value_range if value_range else y * 0.0)
+    y = np.stack(scaled, axis=1) if scaled else np.zeros((length, 1))
+
+    every = (length - 2) / (threshold - 2)
+    edges = np.floor(np.arange(threshold - 1) * every).astype(np.int64) + 1
+    edges[-1] = length - 1
+
+    indices = np.empty(threshold, dtype=np.int64)
+    indices[0], indices[-1] = 0, length - 1
+    selected = 0
+    for bucket in range(threshold - 2):
+        start, end = edges[bucket], edges[bucket + 1]
+        next_start, next_end = (
+            end,
+            edges[bucket + 2] if bucket + 2 < len(edges) else length,
+        )
+        next_x = x[next_start:next_end].mean()
+        next_y = y[next_start:next_end].mean(axis=0)
+
+        areas = np.abs(
+            (x[selected] - next_x) * (y[start:end] - y[selected])
+            - (x[selected] - x[start:end, None]) * (next_y - y[selected])
+        ).sum(axis=1)
+        selected = start + int(np.argmax(areas))
+        indices[bucket + 1] = selected
+
+    return indices
+
+
+def downsample_columns(
+    columns: dict[str, np.ndarray], threshold: int
+) -> dict[str, np.ndarray]:
+    """
+    Downsample decoded stream columns to about `threshold` samples.
+
+    Parameters
+    ----------
+    columns : dict[str, np.ndarray]
+        The stream columns, `latlng` has a lat and lng column.
+    threshold : int
+        The number of samples to keep.
+
+    Returns
+    -------
+    dict[str, np.ndarray]
+        The downsampled columns, columns shorter than the others are dropped.
+    """
+    if not columns:
+        return {}
+
+    length = max(len(values) for values in columns.values())
+    x = columns.get("time", np.arange(length))
+
+    ys = []
+    for name, values in columns.items():
+        if name in ["time", "moving"] or len(values) != length:
+            continue
+        ys += [values] if values.ndim == 1 else list(values.T)
+
+    indices = lttb_indices(x, ys, threshold)
+    return {
+        name: values[indices]
+        for name, values in columns.items()
+        if len(values) == length
+    }
+
+
+def downsample_streams(streams: dict, threshold: int) -> dict:
+    """
+    Downsample the streams of an activity to about `threshold` samples.
+
+    Parameters
+    ----------
+    streams : dict
+        The streams by type, each with the Strava `data` list.
+    threshold : int
+        The number of samples to keep.
+
+    Returns
+    -------
+    dict
+        The downsampled streams in the same format.
+    """
+    columns = {name: np.asarray(stream["data"]) for name, stream in streams.items()}
+    return {
+        name: {"data": values}
+        for name, values in downsample_columns(columns, threshold).items()
+    }
+
+
+def douglas_peucker(points: np.ndarray, tolerance: float) -> np.ndarray:
+    """
+    Simplify a line with the Douglas-Peucker algorithm.
+
+    Parameters
+    ----------
+    points : np.ndarray
+        The [x, y] points of the line.
+    tolerance : float
+        The maximum distance of a removed point to the simplified line.
+
+    Returns
+    -------
+    np.ndarray
+        A mask of the points to keep.
+
+    References
+    ----------
+        - https://en.wikipedia.org/wiki/Ramer%E2%80%93Douglas%E2%80%93Peucker_algorithm
+    """
+    keep = np.zeros(len(points), dtype=bool)
+    if len(points) == 0:
+        return keep
+    keep[[0, -1]] = True
+
+    stack = [(0, len(points) - 1)]
+    while stack:
+        start, end = stack.pop()
+        if end - start < 2:
+            continue
+
+        segment = points[end] - points[start]
+        offsets = points[start + 1 : end] - points[start]
+        length = np.hypot(*segment)
+        if length:
+            distances = (
+                np.abs(segment[0] * offsets[:, 1] - segment[1] * offsets[:, 0]) / length
+            )
+        else:
+            distances = np.hypot(offsets[:, 0], offsets[:, 1])
+
+        index = int(np.argmax(distances))
+        if distances[index] > tolerance:
+            split = start + 1 + index
+            keep[split] = True
+            stack += [(start, split), (split, end)]
+
+    return keep
+
+
+def simplified_polyline(streams: dict, tolerance: float = 10.0) -> str | None:
+    """
+    Simplify the GPS track of an activity for map previews.
+
+    Parameters
+    ----------
+    streams : dict
+        The streams by type, each with the Strava `data` list.
+    tolerance : float, optional
+        The maximum deviation in meters (default is 10.0).
+
+    Returns
+    -------
+    str | None
+        The simplified track as a Google polyline, None without a GPS track.
+    """
+    latlng = np.asarray(streams.get("latlng", {}).get("data") or [], dtype=np.float64)
+    if len(latlng) == 0:
+        return None
+
+    # Project to meters, accurate enough at the scale of a single activity
+    meters_per_degree = 111_320
+    points = np.column_stack(
+        (
+            latlng[:, 1] * meters_per_degree * np.cos(np.radians(latlng[:, 0].mean())),
+            latlng[:, 0] * meters_per_degree,
+        )
+    )
+    return stream_codec.encode_polyline(latlng[douglas_peucker(points, tolerance)])
+
+
+def cleaning_settings() -> dict:
+    """Settings of the stream cleaning"""
+    return {
+        "max_gap_seconds": 10,
+        "heartrate_range": [30, 230],
+        "heartrate_spike_bpm": 25,
+        "median_window": 5,
+    }
+
+
+def rolling_median(values: np.ndarray, window: int) -> np.ndarray:
+    """Centered rolling median, the edges are padded with the edge values"""
+    padded = np.pad(values, window // 2, mode="edge")
+    windows = np.lib.stride_tricks.sliding_window_view(padded, window)
+    return np.median(windows, axis=1)
+
+
+def interpolate_invalid(
+    time: np.ndarray, values: np.ndarray, valid: np.ndarray
+) -> np.ndarray:
+    """Replace invalid samples by interpolating the valid samples around them"""
+    if valid.all() or not valid.any():
+        return values
+    return np.interp(time, time[valid], values[valid])
+
+
+def clean_heartrate(time: np.ndarray, heartrate: np.ndarray) -> np.ndarray:
+    """Interpolate heart rate dropouts and spikes"""
+    settings = cleaning_settings()
+    low, high = settings["heartrate_range"]
+
+    heartrate = heartrate.astype(np.float64)
+    valid = (heartrate >= low) & (heartrate <= high)
+    filled = interpolate_invalid(time, heartrate, valid)
+    median = rolling_median(filled, settings["median_window"])
+    valid &= np.abs(filled - median) <= settings["heartrate_spike_bpm"]
+    return interpolate_invalid(time, heartrate, valid)
+
+
+def replace_null_samples(name: str, data: list) -> np.ndarray | None:
+    """
+    Replace the null samples of a stream column.
+
+    Null samples of `moving` become False, those of other columns are interpolated
+    from the samples around them. None when the column can not be used.
+    """
+    if not any(value is None for value in data):
+        return np.asarray(data)
+    if name == "moving":
+        return np.array([bool(value) for value in data])
+
+    valid = np.array([value is not None for value in data])
+    if name == "latlng" or not valid.any():
+        return None
+    values = np.array(
+        [np.nan if value is None else value for value in data], dtype=np.float64
+    )
+    return interpolate_invalid(np.arange(len(values)), values, valid)
+
+
+def clean_streams(streams: dict) -> dict:
+    """
+    Clean the streams of an activity and resample them onto a 1 Hz grid.
+
+    Null samples are replaced, heart rate dropouts and spikes are interpolated,
+    distance is made monotonic and every column is resampled to one sample per second. Pauses longer than
+    `max_gap_seconds` are kept as stopped time: not moving, zero speed and
+    cadence and constant distance.
+
+    Parameters
+    ----------
+    streams : dict
+        The streams by type, each with the Strava `data` list.
+
+    Returns
+    -------
+    dict
+        The cleaned streams in the same format, empty without a time stream.
+    """
+    if len(streams.get("time", {}).get("data") or []) < 2:
+        return {}
+
+    time = np.asarray(streams["time"]["data"], dtype=np.float64)
+    increasing = np.concatenate(([True], np.diff(time) > 0))
+    time = time[increasing]
+    selected = {
+        name: replace_null_samples(name, stream["data"])
+        for name, stream in streams.items()
+        if name != "time" and len(stream["data"]) == len(increasing)
+    }
+    columns = {
+        name: values[increasing]
+        for name, values in selected.items()
+        if values is not None
+    }
+
+    if "heartrate" in columns:
+        columns["heartrate"] = clean_heartrate(time, columns["heartrate"])
+    if "distance" in columns:
+        columns["distance"] = np.maximum.accumulate(columns["distance"])
+    if "velocity_smooth" in columns:
+        columns["velocity_smooth"] = np.clip(columns["velocity_smooth"], 0, None)
+
+    grid = np.arange(time[0], time[-1] + 1)
+    previous = np.searchsorted(time, grid, "right") - 1
+    following = np.minimum(previous + 1, len(time) - 1)
+    in_gap = (
+        time[following] - time[previous] > cleaning_settings()["max_gap_seconds"]
+    ) & (grid > time[previous])
+
+    output = {"time": grid.astype(np.int64)}
+    for name, values in columns.items():
+        if name == "moving":
+            resampled = values[previous].astype(bool) & ~in_gap
+        elif name == "distance":
+            resampled = np.where(
+                in_gap, values[previous], np.interp(grid, time, values)
+            )
+        elif values.ndim == 2:
+            resampled = np.column_stack(
+                [np.interp(grid, time, column) for column in values.T]
+            )
+        else:
+            resampled = np.interp(grid, time, values.astype(np.float64))
+            if name in ["velocity_smooth", "cadence", "watts"]:
+                resampled[in_gap] = 0
+        output[name] = resampled
+
+    return {name: {"data": values.tolist()} for name, values in output.items()}
@@ -0,0 +1,565 @@
+"""Storage of activity streams in CosmosDB"""
+
+import datetime
+import json
+import logging
+import math
+from functools import partial
+
+import numpy as np
+from azure.cosmos import exceptions
+
+from shared_code import archive_storage, cosmosdb_module, stream_codec, stream_helpers
+
+
+def max_document_size() -> int:
+    """Maximum size in bytes of a stream document, below the 2 MB Cosmos limit"""
+    return 1_500_000
+
+
+def pyramid_levels() -> list[int]:
+    """Number of samples of the downsampled stream levels"""
+    return [100, 500, 2000]
+
+
+def archive_format() -> str:
+    """Format name of the stub left behind by archived streams"""
+    return "archived-v1"
+
+
+def rehydrate_grace_days() -> int:
+    """Days a rehydrated activity stays in the streams container"""
+    return 30
+
+
+def chunk_document_id(activity_id: str, index: int) -> str:
+    """Id of a stream chunk document"""
+    return f"{activity_id}_chunk_{index}"
+
+
+def clean_document_id(activity_id: str) -> str:
+    """Id of the cleaned 1 Hz stream document"""
+    return f"{activity_id}_clean"
+
+
+def level_document_id(activity_id: str, resolution: int) -> str:
+    """Id of a downsampled stream document"""
+    return f"{activity_id}_res_{resolution}"
+
+
+def create_level_documents(activity_id: str, user_id: str, streams: dict) -> list:
+    """Create the downsampled stream documents that are smaller than the streams"""
+    if not streams:
+        return []
+
+    length = max(len(stream["data"]) for stream in streams.values())
+    return [
+        {
+            "id": level_document_id(activity_id, resolution),
+            "userId": user_id,
+            "activityId": activity_id,
+            "resolution": resolution,
+            **stream_codec.encode_streams(
+                stream_helpers.downsample_streams(streams, resolution)
+            ),
+        }
+        for resolution in pyramid_levels()
+        if resolution < length
+    ]
+
+
+def select_level(resolutions: list[int], resolution: int) -> int | None:
+    """Get the smallest stored level with at least the requested resolution"""
+    levels = [level for level in sorted(resolutions) if level >= resolution]
+    return levels[0] if levels else None
+
+
+def split_streams(streams: dict, chunk_length: int) -> list[dict]:
+    """Split the streams in chunks of `chunk_length` samples"""
+    length = max(len(stream["data"]) for stream in streams.values())
+    return [
+        {
+            name: {"data": stream["data"][start : start + chunk_length]}
+            for name, stream in streams.items()
+        }
+        for start in range(0, length, chunk_length)
+    ]
+
+
+def create_stream_documents(activity_id: str, user_id: str, streams: dict) -> list:
+    """
+    Create the stream documents of an activity.
+
+    Streams that fit in a single document are stored as one encoded document.
+    Larger streams are split in time ranged chunk documents, the activity
+    document then holds a manifest of the chunks.
+
+    Parameters
+    ----------
+    activity_id : str
+        The id of the activity.
+    user_id : str
+        The id of the user.
+    streams : dict
+        The streams by type, each with the Strava `data` list.
+
+    Returns
+    -------
+    list
+        The stream documents, the activity document first.
+    """
+    document = {
+        "id": activity_id,
+        "userId": user_id,
+        **stream_codec.encode_streams(streams),
+    }
+    size = len(json.dumps(document))
+    if size <= max_document_size() or not streams:
+        return [document]
+
+    # Leave headroom as deltas restart and compress worse per chunk
+    chunk_count = math.ceil(size / (max_document_size() * 0.8))
+    chunk_length = math.ceil(document["length"] / chunk_count)
+
+    chunks = []
+    for index, chunk in enumerate(split_streams(streams, chunk_length)):
+        time = chunk.get("time", {"data": [None]})["data"]
+        chunks.append(
+            {
+                "id": chunk_document_id(activity_id, index),
+                "userId": user_id,
+                "activityId": activity_id,
+                "chunk": index,
+                "start_index": index * chunk_length,
+                "start_time": time[0],
+                "end_time": time[-1],
+                **stream_codec.encode_streams(chunk),
+            }
+        )
+
+    manifest = {
+        "id": activity_id,
+        "userId": user_id,
+        "format": "chunked-v1",
+        "length": document["length"],
+        "columns": list(streams),
+        "chunks": [
+            {
+                "id": chunk["id"],
+                "start_index": chunk["start_index"],
+                "length": chunk["length"],
+                "start_time": chunk["start_time"],
+                "end_time": chunk["end_time"],
+            }
+            for chunk in chunks
+        ],
+    }
+
+    return [manifest, *chunks]
+
+
+def write_streams(
+    activity_id: str, user_id: str, streams: dict, levels: bool = True
+) -> dict:
+    """Write the streams of an activity, replacing documents of a previous version"""
+    documents = create_stream_documents(activity_id, user_id, streams)
+    levels = create_level_documents(activity_id, user_id, streams) if levels else []
+    documents[0]["resolutions"] = [level["resolution"] for level in levels]
+    documents += levels
+    container = cosmosdb_module.cosmosdb_container("streams")
+
+    # The streams are partitioned on id, the previous version is a single partition
+    previous = container.query_items(
+        query="SELECT c.chunks, c.resolutions FROM c WHERE c.id = @activity_id",
+        parameters=[{"name": "@activity_id", "value": activity_id}],
+        partition_key=activity_id,
+    )
+    stale_documents = set()
+    for item in previous:
+        stale_documents |= {chunk["id"] for chunk in item.get("chunks", [])}
+        stale_documents |= {
+            level_document_id(activity_id, resolution)
+            for resolution in item.get("resolutions", [])
+        }
+    stale_documents -= {document["id"] for document in documents}
+
+    # Write chunks and levels before the document that refers to them
+    for document in [*documents[1:], documents[0]]:
+        cosmosdb_module.container_function_with_back_off(
+            partial(container.upsert_item, document)
+        )
+    for document_id in stale_documents:
+        cosmosdb_module.container_function_with_back_off(
+            partial(container.delete_item, document_id, partition_key=document_id)
+        )
+
+    return documents[0]
+
+
+def select_range(
+    columns: dict[str, np.ndarray],
+    start: float | None = None,
+    end: float | None = None,
+    axis: str = "time",
+) -> dict[str, np.ndarray]:
+    """Select the samples within a range of a monotonic column, time by default"""
+    if start is None and end is None:
+        return columns
+
+    values = columns[axis]
+    first = 0 if start is None else int(np.searchsorted(values, start, "left"))
+    last = len(values) if end is None else int(np.searchsorted(values, end, "right"))
+    return {name: column[first:last] for name, column in columns.items()}
+
+
+def overlapping_chunks(
+    chunks: list[dict], start_time: float | None, end_time: float | None
+) -> list[dict]:
+    """Get the chunks that overlap with a time range"""
+    return [
+        chunk
+        for chunk in chunks
+        if (
+            start_time is None
+            or chunk["end_time"] is None
+            or chunk["end_time"] >= start_time
+        )
+        and (
+            end_time is None
+            or chunk["start_time"] is None
+            or chunk["start_time"] <= end_time
+        )
+    ]
+
+
+def projection_query(columns: list[str] | None) -> str:
+    """
+    Query for a stream document that only selects the requested columns.
+
+    Both encoded and legacy documents keep every column as a top level field, so
+    the projection works for either format.
+    """
+    if columns is None:
+        return "SELECT * FROM c WHERE c.id = @id"
+
+    unknown_columns = set(columns) - set(stream_codec.column_specs())
+    if unknown_columns:
+        raise ValueError(f"Unknown stream columns {sorted(unknown_columns)}")
+
+    fields = ["c.id", "c.userId", "c.format", "c.length", "c.chunks", "c.resolutions"]
+    fields += [f'c["{column}"]' for column in columns]
+    return f"SELECT {', '.join(fields)} FROM c WHERE c.id = @id"  # noqa: S608
+
+
+def read_stream_document(document_id: str, columns: list[str] | None) -> dict | None:
+    """Read a stream document with only the requested columns"""
+    container = cosmosdb_module.cosmosdb_container("streams")
+    items = list(
+        container.query_items(
+            query=projection_query(columns),
+            parameters=[{"name": "@id", "value": document_id}],
+            partition_key=document_id,
+        )
+    )
+    return items[0] if items else None
+
+
+def read_current_document(document_id: str, columns: list[str] | None) -> dict | None:
+    """
+    Read a stream document, rehydrating it first when it was archived.
+
+    Returns None when the document is still a stub because the rehydration failed.
+    """
+    document = read_stream_document(document_id, columns)
+    if document and document.get("format") == archive_format():
+        rehydrate_streams(document_id)
+        document = read_stream_document(document_id, columns)
+    if document and document.get("format") == archive_format():
+        logging.error(f"Could not rehydrate the streams of {document_id}")
+        return None
+    return document
+
+
+def read_stream_version(activity_id: str) -> dict | None:
+    """Read the owner and `_etag` of the stream document of an activity"""
+    container = cosmosdb_module.cosmosdb_container("streams")
+    items = list(
+        container.query_items(
+            query="SELECT c.userId, c._etag FROM c WHERE c.id = @id",
+            parameters=[{"name": "@id", "value": activity_id}],
+            partition_key=activity_id,
+        )
+    )
+    return items[0] if items else None
+
+
+def read_streams(
+    activity_id: str,
+    user_id: str,
+    columns: list[str] | None = None,
+    start_time: float | None = None,
+    end_time: float | None = None,
+) -> dict[str, np.ndarray] | None:
+    """
+    Read the streams of an activity.
+
+    Parameters
+    ----------
+    activity_id : str
+        The id of the activity.
+    user_id : str
+        The id of the user, streams of other users are not returned.
+    columns : list[str] | None, optional
+        The columns to read, all columns when None (default is None). Only these
+        columns are selected from CosmosDB.
+    start_time : float | None, optional
+        Only return samples from this time in seconds (default is None).
+    end_time : float | None, optional
+        Only return samples up to this time in seconds (default is None).
+
+    Returns
+    -------
+    dict[str, np.ndarray] | None
+        The decoded columns, None when the activity has no streams.
+    """
+    ranged = start_time is not None or end_time is not None
+    decode_columns = columns
+    if ranged and columns is not None and "time" not in columns:
+        decode_columns = ["time", *columns]
+
+    document = read_current_document(activity_id, decode_columns)
+    if not document or document["userId"] != user_id:
+        return None
+
+    if document.get("format") != "chunked-v1":
+        output = stream_codec.decode_streams(document, decode_columns)
+    else:
+        parts = []
+        for chunk in overlapping_chunks(document["chunks"], start_time, end_time):
+            chunk_document = read_stream_document(chunk["id"], decode_columns)
+            if not chunk_document:
+                logging.error(f"Missing stream chunk {chunk['id']}")
+                return None
+            parts.append(stream_codec.decode_streams(chunk_document, decode_columns))
+        output = {
+            name: np.concatenate([part[name] for part in parts])
+            for name in (parts[0] if parts else {})
+        }
+
+    if ranged and "time" in output:
+        output = select_range(output, start_time, end_time)
+    if columns is not None:
+        output = {name: output[name] for name in columns if name in output}
+
+    return output
+
+
+def read_stream_level(
+    activity_id: str,
+    user_id: str,
+    resolution: int,
+    columns: list[str] | None = None,
+) -> dict[str, np.ndarray] | None:
+    """
+    Read the downsampled streams of an activity.
+
+    Parameters
+    ----------
+    activity_id : str
+        The id of the activity.
+    user_id : str
+        The id of the user, streams of other users are not returned.
+    resolution : int
+        The number of samples needed, the smallest stored level with at least this
+        many samples is read. The full streams are read when there is none.
+    columns : list[str] | None, optional
+        The columns to read, all columns when None (default is None).
+
+    Returns
+    -------
+    dict[str, np.ndarray] | None
+        The decoded columns, None when the activity has no streams.
+    """
+    document = read_current_document(activity_id, [])
+    if not document or document["userId"] != user_id:
+        return None
+
+    level = select_level(document.get("resolutions") or [], resolution)
+    if level is None:
+        return read_streams(activity_id, user_id, columns)
+
+    level_document = read_stream_document(
+        level_document_id(activity_id, level), columns
+    )
+    if not level_document:
+        logging.error(f"Missing stream level {level} of {activity_id}")
+        return None
+
+    return stream_codec.decode_streams(level_document, columns)
+
+
+def query_streams(
+    activity_id: str,
+    user_id: str,
+    columns: list[str] | None = None,
+    value_range: tuple[str, float | None, float | None] | None = None,
+    resolution: int | None = None,
+) -> dict[str, np.ndarray] | None:
+    """
+    Read a selection of the streams of an activity.
+
+    Without a range the precomputed levels answer resolution requests, a range is
+    read from the full streams and downsampled afterwards so zooming in keeps its
+    detail.
+
+    Parameters
+    ----------
+    activity_id : str
+        The id of the activity.
+    user_id : str
+        The id of the user, streams of other users are not returned.
+    columns : list[str] | None, optional
+        The columns to read, all columns when None (default is None).
+    value_range : tuple[str, float | None, float | None] | None, optional
+        The `time` or `distance` axis with the start and end of the range
+        (default is None).
+    resolution : int | None, optional
+        The number of samples to return at most (default is None).
+
+    Returns
+    -------
+    dict[str, np.ndarray] | None
+        The decoded columns, None when the activity has no streams.
+    """
+    axis, start, end = value_range or ("time", None, None)
+    ranged = start is not None or end is not None
+
+    if resolution and not ranged:
+        return read_stream_level(activity_id, user_id, resolution, columns)
+
+    if axis == "time":
+        output = read_streams(activity_id, user_id, columns, start, end)
+    else:
+        read_columns = columns
+        if ranged and columns is not None and axis not in columns:
+            read_columns = [*columns, axis]
+        output = read_streams(activity_id, user_id, read_columns)
+        if output is not None and ranged and axis in output:
+            output = select_range(output, start, end, axis)
+        if output is not None and columns is not None:
+            output = {name: output[name] for name in columns if name in output}
+
+    if output is not None and resolution:
+        output = stream_helpers.downsample_columns(output, resolution)
+
+    return output
+
+
+def activity_stream_documents(activity_id: str) -> list[dict]:
+    """Get every stream document of an activity, raw and cleaned"""
+    return cosmosdb_module.get_cosmosdb_items(
+        "SELECT * FROM c WHERE c.id IN (@id, @clean_id)"
+        " OR c.activityId IN (@id, @clean_id)",
+        [
+            {"name": "@id", "value": activity_id},
+            {"name": "@clean_id", "value": clean_document_id(activity_id)},
+        ],
+        "streams",
+    )
+
+
+def archive_streams(activity_id: str, user_id: str) -> bool:
+    """
+    Move the streams of an activity to the compressed archive.
+
+    Every stream document of the activity is archived together, the activity
+    document is replaced by a stub that points to the archive and the other
+    documents are deleted. Streams that were rehydrated recently are kept.
+
+    Parameters
+    ----------
+    activity_id : str
+        The id of the activity.
+    user_id : str
+        The id of the user.
+
+    Returns
+    -------
+    bool
+        Whether the streams were archived.
+    """
+    documents = activity_stream_documents(activity_id)
+    main = next(
+        (document for document in documents if document["id"] == activity_id), None
+    )
+    if not main or main.get("format") == archive_format():
+        return False
+
+    rehydrated_at = main.get("rehydrated_at")
+    grace_period = datetime.timedelta(days=rehydrate_grace_days())
+    if (
+        rehydrated_at
+        and datetime.datetime.fromisoformat(rehydrated_at)
+        > datetime.datetime.now(datetime.timezone.utc) - grace_period
+    ):
+        return False
+
+    key = archive_storage.archive_key(user_id, activity_id)
+    archive_storage.write_archive(key, documents)
+
+    container = cosmosdb_module.cosmosdb_container("streams")
+    stub = {
+        "id": activity_id,
+        "userId": user_id,
+        "format": archive_format(),
+        "archive": key,
+        "archived_at": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+    }
+    cosmosdb_module.container_function_with_back_off(
+        partial(container.upsert_item, stub)
+    )
+    for document in documents:
+        if document["id"] != activity_id:
+            cosmosdb_module.container_function_with_back_off(
+                partial(
+                    container.delete_item, document["id"], partition_key=document["id"]
+                )
+            )
+
+    return True
+
+
+def rehydrate_streams(activity_id: str) -> bool:
+    """Restore archived streams of an activity to the streams container"""
+    stub = read_stream_document(activity_id, None)
+    if not stub or stub.get("format") != archive_format():
+        return False
+
+    documents = archive_storage.read_archive(stub["archive"])
+    if documents is None:
+        logging.error(f"Missing stream archive {stub['archive']}")
+        return False
+
+    logging.info(f"Rehydrating streams of {activity_id}")
+    container = cosmosdb_module.cosmosdb_container("streams")
+    main = next(document for document in documents if document["id"] == activity_id)
+    main["rehydrated_at"] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+    # Replace the stub last so a failed rehydration is retried on the next read
+    others = [document for document in documents if document is not main]
+    for document in [*others, main]:
+        cosmosdb_module.container_function_with_back_off(
+            partial(container.upsert_item, document)
+        )
+    archive_storage.delete_archive(stub["archive"])
+
+    try:
+        cosmosdb_module.patch_cosmosdb_item(
+            activity_id,
+            "activities",
+            cosmosdb_module.create_set_operations({"streams_archived": False}),
+        )
+    except exceptions.CosmosResourceNotFoundError:
+        logging.warning(f"Activity {activity_id} of rehydrated streams not found")
+
+    return True
@@ -1,12 +1,17 @@
 """Helper functions for getting user data"""
 
 import base64
+import copy
+import functools
 import json
 import logging
+import time
 
 import azure.functions as func
+from azure.core import MatchConditions
+from azure.cosmos import exceptions
 
-from shared_code import cosmosdb_module
+from shared_code import cache_helpers, cosmosdb_module, get_config
 
 
 def get_user(
@@ -22,19 +27,60 @@ def get_user(
     return headers
 
 
+@functools.cache
+def settings_cache() -> dict:
+    """The cached user settings of this process by user id"""
+    settings = get_config.get_user_settings_cache()
+    return {
+        "entries": cache_helpers.LRUCache(settings["max_users"]),
+        "ttl_seconds": settings["ttl_seconds"],
+    }
+
+
+def read_user_settings(userid: str, etag: str | None = None) -> dict | None:
+    """
+    Point read the settings of a user.
+
+    With an `etag` the read is conditional and returns None while the settings
+    still have that `_etag`, which costs less than reading them again.
+    """
+    container = cosmosdb_module.cosmosdb_container("users")
+    kwargs = {}
+    if etag:
+        kwargs = {"etag": etag, "match_condition": MatchConditions.IfModified}
+    try:
+        return container.read_item(item=userid, partition_key=userid, **kwargs)
+    except exceptions.CosmosResourceNotFoundError:
+        raise ValueError(f"No user found with id {userid}") from None
+
+
 def get_user_settings(userid: str) -> dict:
-    """Get user data and strava client"""
+    """
+    Get the settings of a user.
+
+    Settings are cached per process by user id together with their `_etag`. After
+    the TTL they are revalidated with a conditional read, so unchanged settings
+    are not transferred again. Writers in this process invalidate them with
+    `invalidate_user_settings`, writes elsewhere are seen after the TTL.
+    """
     # suppress logger output
     logger = logging.getLogger("azure")
     logger.setLevel(logging.CRITICAL)
 
-    parameters = [{"name": "@userid", "value": userid}]
+    cache = settings_cache()
+    entry = cache["entries"].get(userid)
+    if entry is None or time.monotonic() - entry["checked"] > cache["ttl_seconds"]:
+        user_settings = read_user_settings(userid, entry["etag"] if entry else None)
+        if user_settings is not None:
+            entry = {"etag": user_settings["_etag"], "settings": user_settings}
+            for key in ["_rid", "_self", "_etag", "_attachments", "_ts"]:
+                user_settings.pop(key, None)
+        entry["checked"] = time.monotonic()
+        cache["entries"].set(userid, entry)
 
-    user_settings = cosmosdb_module.get_cosmosdb_items(
-        "SELECT * FROM c WHERE c.id = @userid", parameters, "users"
-    )
+    return copy.deepcopy(entry["settings"])
 
-    if not user_settings:
-        raise ValueError(f"No user found with id {userid}")
 
-    return user_settings[0]
+def invalidate_user_settings(userid: str) -> None:
+    """Remove the cached settings of a user after they changed"""
+    settings_cache()["entries"].pop(userid)
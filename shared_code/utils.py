@@ -1,8 +1,15 @@
 """General utility functions"""
 
 
+import functools
+from typing import TYPE_CHECKING
+
 import azure.functions as func
-from jsonschema import validate
+
+from shared_code import http_helpers, schemas
+
+if TYPE_CHECKING:
+    from jsonschema.protocols import Validator
 
 
 def get_unique_items(items: list, key_to_filter: str) -> list:
@@ -40,14 +47,47 @@ def create_params_func_request(
     return req
 
 
-def validate_json(instance, schema) -> None | func.HttpResponse:
-    """Validate input."""
-    try:
-        validate(instance=instance, schema=schema)
+@functools.cache
+def get_validator(schema_name: str) -> "Validator":
+    """
+    Get the compiled validator of a schema in `schemas`.
+
+    The schema is checked against its meta-schema and compiled once per process,
+    later calls only validate the instance.
+    """
+    from jsonschema.validators import validator_for
+
+    schema = getattr(schemas, schema_name)()
+    validator_class = validator_for(schema)
+    validator_class.check_schema(schema)
+    return validator_class(schema)
+
+
+def validation_errors(instance, schema_name: str) -> list[dict]:
+    """Get the validation errors of an instance with the path of each error"""
+    errors = sorted(
+        get_validator(schema_name).iter_errors(instance),
+        key=lambda error: [str(part) for part in error.absolute_path],
+    )
+    return [
+        {
+            "path": "/" + "/".join(str(part) for part in error.absolute_path),
+            "message": error.message,
+            "validator": error.validator,
+        }
+        for error in errors
+    ]
+
+
+def validate_json(instance, schema_name: str) -> None | func.HttpResponse:
+    """Validate input against a schema in `schemas`."""
+    errors = validation_errors(instance, schema_name)
+    if not errors:
         return None
-    except Exception:
-        return func.HttpResponse(
-            body='{"result": "Schema validation failed"}',
-            mimetype="application/json",
-            status_code=400,
-        )
+    return func.HttpResponse(
+        body=http_helpers.dumps(
+            {"result": "Schema validation failed", "errors": errors}
+        ),
+        mimetype="application/json",
+        status_code=400,
+    )
@@ -0,0 +1,136 @@
+"""Helper functions for the rolling VO2 max trend"""
+
+from datetime import date, timedelta
+
+from shared_code import cosmosdb_module
+
+
+def trend_settings() -> dict:
+    """Settings of the rolling VO2 max estimate"""
+    return {
+        "window_days": 42,
+        "top_n": 5,
+    }
+
+
+def vo2max_document_id(user_id: str) -> str:
+    """Id of the VO2 max trend document of a user"""
+    return f"vo2max_{user_id}"
+
+
+def default_vo2max_document(user_id: str) -> dict:
+    """Empty VO2 max trend document"""
+    return {
+        "id": vo2max_document_id(user_id),
+        "userId": user_id,
+        "type": "vo2max",
+        "activities": {},
+        "trend": [],
+    }
+
+
+def calculate_rolling_vo2max(estimates: list[dict], day: str) -> float | None:
+    """
+    Calculate the rolling VO2 max estimate of a day.
+
+    The highest estimates within the window are averaged, weighted by how recent
+    they are, so a single outlier or an easy week doesn't move the trend.
+
+    Parameters
+    ----------
+    estimates : list[dict]
+        The estimates with a `date` (YYYY-MM-DD) and an `estimated_vo2_max`.
+    day : str
+        The day to calculate the estimate for.
+
+    Returns
+    -------
+    float | None
+        The rolling VO2 max estimate, None when there are no estimates in the window.
+    """
+    settings = trend_settings()
+    end = date.fromisoformat(day)
+    start = end - timedelta(days=settings["window_days"] - 1)
+
+    in_window = [
+        estimate
+        for estimate in estimates
+        if start <= date.fromisoformat(estimate["date"]) <= end
+    ]
+    if not in_window:
+        return None
+
+    top_n = sorted(in_window, key=lambda x: x["estimated_vo2_max"], reverse=True)[
+        : settings["top_n"]
+    ]
+    weights = [
+        1 - (end - date.fromisoformat(estimate["date"])).days / settings["window_days"]
+        for estimate in top_n
+    ]
+
+    return sum(
+        estimate["estimated_vo2_max"] * weight
+        for estimate, weight in zip(top_n, weights)
+    ) / sum(weights)
+
+
+def is_included(activity: dict) -> bool:
+    """Check if an activity counts towards the VO2 max trend"""
+    user_input = activity.get("user_input") or {}
+    vo2max_estimate = activity.get("vo2max_estimate") or {}
+    return (
+        user_input.get("include_in_vo2max_estimate", True)
+        and vo2max_estimate.get("estimated_vo2_max") is not None
+    )
+
+
+def update_vo2max_document(document: dict, activity: dict) -> dict:
+    """Update the VO2 max trend document with a calculated or excluded activity"""
+    activities = document["activities"]
+    affected_dates = []
+
+    previous = activities.pop(activity["id"], None)
+    if previous:
+        affected_dates.append(previous["date"])
+
+    if is_included(activity):
+        activities[activity["id"]] = {
+            "date": activity["start_date_local"][:10],
+            "estimated_vo2_max": activity["vo2max_estimate"]["estimated_vo2_max"],
+        }
+        affected_dates.append(activities[activity["id"]]["date"])
+
+    if not affected_dates:
+        return document
+
+    # Only days within one window after a changed estimate are affected
+    window_days = trend_settings()["window_days"]
+    start = min(affected_dates)
+    end = (
+        date.fromisoformat(max(affected_dates)) + timedelta(days=window_days - 1)
+    ).isoformat()
+
+    estimates = list(activities.values())
+    days = sorted(
+        {estimate["date"] for estimate in estimates if start <= estimate["date"] <= end}
+    )
+    trend = [point for point in document["trend"] if not start <= point["date"] <= end]
+    trend += [
+        {"date": day, "vo2max": calculate_rolling_vo2max(estimates, day)}
+        for day in days
+    ]
+    document["trend"] = sorted(trend, key=lambda x: x["date"])
+
+    return document
+
+
+def update_vo2max(activity: dict) -> dict:
+    """Update the materialized VO2 max trend of a user with an activity"""
+    user_id = activity["userId"]
+
+    return cosmosdb_module.update_cosmosdb_item(
+        vo2max_document_id(user_id),
+        "metrics",
+        lambda document: update_vo2max_document(document, activity),
+        default_vo2max_document(user_id),
+    )
@@ -0,0 +1,21 @@
+"""Shared fixtures"""
+
+import pytest
+
+from shared_code import response_cache, user_helpers
+
+
+@pytest.fixture(autouse=True)
+def _clear_response_cache():
+    """Start every test with an empty response cache"""
+    response_cache.cache_state.cache_clear()
+    yield
+    response_cache.cache_state.cache_clear()
+
+
+@pytest.fixture(autouse=True)
+def _clear_user_settings_cache():
+    """Start every test with an empty user settings cache"""
+    user_helpers.settings_cache.cache_clear()
+    yield
+    user_helpers.settings_cache.cache_clear()
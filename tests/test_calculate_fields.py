@@ -0,0 +1,160 @@
+"""Test calculate_fields"""
+
+import json
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+from app.calculate_fields import calculate_custom_fields, calculate_fields
+from shared_code import stream_codec
+
+with open(Path(__file__).parent / "data" / "user_settings.json", "r") as f:
+    mock_user_settings = json.load(f)
+
+mock_user_settings = {
+    **mock_user_settings,
+    "heart_rate": {"max": 200, "resting": 50, "threshold": 180, "zones": []},
+    "pace": {"threshold": 4.0, "zones": []},
+    "gender": "male",
+    "preferences": {
+        "preferred_tss_type": "hr",
+        "units": "metric",
+        "dark_mode": "system",
+    },
+}
+
+
+def create_activity() -> dict:
+    """Create an enriched activity"""
+    return {
+        "id": "1",
+        "userId": "123",
+        "type": "Run",
+        "has_heartrate": True,
+        "average_heartrate": 150.0,
+        "average_speed": 3.0,
+        "distance": 1200.0,
+        "moving_time": 400,
+        "start_date_local": "2023-11-05T09:48:49Z",
+        "laps": [
+            {
+                "elapsed_time": 200,
+                "moving_time": 200,
+                "average_speed": 3.0,
+            },
+            {
+                "elapsed_time": 200,
+                "moving_time": 200,
+                "average_speed": 3.0,
+            },
+        ],
+        "custom_fields_calculated": False,
+        "calculation_versions": {},
+    }
+
+
+def create_stream() -> dict:
+    """Create the streams of an activity"""
+    return {
+        "id": "1",
+        "userId": "123",
+        "time": {"data": list(range(400))},
+        "heartrate": {"data": [140] * 200 + [160] * 200},
+        "distance": {"data": [i * 3.0 for i in range(400)]},
+    }
+
+
+class TestCalculateCustomFields:
+    """Test calculate_custom_fields"""
+
+    def test_all_calculators(self):
+        """Test all calculators"""
+        activity = calculate_custom_fields(
+            create_activity(),
+            stream_codec.decode_streams(create_stream()),
+            mock_user_settings,
+        )
+
+        assert activity["custom_fields_calculated"]
+        assert activity["laps"][0]["average_heartrate"] == 140
+        assert activity["laps"][1]["average_heartrate"] == 160
+        assert "start_index" not in activity["laps"][0]
+        assert activity["hr_trimp"] == sum(lap["hr_trimp"] for lap in activity["laps"])
+        assert activity["pace_reserve"] == 0.75
+        assert activity["vo2max_estimate"]["workout_vo2_max"] is not None
+        assert activity["mean_max_curves"]["speed"][0] == 3.0
+        assert set(activity["calculation_versions"]) == {
+            "hr_reserve",
+            "pace_reserve",
+            "hr_trimp",
+            "pace_trimp",
+            "vo2max_estimate",
+            "mean_max_curves",
+        }
+
+    def test_selected_calculators(self):
+        """Test only the selected calculators run"""
+        activity = calculate_custom_fields(
+            create_activity(), {}, mock_user_settings, ["pace_reserve", "pace_trimp"]
+        )
+
+        assert activity["pace_trimp"] is not None
+        assert "hr_trimp" not in activity
+        assert activity["calculation_versions"] == {
+            "pace_reserve": 1,
+            "pace_trimp": 1,
+        }
+
+
+class TestCalculateFields:
+    """Test calculate_fields"""
+
+    @patch("app.calculate_fields.curve_helpers")
+    @patch("app.calculate_fields.vo2max_helpers")
+    @patch("app.calculate_fields.fitness_helpers")
+    @patch("shared_code.cosmosdb_module.get_cosmosdb_items")
+    def test_selected_calculators(
+        self,
+        mock_get_cosmosdb_items,
+        mock_fitness_helpers,
+        mock_vo2max_helpers,
+        mock_curve_helpers,
+    ):
+        """Test a message with calculators skips the streams and other metrics"""
+        queue = MagicMock()
+        queue.get_json.return_value = {
+            "activity_id": "1",
+            "user_id": "123",
+            "calculators": ["pace_reserve"],
+        }
+        mock_get_cosmosdb_items.return_value = [{**create_activity(), "_etag": "etag"}]
+
+        func_call = calculate_fields.build().get_user_function()
+        with (
+            patch("shared_code.user_helpers.get_user_settings") as get_user_settings,
+            patch("shared_code.cosmosdb_module.cosmosdb_container") as container,
+        ):
+            get_user_settings.return_value = mock_user_settings
+            func_call(queue)
+
+        mock_get_cosmosdb_items.assert_called_once()
+        patch_item = container.return_value.patch_item
+        patch_item.assert_called_once()
+        assert patch_item.call_args.kwargs["etag"] == "etag"
+        operations = {
+            operation["path"]: operation["value"]
+            for operation in patch_item.call_args.kwargs["patch_operations"]
+        }
+        assert set(operations) == {
+            "/pace_reserve",
+            "/pace_trimp",
+            "/laps",
+            "/calculation_versions",
+            "/custom_fields_calculated",
+        }
+        assert operations["/calculation_versions"] == {
+            "pace_reserve": 1,
+            "pace_trimp": 1,
+        }
+        mock_fitness_helpers.update_fitness.assert_called_once()
+        mock_vo2max_helpers.update_vo2max.assert_not_called()
+        mock_curve_helpers.update_curves.assert_not_called()
@@ -105,15 +105,20 @@ class TestStrava:
         assert response.get_body() == b'{"result": "Success"}'
         # check if strava_helpers.initial_strava_auth is called with correct parameters
         initial_strava_auth.assert_called_with("code")
-        cosmosdb_container.return_value.upsert_item.assert_called_with(
-            {
-                "id": "id",
-                "strava_authentication": {
-                    "access_token": "123",
-                    "refresh_token": "123",
-                    "expires_at": 1699220922,
-                    "client_id": "123",
-                    "client_secret": "123",
-                },
-            }
+        cosmosdb_container.return_value.patch_item.assert_called_with(
+            item="123",
+            partition_key="123",
+            patch_operations=[
+                {
+                    "op": "set",
+                    "path": "/strava_authentication",
+                    "value": {
+                        "access_token": "123",
+                        "refresh_token": "123",
+                        "expires_at": 1699220922,
+                        "client_id": "123",
+                        "client_secret": "123",
+                    },
+                }
+            ],
         )
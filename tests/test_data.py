@@ -1,10 +1,25 @@
 """Test data module"""
 
+import copy
+import datetime
 import json
 from pathlib import Path
 from unittest.mock import patch
 
-from api.data import list_activities
+import azure.functions as func
+import numpy as np
+from azure.core import MatchConditions
+
+from api.data import (
+    get_aggregates,
+    get_curves,
+    get_fitness,
+    get_streams,
+    get_vo2max,
+    list_activities,
+    update_user_input,
+)
+from shared_code import response_cache, stream_codec
 from shared_code.utils import create_params_func_request
 
 with open(Path(__file__).parent / "data" / "get_user_data.json", "r") as f:
@@ -35,9 +50,11 @@ class TestListActivities:
             params={},
         )
 
-        cosmosdb_container.return_value.query_items.return_value = (
-            mock_container_response
-        )
+        cosmosdb_container.return_value.query_items.side_effect = [
+            [1],
+            [1682629624],
+            mock_container_response,
+        ]
         mock_get_user.return_value = mock_get_user_data
 
         func_call = list_activities.build().get_user_function()
@@ -88,13 +105,652 @@ class TestListActivities:
             }
         ]
 
-        cosmosdb_container.return_value.query_items.return_value = (
-            mock_container_response
+        cosmosdb_container.return_value.query_items.side_effect = [
+            [1],
+            [1682629624],
+            mock_container_response,
+        ]
+        mock_get_user.return_value = mock_get_user_data
+
+        func_call = list_activities.build().get_user_function()
+        result = func_call(req)
+
+        assert result.status_code == 200
+        assert json.loads(result.get_body()) == [{"id": "123"}]
+
+
+class TestListActivitiesETag:
+    """Test conditional requests to list_activities"""
+
+    @patch("shared_code.user_helpers.get_user")
+    @patch("shared_code.cosmosdb_module.cosmosdb_container")
+    def test_not_modified(self, cosmosdb_container, mock_get_user):
+        """Test the full query is skipped when the ETag matches"""
+        query_items = cosmosdb_container.return_value.query_items
+        query_items.side_effect = [
+            [1],
+            [1682629624],
+            [{"id": "123"}],
+            [1],
+            [1682629624],
+        ]
+        mock_get_user.return_value = mock_get_user_data
+        func_call = list_activities.build().get_user_function()
+
+        req = create_params_func_request(
+            url="/api/data/activities",
+            method="GET",
+            params={},
+        )
+        result = func_call(req)
+        etag = result.headers["ETag"]
+        assert result.status_code == 200
+        assert result.headers["Last-Modified"] == "Thu, 27 Apr 2023 21:07:04 GMT"
+
+        response_cache.invalidate_user(mock_get_user_data["userId"])
+        req = func.HttpRequest(
+            method="GET",
+            url="/api/data/activities",
+            body=None,
+            headers={"If-None-Match": f"W/{etag}"},
         )
+        result = func_call(req)
+        assert result.status_code == 304
+        assert result.headers["ETag"] == etag
+        assert query_items.call_count == 5
+        assert (
+            query_items.call_args_list[0]
+            .kwargs["query"]
+            .startswith("SELECT VALUE COUNT(1) FROM c")
+        )
+
+
+class TestListActivitiesCache:
+    """Test cached list_activities responses"""
+
+    @patch("shared_code.user_helpers.get_user")
+    @patch("shared_code.cosmosdb_module.cosmosdb_container")
+    def test_cached(self, cosmosdb_container, mock_get_user):
+        """Test a repeated request is served from the cache until a write"""
+        query_items = cosmosdb_container.return_value.query_items
+        query_items.side_effect = [
+            [1],
+            [1682629624],
+            [{"id": "123"}],
+            [2],
+            [1682629625],
+            [{"id": "123"}, {"id": "456"}],
+        ]
         mock_get_user.return_value = mock_get_user_data
+        func_call = list_activities.build().get_user_function()
+        req = create_params_func_request(
+            url="/api/data/activities",
+            method="GET",
+            params={},
+        )
+
+        first = func_call(req)
+        second = func_call(req)
+        assert second.get_body() == first.get_body()
+        assert second.headers["ETag"] == first.headers["ETag"]
+        assert query_items.call_count == 3
+
+        response_cache.invalidate_user(mock_get_user_data["userId"])
+        third = func_call(req)
+        assert json.loads(third.get_body()) == [{"id": "123"}, {"id": "456"}]
+        assert query_items.call_count == 6
+
 
+class TestListActivitiesPages:
+    """Test paginated list_activities"""
+
+    @patch("shared_code.user_helpers.get_user")
+    @patch("shared_code.cosmosdb_module.cosmosdb_container")
+    def test_page(self, cosmosdb_container, mock_get_user):
+        """Test pages are sorted newest first and continue after the last item"""
+        query_items = cosmosdb_container.return_value.query_items
+        query_items.side_effect = [
+            [3],
+            [1682629624],
+            [
+                {"id": "3", "start_date": "2023-11-05T09:00:00Z", "_ts": 1},
+                {"id": "2", "start_date": "2023-11-04T09:00:00Z", "_ts": 1},
+            ],
+            [3],
+            [1682629624],
+            [{"id": "1", "start_date": "2023-11-04T09:00:00Z", "_ts": 1}],
+        ]
+        mock_get_user.return_value = mock_get_user_data
         func_call = list_activities.build().get_user_function()
+
+        req = create_params_func_request(
+            url="/api/data/activities",
+            method="GET",
+            params={"pageSize": "2", "fields": "name"},
+        )
+        result = func_call(req)
+        body = json.loads(result.get_body().decode("utf-8"))
+        assert result.status_code == 200
+        assert [item["id"] for item in body["items"]] == ["3", "2"]
+        query = query_items.call_args.kwargs["query"]
+        assert query.startswith('SELECT TOP @pageSize c.id, c["name"], c["start_date"]')
+        assert query.endswith("ORDER BY c.start_date DESC, c.id DESC")
+        assert query_items.call_args.kwargs["max_item_count"] == 2
+
+        req = create_params_func_request(
+            url="/api/data/activities",
+            method="GET",
+            params={
+                "pageSize": "2",
+                "fields": "name",
+                "continuationToken": body["continuationToken"],
+            },
+        )
+        body = json.loads(func_call(req).get_body().decode("utf-8"))
+        assert body == {
+            "items": [{"id": "1", "start_date": "2023-11-04T09:00:00Z"}],
+            "continuationToken": None,
+        }
+        assert "c.id < @cursorId" in query_items.call_args.kwargs["query"]
+        assert {"name": "@cursorDate", "value": "2023-11-04T09:00:00Z"} in (
+            query_items.call_args.kwargs["parameters"]
+        )
+        assert {"name": "@cursorId", "value": "2"} in (
+            query_items.call_args.kwargs["parameters"]
+        )
+
+    @patch("shared_code.user_helpers.get_user")
+    @patch("shared_code.cosmosdb_module.cosmosdb_container")
+    def test_ndjson(self, cosmosdb_container, mock_get_user):
+        """Test newline delimited json"""
+        req = create_params_func_request(
+            url="/api/data/activities",
+            method="GET",
+            params={"format": "ndjson"},
+        )
+
+        cosmosdb_container.return_value.query_items.side_effect = [
+            [2],
+            [1],
+            iter([{"id": "1", "_ts": 1}, {"id": "2", "_ts": 1}]),
+        ]
+        mock_get_user.return_value = mock_get_user_data
+
+        func_call = list_activities.build().get_user_function()
+        result = func_call(req)
+        assert result.status_code == 200
+        assert result.mimetype == "application/x-ndjson"
+        assert result.get_body() == b'{"id":"1"}\n{"id":"2"}\n'
+
+    @patch("shared_code.user_helpers.get_user")
+    @patch("shared_code.cosmosdb_module.cosmosdb_container")
+    def test_projection(self, cosmosdb_container, mock_get_user):
+        """Test the summary view and field list are projected in the query"""
+        query_items = cosmosdb_container.return_value.query_items
+        query_items.side_effect = [
+            [1],
+            [1682629624],
+            [{"id": "1", "name": "Morning run"}],
+            [1],
+            [1682629624],
+            [{"id": "1", "name": "Morning run"}],
+        ]
+        mock_get_user.return_value = mock_get_user_data
+        func_call = list_activities.build().get_user_function()
+
+        req = create_params_func_request(
+            url="/api/data/activities",
+            method="GET",
+            params={"fields": "name,distance"},
+        )
+        result = func_call(req)
+        assert result.status_code == 200
+        assert json.loads(result.get_body()) == [{"id": "1", "name": "Morning run"}]
+        assert query_items.call_args.kwargs["query"] == (
+            'SELECT c.id, c["name"], c["distance"] FROM c WHERE c.userId = @userid'
+        )
+
+        req = create_params_func_request(
+            url="/api/data/activities",
+            method="GET",
+            params={"view": "summary"},
+        )
+        func_call(req)
+        assert 'c["hr_trimp"]' in query_items.call_args.kwargs["query"]
+        assert 'c["laps"]' not in query_items.call_args.kwargs["query"]
+
+    def test_invalid_parameters(self):
+        """Test invalid parameters"""
+        func_call = list_activities.build().get_user_function()
+        for params in [
+            {"pageSize": "0"},
+            {"order": "up"},
+            {"pageSize": "2", "continuationToken": "abc"},
+            {"format": "xml"},
+            {"view": "full"},
+            {"view": "summary", "fields": "id"},
+            {"fields": "id,name FROM c --"},
+        ]:
+            req = create_params_func_request(
+                url="/api/data/activities",
+                method="GET",
+                params=params,
+            )
+            assert func_call(req).status_code == 400
+
+
+class TestGetFitness:
+    """Test get_fitness"""
+
+    mock_document = {
+        "id": "fitness_123",
+        "userId": "123",
+        "tss_type": "hr",
+        "activities": {},
+        "series": [
+            {"date": "2023-11-04", "load": 0.0, "ctl": 0.0, "atl": 0.0, "tsb": 0.0},
+            {"date": "2023-11-05", "load": 42.0, "ctl": 1.0, "atl": 6.0, "tsb": 0.0},
+        ],
+    }
+    mock_settings = {"preferences": {"preferred_tss_type": "hr"}}
+
+    @patch("shared_code.user_helpers.get_user_settings")
+    @patch("shared_code.user_helpers.get_user")
+    @patch("shared_code.cosmosdb_module.get_cosmosdb_item")
+    def test_valid_request(self, get_cosmosdb_item, mock_get_user, get_user_settings):
+        """Test valid request"""
+        req = create_params_func_request(
+            url="/api/data/fitness",
+            method="GET",
+            params={"startDate": "2023-11-05", "endDate": "2023-11-05"},
+        )
+
+        get_cosmosdb_item.return_value = self.mock_document
+        mock_get_user.return_value = mock_get_user_data
+        get_user_settings.return_value = self.mock_settings
+
+        func_call = get_fitness.build().get_user_function()
+        result = func_call(req)
+        body = json.loads(result.get_body().decode("utf-8"))
+        assert result.status_code == 200
+        assert body == [self.mock_document["series"][1]]
+        get_cosmosdb_item.assert_called_once_with("fitness_123", "metrics")
+
+    @patch("shared_code.user_helpers.get_user_settings")
+    @patch("shared_code.user_helpers.get_user")
+    @patch("shared_code.cosmosdb_module.get_cosmosdb_item")
+    def test_extended_to_today(
+        self, get_cosmosdb_item, mock_get_user, get_user_settings
+    ):
+        """Test the series continues after the last activity"""
+        req = create_params_func_request(
+            url="/api/data/fitness",
+            method="GET",
+            params={"startDate": "2023-11-06"},
+        )
+
+        get_cosmosdb_item.return_value = self.mock_document
+        mock_get_user.return_value = mock_get_user_data
+        get_user_settings.return_value = self.mock_settings
+
+        func_call = get_fitness.build().get_user_function()
+        body = json.loads(func_call(req).get_body().decode("utf-8"))
+        assert body[0]["date"] == "2023-11-06"
+        assert body[0]["load"] == 0.0
+        assert body[0]["tsb"] == -5.0
+        assert body[-1]["date"] == datetime.date.today().isoformat()
+
+    @patch("shared_code.user_helpers.get_user_settings")
+    @patch("shared_code.user_helpers.get_user")
+    @patch("shared_code.cosmosdb_module.get_cosmosdb_item")
+    def test_no_data_in_cosmosdb(
+        self, get_cosmosdb_item, mock_get_user, get_user_settings
+    ):
+        """Test no data in cosmosdb"""
+        req = create_params_func_request(
+            url="/api/data/fitness",
+            method="GET",
+            params={},
+        )
+
+        get_cosmosdb_item.return_value = None
+        mock_get_user.return_value = mock_get_user_data
+        get_user_settings.return_value = self.mock_settings
+
+        func_call = get_fitness.build().get_user_function()
         result = func_call(req)
+        assert result.status_code == 200
+        assert result.get_body() == b"[]"
+
+    @patch("shared_code.cosmosdb_module.update_cosmosdb_item")
+    @patch("shared_code.user_helpers.get_user_settings")
+    @patch("shared_code.user_helpers.get_user")
+    @patch("shared_code.cosmosdb_module.get_cosmosdb_item")
+    def test_changed_tss_type(
+        self, get_cosmosdb_item, mock_get_user, get_user_settings, update_cosmosdb_item
+    ):
+        """Test the series is recalculated when the load type preference changed"""
+        req = create_params_func_request(
+            url="/api/data/fitness",
+            method="GET",
+            params={"startDate": "2023-11-05", "endDate": "2023-11-05"},
+        )
+
+        document = {
+            **self.mock_document,
+            "activities": {
+                "1": {"date": "2023-11-05", "hr_trimp": 42.0, "pace_trimp": 84.0}
+            },
+        }
+        get_cosmosdb_item.return_value = document
+        mock_get_user.return_value = mock_get_user_data
+        get_user_settings.return_value = {"preferences": {"preferred_tss_type": "pace"}}
+        update_cosmosdb_item.side_effect = lambda _id, _container, update, _default: (
+            update(copy.deepcopy(document))
+        )
+
+        func_call = get_fitness.build().get_user_function()
+        body = json.loads(func_call(req).get_body().decode("utf-8"))
+        assert body == [
+            {"date": "2023-11-05", "load": 84.0, "ctl": 2.0, "atl": 12.0, "tsb": 0.0}
+        ]
+        assert update_cosmosdb_item.call_args.args[:2] == ("fitness_123", "metrics")
+
+
+class TestGetVo2max:
+    """Test get_vo2max"""
+
+    @patch("shared_code.user_helpers.get_user")
+    @patch("shared_code.cosmosdb_module.get_cosmosdb_item")
+    def test_valid_request(self, get_cosmosdb_item, mock_get_user):
+        """Test valid request"""
+        req = create_params_func_request(
+            url="/api/data/vo2max",
+            method="GET",
+            params={"endDate": "2023-11-04T23:59:59Z"},
+        )
+
+        get_cosmosdb_item.return_value = {
+            "id": "vo2max_123",
+            "trend": [
+                {"date": "2023-11-04", "vo2max": 55.0},
+                {"date": "2023-11-05", "vo2max": 56.0},
+            ],
+        }
+        mock_get_user.return_value = mock_get_user_data
+
+        func_call = get_vo2max.build().get_user_function()
+        result = func_call(req)
+        body = json.loads(result.get_body().decode("utf-8"))
+        assert result.status_code == 200
+        assert body == [{"date": "2023-11-04", "vo2max": 55.0}]
+        get_cosmosdb_item.assert_called_once_with("vo2max_123", "metrics")
+
 
+class TestGetCurves:
+    """Test get_curves"""
+
+    @patch("shared_code.user_helpers.get_user")
+    @patch("shared_code.cosmosdb_module.get_cosmosdb_item")
+    def test_season(self, get_cosmosdb_item, mock_get_user):
+        """Test season curves of an activity type"""
+        best = {"value": 4.0, "activity_id": "1", "date": "2023-01-01"}
+        ride = {"value": 9.0, "activity_id": "2", "date": "2023-01-02"}
+        get_cosmosdb_item.return_value = {
+            "types": {
+                "Run": {
+                    "all_time": {},
+                    "seasons": {"2023": {"speed": {"10": best, "5": best}}},
+                },
+                "Ride": {"all_time": {}, "seasons": {"2023": {"speed": {"5": ride}}}},
+            },
+        }
+        mock_get_user.return_value = mock_get_user_data
+        func_call = get_curves.build().get_user_function()
+
+        req = create_params_func_request(
+            url="/api/data/curves",
+            method="GET",
+            params={"season": "2023"},
+        )
+        result = func_call(req)
+        body = json.loads(result.get_body().decode("utf-8"))
         assert result.status_code == 200
-        assert result.get_body() == b'[{"id": "123"}]'
+        assert [point["duration"] for point in body["speed"]] == [5, 10]
+
+        req = create_params_func_request(
+            url="/api/data/curves",
+            method="GET",
+            params={"season": "2023", "type": "Ride"},
+        )
+        body = json.loads(func_call(req).get_body().decode("utf-8"))
+        assert [point["value"] for point in body["speed"]] == [9.0]
+
+        req = create_params_func_request(
+            url="/api/data/curves",
+            method="GET",
+            params={"type": "Swim"},
+        )
+        assert json.loads(func_call(req).get_body().decode("utf-8")) == {}
+
+
+class TestGetAggregates:
+    """Test get_aggregates"""
+
+    @patch("shared_code.user_helpers.get_user")
+    @patch("shared_code.aggregate_helpers.get_year_entries")
+    def test_valid_request(self, get_year_entries, mock_get_user):
+        """Test monthly totals over two years"""
+        req = create_params_func_request(
+            url="/api/data/aggregates",
+            method="GET",
+            params={
+                "bucket": "month",
+                "startDate": "2022-12-01",
+                "endDate": "2023-01-31",
+            },
+        )
+
+        fields = {"distance": 1000.0, "moving_time": 300}
+        get_year_entries.side_effect = [
+            [
+                {"date": "2022-11-30", "type": "Run", **fields},
+                {"date": "2022-12-01", "type": "Run", **fields},
+            ],
+            [{"date": "2023-01-02", "type": "Run", "count": 2, **fields}],
+        ]
+        mock_get_user.return_value = mock_get_user_data
+
+        func_call = get_aggregates.build().get_user_function()
+        result = func_call(req)
+        body = json.loads(result.get_body().decode("utf-8"))
+        assert result.status_code == 200
+        assert [(bucket["bucket"], bucket["count"]) for bucket in body] == [
+            ("2022-12", 1),
+            ("2023-01", 2),
+        ]
+        assert [call.args for call in get_year_entries.call_args_list] == [
+            ("123", "2022"),
+            ("123", "2023"),
+        ]
+
+    def test_invalid_request(self):
+        """Test invalid bucket and date range"""
+        func_call = get_aggregates.build().get_user_function()
+        for params in [
+            {"bucket": "hour"},
+            {"startDate": "2023-01-01", "endDate": "2022-01-01"},
+            {"startDate": "abcd"},
+        ]:
+            req = create_params_func_request(
+                url="/api/data/aggregates", method="GET", params=params
+            )
+            assert func_call(req).status_code == 400
+
+
+class TestGetStreams:
+    """Test get_streams"""
+
+    @patch("shared_code.user_helpers.get_user")
+    @patch("shared_code.stream_store.query_streams")
+    def test_valid_request(self, query_streams, mock_get_user):
+        """Test valid request"""
+        req = create_params_func_request(
+            url="/api/data/streams",
+            method="GET",
+            params={
+                "activityId": "1",
+                "columns": "time,heartrate",
+                "startDistance": "1000",
+                "resolution": "100",
+            },
+        )
+
+        query_streams.return_value = {
+            "time": np.array([0, 10, 20]),
+            "heartrate": np.array([120, 130, 125]),
+        }
+        mock_get_user.return_value = mock_get_user_data
+
+        func_call = get_streams.build().get_user_function()
+        result = func_call(req)
+        body = json.loads(result.get_body().decode("utf-8"))
+        assert result.status_code == 200
+        assert body == {
+            "activityId": "1",
+            "format": "json",
+            "length": 3,
+            "columns": {"time": [0, 10, 20], "heartrate": [120, 130, 125]},
+        }
+        query_streams.assert_called_once_with(
+            "1", "123", ["time", "heartrate"], ("distance", 1000.0, None), 100
+        )
+
+    @patch("shared_code.user_helpers.get_user")
+    @patch("shared_code.stream_store.query_streams")
+    def test_encoded(self, query_streams, mock_get_user):
+        """Test encoded format"""
+        req = create_params_func_request(
+            url="/api/data/streams",
+            method="GET",
+            params={"activityId": "1", "format": "encoded"},
+        )
+
+        query_streams.return_value = {"heartrate": np.array([120, 130, 125])}
+        mock_get_user.return_value = mock_get_user_data
+
+        func_call = get_streams.build().get_user_function()
+        result = func_call(req)
+        body = json.loads(result.get_body().decode("utf-8"))
+        assert result.status_code == 200
+        assert stream_codec.decode_column(body["columns"]["heartrate"]).tolist() == [
+            120,
+            130,
+            125,
+        ]
+
+    @patch("shared_code.user_helpers.get_user")
+    @patch("shared_code.stream_store.query_streams")
+    def test_not_found(self, query_streams, mock_get_user):
+        """Test activity without streams"""
+        req = create_params_func_request(
+            url="/api/data/streams",
+            method="GET",
+            params={"activityId": "1"},
+        )
+
+        query_streams.return_value = None
+        mock_get_user.return_value = mock_get_user_data
+
+        func_call = get_streams.build().get_user_function()
+        result = func_call(req)
+        assert result.status_code == 404
+
+    def test_invalid_parameters(self):
+        """Test invalid parameters"""
+        func_call = get_streams.build().get_user_function()
+        for params in [
+            {"resolution": "abc"},
+            {"resolution": "1"},
+            {"columns": "time,power"},
+            {"startTime": "10", "endDistance": "1000"},
+            {"format": "xml"},
+        ]:
+            req = create_params_func_request(
+                url="/api/data/streams",
+                method="GET",
+                params={"activityId": "1", **params},
+            )
+            result = func_call(req)
+            assert result.status_code == 400
+
+
+class TestUpdateUserInput:
+    """Test update_user_input"""
+
+    user_input = {"include_in_vo2max_estimate": False, "tags": [], "notes": "tired"}
+
+    def create_request(self, body: dict) -> func.HttpRequest:
+        """Create request"""
+        return func.HttpRequest(
+            method="POST",
+            url="/api/data/activities/user_input",
+            params={"activityId": "1"},
+            body=json.dumps(body).encode("utf-8"),
+        )
+
+    def test_invalid_schema(self):
+        """Test invalid schema"""
+        func_call = update_user_input.build().get_user_function()
+        result = func_call(self.create_request({"notes": 1}))
+        assert result.status_code == 400
+
+    @patch("shared_code.vo2max_helpers.update_vo2max")
+    @patch("shared_code.user_helpers.get_user")
+    @patch("shared_code.cosmosdb_module.cosmosdb_container")
+    def test_valid_request(self, cosmosdb_container, mock_get_user, update_vo2max):
+        """Test valid request"""
+        container = cosmosdb_container.return_value
+        container.read_item.return_value = {
+            "id": "1",
+            "userId": "123",
+            "_etag": "etag",
+            "user_input": {
+                "include_in_vo2max_estimate": True,
+                "tags": [],
+                "notes": "",
+            },
+        }
+        container.patch_item.return_value = {"id": "1", "_etag": "etag2"}
+        mock_get_user.return_value = mock_get_user_data
+
+        func_call = update_user_input.build().get_user_function()
+        result = func_call(self.create_request(self.user_input))
+
+        assert result.status_code == 200
+        container.patch_item.assert_called_once_with(
+            item="1",
+            partition_key="1",
+            patch_operations=[
+                {"op": "set", "path": "/user_input", "value": self.user_input}
+            ],
+            etag="etag",
+            match_condition=MatchConditions.IfNotModified,
+        )
+        update_vo2max.assert_called_once_with({"id": "1", "_etag": "etag2"})
+
+    @patch("shared_code.user_helpers.get_user")
+    @patch("shared_code.cosmosdb_module.cosmosdb_container")
+    def test_other_user(self, cosmosdb_container, mock_get_user):
+        """Test activity of another user"""
+        cosmosdb_container.return_value.read_item.return_value = {
+            "id": "1",
+            "userId": "456",
+        }
+        mock_get_user.return_value = mock_get_user_data
+
+        func_call = update_user_input.build().get_user_function()
+        result = func_call(self.create_request(self.user_input))
+
+        assert result.status_code == 404
+        cosmosdb_container.return_value.patch_item.assert_not_called()
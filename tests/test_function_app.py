@@ -1,5 +1,8 @@
 """Test the function_app module"""
 
+import subprocess
+import sys
+from pathlib import Path
 from unittest.mock import patch
 
 from function_app import app, main
@@ -13,3 +16,27 @@ def test_main(mock_register_blueprint):
 
     # Assert
     assert mock_register_blueprint.call_count > 0
+
+
+def imported_modules(module: str, modules: list[str]) -> str:
+    """Print which of the modules are imported with a module in a new interpreter"""
+    code = f"import sys, {module}; print([m for m in {modules} if m in sys.modules])"
+    result = subprocess.run(
+        [sys.executable, "-c", code],  # noqa: S603
+        cwd=Path(__file__).parent.parent,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return result.stdout.strip()
+
+
+def test_lazy_imports():
+    """Test heavy dependencies are not imported when the function app starts"""
+    modules = ["stravalib", "jsonschema", "azure.storage.queue"]
+    assert imported_modules("function_app", modules) == "[]"
+
+
+def test_http_helpers_lazy_numpy():
+    """Test the HTTP helpers serialize numpy values without importing numpy"""
+    assert imported_modules("shared_code.http_helpers", ["numpy"]) == "[]"
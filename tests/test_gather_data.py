@@ -10,6 +10,7 @@ from azure.storage.queue import QueueClient
 
 from app.gather_data import (
     add_activity_to_enrichment_queue,
+    complete_orchestration,
     get_activities,
     get_user_settings,
 )
@@ -158,6 +159,10 @@ class TestGetActivities:
                         "vo2_max_percentage": None,
                         "estimated_vo2_max": None,
                     },
+                    "mean_max_curves": None,
+                    "simplified_polyline": None,
+                    "streams_archived": False,
+                    "calculation_versions": {},
                     "user_input": {
                         "include_in_vo2max_estimate": True,
                         "tags": [],
@@ -183,6 +188,10 @@ class TestGetActivities:
                         "vo2_max_percentage": None,
                         "estimated_vo2_max": None,
                     },
+                    "mean_max_curves": None,
+                    "simplified_polyline": None,
+                    "streams_archived": False,
+                    "calculation_versions": {},
                     "user_input": {
                         "include_in_vo2max_estimate": True,
                         "tags": [],
@@ -294,6 +303,10 @@ class TestGetActivities:
                         "vo2_max_percentage": None,
                         "estimated_vo2_max": None,
                     },
+                    "mean_max_curves": None,
+                    "simplified_polyline": None,
+                    "streams_archived": False,
+                    "calculation_versions": {},
                     "user_input": {
                         "include_in_vo2max_estimate": True,
                         "tags": [],
@@ -319,6 +332,10 @@ class TestGetActivities:
                         "vo2_max_percentage": None,
                         "estimated_vo2_max": None,
                     },
+                    "mean_max_curves": None,
+                    "simplified_polyline": None,
+                    "streams_archived": False,
+                    "calculation_versions": {},
                     "user_input": {
                         "include_in_vo2max_estimate": True,
                         "tags": [],
@@ -370,3 +387,19 @@ class TestAddActivityToEnrichmentQueue:
         # Assert
         assert result == {"status": "success"}
         assert mock_queue_client.return_value.send_message.call_count == len(payload)
+
+
+class TestCompleteOrchestration:
+    """Test complete_orchestration"""
+
+    @patch("shared_code.response_cache.invalidate_user")
+    @patch("shared_code.orchestration_index.complete_instance")
+    def test_complete_orchestration(self, mock_complete_instance, mock_invalidate):
+        """Test the result is recorded in the orchestration index"""
+        result = {"status": "success", "ActivitiesAdded": 1}
+
+        func_call = complete_orchestration.build().get_user_function()
+        assert func_call(["123", "abc", result]) == {"status": "Done"}
+
+        mock_complete_instance.assert_called_once_with("123", "abc", result)
+        mock_invalidate.assert_called_once_with("123")
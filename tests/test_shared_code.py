@@ -2,26 +2,44 @@
 
 import asyncio
 import base64
+import copy
 import datetime
+import gzip
 import json
 import os
+import time
 from pathlib import Path
 from unittest import mock
 
 import azure.functions as func
+import numpy as np
 import pytest
 import time_machine
 from azure.cosmos import exceptions
 from azure.functions import QueueMessage
 
 from shared_code import (
+    aggregate_helpers,
     aio_helper,
+    cache_helpers,
+    calculators,
+    cosmosdb_containers,
     cosmosdb_module,
+    curve_helpers,
+    fitness_helpers,
     get_config,
+    http_helpers,
+    orchestration_index,
     queue_helpers,
+    response_cache,
     strava_helpers,
+    stream_cache,
+    stream_codec,
+    stream_helpers,
+    stream_store,
     user_helpers,
     utils,
+    vo2max_helpers,
 )
 
 with open(Path(__file__).parent / "data" / "get_user_data.json", "r") as f:
@@ -162,6 +180,104 @@ class TestCosmosdbModule:
             )
         assert function.call_count == max_retries + 1
 
+    @mock.patch("shared_code.cosmosdb_module.cosmosdb_container")
+    def test_get_cosmosdb_item(self, mock_cosmosdb_container):
+        """Test get cosmosdb item"""
+        container = mock_cosmosdb_container.return_value
+        container.read_item.return_value = {"id": "1", "_etag": "etag"}
+
+        assert cosmosdb_module.get_cosmosdb_item("1", "test") == {"id": "1"}
+        container.read_item.assert_called_once_with(item="1", partition_key="1")
+
+        container.read_item.side_effect = exceptions.CosmosResourceNotFoundError()
+        assert cosmosdb_module.get_cosmosdb_item("1", "test") is None
+
+    @mock.patch("time.sleep")
+    @mock.patch("shared_code.cosmosdb_module.cosmosdb_container")
+    def test_update_cosmosdb_item(self, mock_cosmosdb_container, mock_sleep):
+        """Test update cosmosdb item"""
+        container = mock_cosmosdb_container.return_value
+
+        def update_function(item):
+            item["count"] += 1
+            return item
+
+        # New item
+        container.read_item.side_effect = exceptions.CosmosResourceNotFoundError()
+        container.create_item.side_effect = lambda item: item
+        result = cosmosdb_module.update_cosmosdb_item(
+            "1", "test", update_function, {"id": "1", "count": 0}
+        )
+        assert result == {"id": "1", "count": 1}
+
+        # Concurrent modification is retried on a fresh copy
+        container.read_item.side_effect = [
+            {"id": "1", "count": 1, "_etag": "a"},
+            {"id": "1", "count": 2, "_etag": "b"},
+        ]
+        container.replace_item.side_effect = [
+            exceptions.CosmosAccessConditionFailedError(),
+            {"id": "1", "count": 3},
+        ]
+        result = cosmosdb_module.update_cosmosdb_item(
+            "1", "test", update_function, {"id": "1", "count": 0}
+        )
+        assert result == {"id": "1", "count": 3}
+        assert container.replace_item.call_args.kwargs["etag"] == "b"
+        mock_sleep.assert_called_once()
+
+    @mock.patch("time.sleep")
+    @mock.patch("shared_code.cosmosdb_module.cosmosdb_container")
+    def test_update_cosmosdb_item_conflicts(self, mock_cosmosdb_container, mock_sleep):
+        """Test repeated conflicts back off and raise after the last retry"""
+        container = mock_cosmosdb_container.return_value
+        container.read_item.side_effect = lambda **_: {"id": "1", "_etag": "a"}
+        container.replace_item.side_effect = (
+            exceptions.CosmosAccessConditionFailedError()
+        )
+
+        with pytest.raises(exceptions.CosmosAccessConditionFailedError):
+            cosmosdb_module.update_cosmosdb_item(
+                "1", "test", lambda item: item, {"id": "1"}, max_retries=5
+            )
+
+        delays = [call.args[0] for call in mock_sleep.call_args_list]
+        assert container.replace_item.call_count == 6
+        assert len(delays) == 5
+        assert delays[0] <= 0.2
+        assert delays[-1] > delays[0] * 4
+
+        # A conflict that clears up succeeds after backing off
+        mock_sleep.reset_mock()
+        container.replace_item.side_effect = [
+            exceptions.CosmosAccessConditionFailedError(),
+            exceptions.CosmosAccessConditionFailedError(),
+            {"id": "1"},
+        ]
+        assert cosmosdb_module.update_cosmosdb_item(
+            "1", "test", lambda item: item, {"id": "1"}
+        ) == {"id": "1"}
+        assert mock_sleep.call_count == 2
+
+    @mock.patch("shared_code.cosmosdb_module.cosmosdb_container")
+    def test_patch_cosmosdb_item(self, mock_cosmosdb_container):
+        """Test patch cosmosdb item"""
+        container = mock_cosmosdb_container.return_value
+        container.patch_item.side_effect = [{"_etag": "b"}, {"_etag": "c"}]
+        operations = cosmosdb_module.create_set_operations(
+            {f"field_{i}": i for i in range(12)}
+        )
+
+        result = cosmosdb_module.patch_cosmosdb_item("1", "test", operations, "a")
+
+        assert result == {"_etag": "c"}
+        assert operations[0] == {"op": "set", "path": "/field_0", "value": 0}
+        first, second = container.patch_item.call_args_list
+        assert first.kwargs["patch_operations"] == operations[:10]
+        assert first.kwargs["etag"] == "a"
+        assert second.kwargs["patch_operations"] == operations[10:]
+        assert second.kwargs["etag"] == "b"
+
 
 class TestGetConfig:
     """Test get_config.py"""
@@ -210,6 +326,23 @@ class TestUtils:
         weighted_average = utils.get_weighted_average(data, weight)
         assert weighted_average == 3.0
 
+    def test_get_validator(self):
+        """Test validators are compiled once per schema"""
+        assert utils.get_validator("user_input") is utils.get_validator("user_input")
+        assert utils.get_validator("user_data") is not utils.get_validator("user_input")
+
+    def test_validation_errors(self):
+        """Test every error is reported with its path"""
+        errors = utils.validation_errors(
+            {"include_in_vo2max_estimate": "yes"}, "user_input"
+        )
+        assert {
+            "path": "/include_in_vo2max_estimate",
+            "message": "'yes' is not of type 'boolean'",
+            "validator": "type",
+        } in errors
+        assert utils.validate_json({"include_in_vo2max_estimate": "yes"}, "user_input")
+
 
 class TestUserHelpers:
     """Test user_helpers.py"""
@@ -233,11 +366,41 @@ class TestUserHelpers:
 
         assert user == mock_get_user_data
 
+    @mock.patch("shared_code.cosmosdb_module.cosmosdb_container")
+    def test_get_user_settings(self, mock_cosmosdb_container):
+        """Test settings are cached, revalidated after the TTL and invalidated"""
+        read_item = mock_cosmosdb_container.return_value.read_item
+        read_item.side_effect = lambda **_kwargs: {
+            **copy.deepcopy(mock_user_settings),
+            "_etag": '"1"',
+        }
+        expected = {
+            key: value
+            for key, value in mock_user_settings.items()
+            if not key.startswith("_")
+        }
+
+        settings = user_helpers.get_user_settings("123")
+        settings["heart_rate"] = None
+        assert user_helpers.get_user_settings("123") == expected
+        assert read_item.call_count == 1
+
+        # Unchanged settings are revalidated with a conditional read
+        read_item.side_effect = lambda **_kwargs: None
+        with mock.patch("time.monotonic", return_value=time.monotonic() + 3600):
+            assert user_helpers.get_user_settings("123") == expected
+        assert read_item.call_args.kwargs["etag"] == '"1"'
+
+        user_helpers.invalidate_user_settings("123")
+        read_item.side_effect = exceptions.CosmosResourceNotFoundError()
+        with pytest.raises(ValueError, match="No user found"):
+            user_helpers.get_user_settings("123")
+
 
 class TestStravaHelpers:
     """Test strava_helpers.py"""
 
-    @mock.patch("shared_code.strava_helpers.Client")
+    @mock.patch("stravalib.client.Client")
     @mock.patch.dict(
         os.environ,
         {
@@ -265,7 +428,7 @@ class TestStravaHelpers:
         # Assert
         assert result == auth_object
 
-    @mock.patch("shared_code.strava_helpers.Client")
+    @mock.patch("stravalib.client.Client")
     @mock.patch.dict(
         os.environ,
         {
@@ -301,7 +464,7 @@ class TestStravaHelpers:
 
     @time_machine.travel("2025-01-01")
     @mock.patch("shared_code.cosmosdb_module.cosmosdb_container")
-    @mock.patch("shared_code.strava_helpers.Client")
+    @mock.patch("stravalib.client.Client")
     @mock.patch("shared_code.strava_helpers.refresh_strava_auth")
     def test_create_strava_client(
         self, mock_refresh_strava_auth, mock_client, mock_container
@@ -405,6 +568,982 @@ class TestStravaHelpers:
         assert "segment_leaderboard_opt_out" not in cleaned_activity
 
 
+class TestFitnessHelpers:
+    """Test fitness_helpers.py"""
+
+    def test_calculate_training_load(self):
+        """Test calculate training load"""
+        series = fitness_helpers.calculate_training_load(
+            {"2023-01-01": 42.0, "2023-01-03": 84.0}, "2023-01-01", "2023-01-03"
+        )
+
+        assert [entry["date"] for entry in series] == [
+            "2023-01-01",
+            "2023-01-02",
+            "2023-01-03",
+        ]
+        assert series[0]["ctl"] == pytest.approx(1.0)
+        assert series[0]["atl"] == pytest.approx(6.0)
+        assert series[0]["tsb"] == 0.0
+        assert series[1]["tsb"] == pytest.approx(-5.0)
+        assert series[2]["load"] == 84.0
+
+    def test_update_fitness_document(self):
+        """Test incremental updates give the same result as a full calculation"""
+        activities = [
+            {"id": "1", "start_date_local": "2023-01-01T08:00:00Z", "hr_trimp": 50.0},
+            {"id": "2", "start_date_local": "2023-01-05T08:00:00Z", "hr_trimp": 80.0},
+            {"id": "3", "start_date_local": "2023-01-03T08:00:00Z", "hr_trimp": 20.0},
+        ]
+        document = fitness_helpers.default_fitness_document("123", "hr")
+        for activity in activities:
+            document = fitness_helpers.update_fitness_document(document, activity, "hr")
+
+        expected = fitness_helpers.calculate_training_load(
+            {"2023-01-01": 50.0, "2023-01-03": 20.0, "2023-01-05": 80.0},
+            "2023-01-01",
+            "2023-01-05",
+        )
+        assert document["series"] == expected
+
+        # Recalculating an activity replaces its load
+        activities[1]["hr_trimp"] = 40.0
+        document = fitness_helpers.update_fitness_document(
+            document, activities[1], "hr"
+        )
+        assert document["series"][-1]["load"] == 40.0
+
+        # Switching the load type recalculates the whole series
+        document = fitness_helpers.update_fitness_document(
+            document, activities[0], "pace"
+        )
+        assert document["tss_type"] == "pace"
+        assert all(entry["load"] == 0.0 for entry in document["series"])
+
+    def test_extend_series(self):
+        """Test the series is extended with decaying loads"""
+        series = fitness_helpers.calculate_training_load(
+            {"2023-01-01": 42.0}, "2023-01-01", "2023-01-01"
+        )
+
+        extended = fitness_helpers.extend_series(series, "2023-01-03")
+
+        assert extended == fitness_helpers.calculate_training_load(
+            {"2023-01-01": 42.0}, "2023-01-01", "2023-01-03"
+        )
+        assert fitness_helpers.extend_series(series, "2022-12-31") == series
+        assert fitness_helpers.extend_series([], "2023-01-03") == []
+
+
+class TestVo2maxHelpers:
+    """Test vo2max_helpers.py"""
+
+    @staticmethod
+    def create_activity(activity_id, start_date, estimate, include=True):
+        """Create a calculated activity"""
+        return {
+            "id": activity_id,
+            "start_date_local": f"{start_date}T08:00:00Z",
+            "vo2max_estimate": {"estimated_vo2_max": estimate},
+            "user_input": {"include_in_vo2max_estimate": include},
+        }
+
+    def test_calculate_rolling_vo2max(self):
+        """Test calculate rolling vo2max"""
+        estimates = [
+            {"date": "2023-01-01", "estimated_vo2_max": 50.0},
+            {"date": "2023-01-22", "estimated_vo2_max": 54.0},
+            {"date": "2023-03-01", "estimated_vo2_max": 60.0},
+        ]
+
+        assert vo2max_helpers.calculate_rolling_vo2max(
+            estimates, "2023-01-22"
+        ) == pytest.approx((50.0 * 21 / 42 + 54.0) / (21 / 42 + 1))
+        assert vo2max_helpers.calculate_rolling_vo2max(estimates, "2023-02-20") == 54.0
+        assert vo2max_helpers.calculate_rolling_vo2max(estimates, "2022-12-31") is None
+
+    def test_update_vo2max_document(self):
+        """Test update vo2max document"""
+        document = vo2max_helpers.default_vo2max_document("123")
+        for activity in [
+            self.create_activity("1", "2023-01-01", 50.0),
+            self.create_activity("2", "2023-01-10", 52.0),
+            self.create_activity("3", "2023-06-01", 40.0),
+        ]:
+            document = vo2max_helpers.update_vo2max_document(document, activity)
+
+        assert [point["date"] for point in document["trend"]] == [
+            "2023-01-01",
+            "2023-01-10",
+            "2023-06-01",
+        ]
+        assert document["trend"][-1]["vo2max"] == 40.0
+
+        # Excluding an activity removes it from every affected point
+        document = vo2max_helpers.update_vo2max_document(
+            document, self.create_activity("1", "2023-01-01", 50.0, False)
+        )
+        assert document["trend"] == [
+            {"date": "2023-01-10", "vo2max": 52.0},
+            {"date": "2023-06-01", "vo2max": 40.0},
+        ]
+
+
+class TestStreamHelpers:
+    """Test stream_helpers.py"""
+
+    def test_curve_durations(self):
+        """Test curve durations"""
+        assert stream_helpers.curve_durations(3) == []
+        assert stream_helpers.curve_durations(12) == [5, 10, 12]
+        durations = stream_helpers.curve_durations(7200)
+        assert durations[-1] == 7200
+        assert durations == sorted(set(durations))
+
+    def test_calculate_mean_max_curves(self):
+        """Test the curves match a brute force calculation"""
+        time = [0, 1, 2, 3, 5, 6, 7, 8, 9, 10, 11, 12]
+        heartrate = [100, 120, 150, 130, 110, 170, 160, 100, 90, 95, 150, 155]
+        velocity = [3.0, 3.2, 4.0, 4.2, 3.8, 3.0, 2.8, 5.0, 5.2, 3.1, 3.0, 3.3]
+        distance = [sum(velocity[: i + 1]) for i in range(len(velocity))]
+        stream = {
+            "time": np.array(time),
+            "heartrate": np.array(heartrate),
+            "distance": np.array(distance),
+        }
+
+        curves = stream_helpers.calculate_mean_max_curves(stream)
+
+        heartrate_1hz = stream_helpers.resample_to_seconds(
+            np.array(time, dtype=float), np.array(heartrate, dtype=float)
+        )
+        distance_1hz = stream_helpers.resample_to_seconds(
+            np.array(time, dtype=float), np.array(distance, dtype=float)
+        )
+        assert curves["durations"] == [5, 10, 12]
+        for duration, hr_value, speed_value in zip(
+            curves["durations"], curves["heartrate"], curves["speed"]
+        ):
+            expected_hr = max(
+                heartrate_1hz[i : i + duration].mean()
+                for i in range(len(heartrate_1hz) - duration + 1)
+            )
+            expected_speed = max(
+                (distance_1hz[i + duration] - distance_1hz[i]) / duration
+                for i in range(len(distance_1hz) - duration)
+            )
+            assert hr_value == pytest.approx(expected_hr)
+            assert speed_value == pytest.approx(expected_speed)
+
+        assert stream_helpers.calculate_mean_max_curves({}) is None
+
+    def test_downsample_streams(self):
+        """Test downsampling keeps the endpoints and the peaks of every column"""
+        heartrate = [120] * 1000
+        heartrate[400] = 190
+        altitude = [10.0] * 1000
+        altitude[700] = 80.0
+        streams = {
+            "time": {"data": list(range(1000))},
+            "heartrate": {"data": heartrate},
+            "altitude": {"data": altitude},
+            "latlng": {"data": [[52.0 + i * 1e-4, 4.0] for i in range(1000)]},
+        }
+
+        output = stream_helpers.downsample_streams(streams, 100)
+
+        time = output["time"]["data"].tolist()
+        assert len(time) == 100
+        assert time[0] == 0
+        assert time[-1] == 999
+        assert time == sorted(time)
+        assert 400 in time
+        assert 700 in time
+        assert output["latlng"]["data"].shape == (100, 2)
+
+        assert len(
+            stream_helpers.downsample_streams(streams, 2000)["time"]["data"]
+        ) == (1000)
+
+    def test_clean_streams_null_samples(self):
+        """Test null samples are interpolated and unusable columns dropped"""
+        streams = {
+            "time": {"data": [0, 1, 2, 3]},
+            "heartrate": {"data": [120, None, 124, 126]},
+            "distance": {"data": [0.0, None, 6.0, 9.0]},
+            "moving": {"data": [True, None, True, True]},
+            "watts": {"data": [None, None, None, None]},
+        }
+
+        cleaned = stream_helpers.clean_streams(streams)
+
+        assert cleaned["heartrate"]["data"] == [120.0, 122.0, 124.0, 126.0]
+        assert cleaned["distance"]["data"] == [0.0, 3.0, 6.0, 9.0]
+        assert cleaned["moving"]["data"] == [True, False, True, True]
+        assert "watts" not in cleaned
+
+    def test_clean_streams(self):
+        """Test dropouts and spikes are removed and pauses are kept on a 1 Hz grid"""
+        streams = {
+            "time": {"data": [0, 2, 4, 6, 8, 10, 30, 32]},
+            "heartrate": {"data": [120, 122, 0, 126, 200, 130, 110, 112]},
+            "distance": {"data": [0.0, 6.0, 12.0, 11.0, 24.0, 30.0, 30.0, 36.0]},
+            "velocity_smooth": {"data": [3.0] * 6 + [0.0, 3.0]},
+            "moving": {"data": [True] * 6 + [False, True]},
+        }
+
+        output = stream_helpers.clean_streams(streams)
+
+        assert output["time"]["data"] == list(range(33))
+        heartrate = output["heartrate"]["data"]
+        assert heartrate[4] == 124
+        assert heartrate[8] == 128
+        distance = output["distance"]["data"]
+        assert distance == sorted(distance)
+        assert distance[20] == 30.0
+        assert output["velocity_smooth"]["data"][20] == 0
+        assert output["moving"]["data"][20] is False
+        assert output["moving"]["data"][9] is True
+        assert stream_helpers.clean_streams({}) == {}
+
+    def test_simplified_polyline(self):
+        """Test the track is simplified to the points that change its shape"""
+        latlng = [[52.0, 4.0 + i * 1e-4] for i in range(100)]
+        latlng[50] = [52.001, 4.005]
+
+        polyline = stream_helpers.simplified_polyline({"latlng": {"data": latlng}})
+
+        assert stream_codec.decode_polyline(polyline).tolist() == [
+            [52.0, 4.0],
+            [52.0, 4.0049],
+            [52.001, 4.005],
+            [52.0, 4.0051],
+            [52.0, 4.0099],
+        ]
+        assert stream_helpers.simplified_polyline({}) is None
+
+
+class TestStreamCodec:
+    """Test stream_codec.py"""
+
+    streams = {
+        "time": {"data": [0, 1, 2, 5, 6]},
+        "distance": {"data": [0.0, 2.9, 6.1, 15.3, 18.0]},
+        "heartrate": {"data": [90, 95, 101, 120, 119]},
+        "velocity_smooth": {"data": [0.0, 2.9, 3.123, 3.2, 2.95]},
+        "moving": {"data": [False, True, True, True, False]},
+        "latlng": {
+            "data": [
+                [52.370216, 4.895168],
+                [52.370226, 4.895178],
+                [52.370236, 4.895198],
+                [52.370266, 4.895238],
+                [52.370276, 4.895248],
+            ]
+        },
+    }
+
+    def test_polyline(self):
+        """Test the polyline matches the reference example"""
+        latlng = [[38.5, -120.2], [40.7, -120.95], [43.252, -126.453]]
+
+        polyline = stream_codec.encode_polyline(latlng)
+
+        assert polyline == "_p~iF~ps|U_ulLnnqC_mqNvxq`@"
+        np.testing.assert_allclose(stream_codec.decode_polyline(polyline), latlng)
+        assert stream_codec.decode_polyline("").shape == (0, 2)
+
+    def test_round_trip(self):
+        """Test encoded streams decode to the original values"""
+        document = stream_codec.encode_streams(self.streams)
+
+        assert document["format"] == "columnar-v1"
+        assert document["length"] == 5
+        decoded = stream_codec.decode_streams(document)
+        assert set(decoded) == set(self.streams)
+        for name, stream in self.streams.items():
+            np.testing.assert_allclose(decoded[name], stream["data"], atol=1e-6)
+        assert decoded["time"].dtype == np.int64
+        assert decoded["moving"].dtype == bool
+        assert decoded["latlng"].shape == (5, 2)
+
+    def test_missing_samples(self):
+        """Test null samples decode to NaN, or False for boolean columns"""
+        watts = stream_codec.decode_column(
+            stream_codec.encode_column("watts", [100, None, 120])
+        )
+        np.testing.assert_array_equal(watts, [100.0, np.nan, 120.0])
+
+        distance = stream_codec.encode_column("distance", [None, 1.5, None, 2.0])
+        assert "missing" in distance
+        np.testing.assert_array_equal(
+            stream_codec.decode_column(distance), [np.nan, 1.5, np.nan, 2.0]
+        )
+
+        moving = stream_codec.encode_column("moving", [True, None, True])
+        assert stream_codec.decode_column(moving).tolist() == [True, False, True]
+        assert "missing" not in stream_codec.encode_column("watts", [100, 120])
+
+    def test_legacy_document(self):
+        """Test legacy documents decode without an encoding"""
+        document = {"id": "1", "userId": "123", **self.streams}
+
+        decoded = stream_codec.decode_streams(
+            document, ["time", "heartrate", "cadence"]
+        )
+
+        assert set(decoded) == {"time", "heartrate"}
+        assert decoded["heartrate"].tolist() == self.streams["heartrate"]["data"]
+
+    def test_encoding_is_compact(self):
+        """Test a long stream is much smaller than the legacy json"""
+        time = list(range(20000))
+        heartrate = [int(140 + 10 * np.sin(i / 60)) for i in time]
+
+        document = stream_codec.encode_streams(
+            {"time": {"data": time}, "heartrate": {"data": heartrate}}
+        )
+
+        legacy_size = len(json.dumps({"time": time, "heartrate": heartrate}))
+        assert len(json.dumps(document)) * 10 < legacy_size
+
+
+class TestStreamStore:
+    """Test stream_store.py"""
+
+    streams = {
+        "time": {"data": list(range(0, 2000, 2))},
+        "heartrate": {"data": [120 + i % 40 for i in range(1000)]},
+        "moving": {"data": [i % 7 != 0 for i in range(1000)]},
+    }
+
+    @mock.patch("shared_code.stream_store.max_document_size")
+    def test_chunked_round_trip(self, mock_max_document_size):
+        """Test oversized streams are chunked and reassembled by time range"""
+        mock_max_document_size.return_value = 200
+        documents = stream_store.create_stream_documents("1", "123", self.streams)
+        manifest, chunks = documents[0], documents[1:]
+
+        assert manifest["format"] == "chunked-v1"
+        assert len(chunks) > 1
+        assert [chunk["id"] for chunk in manifest["chunks"]] == [
+            chunk["id"] for chunk in chunks
+        ]
+
+        stored = {document["id"]: document for document in documents}
+
+        def read_stream_document(document_id, columns):
+            document = stored.get(document_id)
+            if columns is None:
+                return document
+            keys = ["id", "userId", "format", "length", "chunks", *columns]
+            return {key: document[key] for key in keys if key in document}
+
+        with mock.patch(
+            "shared_code.stream_store.read_stream_document",
+            side_effect=read_stream_document,
+        ) as mock_read_stream_document:
+            output = stream_store.read_streams("1", "123")
+            assert output["time"].tolist() == self.streams["time"]["data"]
+            assert output["moving"].tolist() == self.streams["moving"]["data"]
+
+            mock_read_stream_document.reset_mock()
+            output = stream_store.read_streams(
+                "1", "123", ["heartrate"], start_time=100, end_time=110
+            )
+            assert list(output) == ["heartrate"]
+            assert output["heartrate"].tolist() == [130, 131, 132, 133, 134, 135]
+            assert mock_read_stream_document.call_count < len(documents)
+            mock_read_stream_document.assert_called_with(
+                "1_chunk_0", ["time", "heartrate"]
+            )
+
+            assert stream_store.read_streams("1", "456") is None
+
+    @mock.patch("shared_code.cosmosdb_module.cosmosdb_container")
+    def test_read_stream_document(self, mock_cosmosdb_container):
+        """Test only the requested columns are selected"""
+        container = mock_cosmosdb_container.return_value
+        container.query_items.return_value = [{"id": "1"}]
+
+        assert stream_store.read_stream_document("1", ["time", "heartrate"]) == {
+            "id": "1"
+        }
+        assert container.query_items.call_args.kwargs == {
+            "query": "SELECT c.id, c.userId, c.format, c.length, c.chunks,"
+            ' c.resolutions, c["time"], c["heartrate"] FROM c WHERE c.id = @id',
+            "parameters": [{"name": "@id", "value": "1"}],
+            "partition_key": "1",
+        }
+
+        with pytest.raises(ValueError, match="Unknown stream columns"):
+            stream_store.projection_query(['time"] FROM c --'])
+
+    def test_single_document(self):
+        """Test streams below the size limit are stored in a single document"""
+        documents = stream_store.create_stream_documents("1", "123", self.streams)
+        assert len(documents) == 1
+        assert documents[0]["format"] == "columnar-v1"
+
+    @mock.patch("shared_code.cosmosdb_module.cosmosdb_container")
+    def test_write_streams(self, mock_cosmosdb_container):
+        """Test the levels are written and stale documents are deleted"""
+        container = mock_cosmosdb_container.return_value
+        container.query_items.return_value = [
+            {
+                "chunks": [{"id": "1_chunk_0"}, {"id": "1_chunk_1"}],
+                "resolutions": [100, 2000],
+            }
+        ]
+
+        document = stream_store.write_streams("1", "123", self.streams)
+
+        assert document["resolutions"] == [100, 500]
+        assert [
+            call.args[0]["id"] for call in container.upsert_item.call_args_list
+        ] == ["1_res_100", "1_res_500", "1"]
+        assert sorted(
+            call.args[0] for call in container.delete_item.call_args_list
+        ) == ["1_chunk_0", "1_chunk_1", "1_res_2000"]
+        assert container.query_items.call_args.kwargs["partition_key"] == "1"
+        assert "enable_cross_partition_query" not in (
+            container.query_items.call_args.kwargs
+        )
+
+    def test_read_stream_level(self):
+        """Test the smallest level with enough samples is read"""
+        levels = stream_store.create_level_documents("1", "123", self.streams)
+        stored = {
+            "1": {"id": "1", "userId": "123", "resolutions": [100, 500]},
+            **{level["id"]: level for level in levels},
+        }
+
+        with mock.patch(
+            "shared_code.stream_store.read_stream_document",
+            side_effect=lambda document_id, columns: stored.get(document_id),
+        ) as mock_read_stream_document:
+            output = stream_store.read_stream_level("1", "123", 200, ["heartrate"])
+            assert list(output) == ["heartrate"]
+            assert len(output["heartrate"]) == 500
+            mock_read_stream_document.assert_called_with("1_res_500", ["heartrate"])
+
+            assert stream_store.read_stream_level("1", "456", 200) is None
+
+    def test_query_streams(self):
+        """Test distance ranges are read from the full streams and downsampled"""
+        streams = {
+            "time": np.arange(0, 2000, 2),
+            "distance": np.arange(1000) * 5.0,
+            "heartrate": np.array([120 + i % 40 for i in range(1000)]),
+        }
+
+        with mock.patch(
+            "shared_code.stream_store.read_streams", return_value=streams
+        ) as mock_read_streams:
+            output = stream_store.query_streams(
+                "1", "123", ["heartrate"], ("distance", 1000, 2000), 50
+            )
+            mock_read_streams.assert_called_once_with(
+                "1", "123", ["heartrate", "distance"]
+            )
+            assert list(output) == ["heartrate"]
+            assert len(output["heartrate"]) == 50
+
+        with mock.patch(
+            "shared_code.stream_store.read_stream_level"
+        ) as mock_read_stream_level:
+            stream_store.query_streams("1", "123", None, None, 500)
+            mock_read_stream_level.assert_called_once_with("1", "123", 500, None)
+
+
+class TestStreamArchive:
+    """Test archiving streams with stream_store.py and archive_storage.py"""
+
+    documents = [
+        {"id": "1", "userId": "123", "format": "columnar-v1", "resolutions": [100]},
+        {"id": "1_res_100", "userId": "123", "activityId": "1", "resolution": 100},
+        {"id": "1_clean", "userId": "123", "format": "columnar-v1"},
+    ]
+
+    def test_archive_and_rehydrate(self, tmp_path):
+        """Test streams are replaced by a stub and restored from the archive"""
+        with (
+            mock.patch(
+                "shared_code.get_config.get_stream_archive",
+                return_value={"directory": str(tmp_path), "age_days": 1},
+            ),
+            mock.patch(
+                "shared_code.cosmosdb_module.get_cosmosdb_items",
+                return_value=copy.deepcopy(self.documents),
+            ),
+            mock.patch(
+                "shared_code.cosmosdb_module.cosmosdb_container"
+            ) as mock_cosmosdb_container,
+            mock.patch(
+                "shared_code.cosmosdb_module.patch_cosmosdb_item"
+            ) as mock_patch_cosmosdb_item,
+        ):
+            container = mock_cosmosdb_container.return_value
+
+            assert stream_store.archive_streams("1", "123")
+            stub = container.upsert_item.call_args.args[0]
+            assert stub["format"] == "archived-v1"
+            assert stub["archive"] == "123/1.json.xz"
+            assert (tmp_path / "123" / "1.json.xz").exists()
+            assert sorted(
+                call.args[0] for call in container.delete_item.call_args_list
+            ) == ["1_clean", "1_res_100"]
+
+            container.reset_mock()
+            with mock.patch(
+                "shared_code.stream_store.read_stream_document", return_value=stub
+            ):
+                assert stream_store.rehydrate_streams("1")
+
+            upserted = [call.args[0] for call in container.upsert_item.call_args_list]
+            assert [document["id"] for document in upserted] == [
+                "1_res_100",
+                "1_clean",
+                "1",
+            ]
+            assert "rehydrated_at" in upserted[-1]
+            assert not (tmp_path / "123" / "1.json.xz").exists()
+            mock_patch_cosmosdb_item.assert_called_once_with(
+                "1",
+                "activities",
+                [{"op": "set", "path": "/streams_archived", "value": False}],
+            )
+
+    def test_failed_rehydration(self):
+        """Test a stub that could not be rehydrated is not decoded"""
+        stub = {
+            "id": "1",
+            "userId": "123",
+            "format": "archived-v1",
+            "archive": "123/1.json.xz",
+        }
+        with (
+            mock.patch(
+                "shared_code.stream_store.read_stream_document", return_value=stub
+            ),
+            mock.patch(
+                "shared_code.stream_store.rehydrate_streams", return_value=False
+            ) as mock_rehydrate_streams,
+        ):
+            assert stream_store.read_streams("1", "123") is None
+            mock_rehydrate_streams.assert_called_once_with("1")
+
+    def test_recently_rehydrated(self):
+        """Test recently rehydrated streams are not archived again"""
+        documents = copy.deepcopy(self.documents)
+        documents[0]["rehydrated_at"] = datetime.datetime.now(
+            datetime.timezone.utc
+        ).isoformat()
+
+        with mock.patch(
+            "shared_code.cosmosdb_module.get_cosmosdb_items", return_value=documents
+        ):
+            assert not stream_store.archive_streams("1", "123")
+
+
+class TestCosmosdbContainers:
+    """Test cosmosdb_containers.py"""
+
+    def test_container_definitions(self):
+        """Test the streams are not indexed and activities only on queried paths"""
+        definitions = {
+            container["name"]: container
+            for container in cosmosdb_containers.container_definitions()
+        }
+
+        assert set(definitions) == {
+            "activities",
+            "streams",
+            "users",
+            "notifications",
+            "metrics",
+        }
+        streams_policy = definitions["streams"]["indexing_policy"]
+        assert {"path": "/*"} in streams_policy["excludedPaths"]
+        assert streams_policy["includedPaths"] == [{"path": "/activityId/?"}]
+
+        activities_policy = definitions["activities"]["indexing_policy"]
+        assert {"path": "/userId/?"} in activities_policy["includedPaths"]
+        assert {"path": "/_ts/?"} in activities_policy["includedPaths"]
+        assert [
+            {"path": "/userId", "order": "ascending"},
+            {"path": "/start_date", "order": "descending"},
+        ] in activities_policy["compositeIndexes"]
+
+
+class TestAggregateHelpers:
+    """Test aggregate_helpers.py"""
+
+    def test_update_aggregates_document(self):
+        """Test a recalculated activity replaces its contribution"""
+        document = aggregate_helpers.default_aggregates_document("123", "2023")
+        activity = {
+            "id": "1",
+            "type": "Run",
+            "start_date_local": "2023-11-05T09:48:49Z",
+            "distance": 10000.0,
+            "moving_time": 3000,
+            "hr_trimp": None,
+        }
+
+        aggregate_helpers.update_aggregates_document(document, activity)
+        aggregate_helpers.update_aggregates_document(
+            document, {**activity, "hr_trimp": 80.0}
+        )
+
+        assert document["activities"] == {
+            "1": {
+                "date": "2023-11-05",
+                "type": "Run",
+                "distance": 10000.0,
+                "moving_time": 3000,
+                "elapsed_time": 0,
+                "total_elevation_gain": 0,
+                "hr_trimp": 80.0,
+                "pace_trimp": 0,
+            }
+        }
+
+    def test_sum_buckets(self):
+        """Test entries are summed per ISO week and filtered on type"""
+        fields = {field: 1 for field in aggregate_helpers.aggregate_fields()}
+        entries = [
+            {"date": "2023-11-05", "type": "Run", **fields},
+            {"date": "2023-11-06", "type": "Run", **fields},
+            {"date": "2023-11-07", "type": "Ride", **fields},
+            {"date": "2023-11-08", "type": "Run", "count": 2, **fields},
+        ]
+
+        weeks = aggregate_helpers.sum_buckets(entries, "week", "Run")
+
+        assert [(week["bucket"], week["count"]) for week in weeks] == [
+            ("2023-10-30", 1),
+            ("2023-11-06", 3),
+        ]
+        assert weeks[1]["distance"] == 2
+        assert aggregate_helpers.sum_buckets(entries, "year")[0]["count"] == 5
+
+    stored_activity = {
+        "id": "1",
+        "start_date_local": "2020-01-01T08:00:00Z",
+        "type": "Run",
+        "distance": 5000.0,
+        "hr_trimp": None,
+    }
+
+    @mock.patch("shared_code.cosmosdb_module.cosmosdb_container")
+    @mock.patch("shared_code.cosmosdb_module.get_cosmosdb_items")
+    @mock.patch("shared_code.cosmosdb_module.get_cosmosdb_item")
+    def test_get_year_entries(
+        self, mock_get_cosmosdb_item, mock_get_cosmosdb_items, mock_cosmosdb_container
+    ):
+        """Test years without an aggregates document are built once and stored"""
+        container = mock_cosmosdb_container.return_value
+        container.read_item.side_effect = exceptions.CosmosResourceNotFoundError()
+        container.create_item.side_effect = lambda item: item
+        mock_get_cosmosdb_item.return_value = None
+        mock_get_cosmosdb_items.return_value = [self.stored_activity]
+
+        assert aggregate_helpers.get_year_entries("123", "2020") == [
+            {
+                "date": "2020-01-01",
+                "type": "Run",
+                "distance": 5000.0,
+                "moving_time": 0,
+                "elapsed_time": 0,
+                "total_elevation_gain": 0,
+                "hr_trimp": 0,
+                "pace_trimp": 0,
+            }
+        ]
+        assert "GROUP BY" not in mock_get_cosmosdb_items.call_args.args[0]
+        stored = container.create_item.call_args.args[0]
+        assert stored["id"] == "aggregates_123_2020"
+        assert list(stored["activities"]) == ["1"]
+
+    @mock.patch("shared_code.cosmosdb_module.cosmosdb_container")
+    @mock.patch("shared_code.cosmosdb_module.get_cosmosdb_items")
+    def test_update_aggregates_seeds_year(
+        self, mock_get_cosmosdb_items, mock_cosmosdb_container
+    ):
+        """Test a new year document holds the stored activities of that year"""
+        container = mock_cosmosdb_container.return_value
+        container.read_item.side_effect = exceptions.CosmosResourceNotFoundError()
+        container.create_item.side_effect = lambda item: item
+        mock_get_cosmosdb_items.return_value = [self.stored_activity]
+
+        document = aggregate_helpers.update_aggregates(
+            {**self.stored_activity, "id": "2", "userId": "123"}
+        )
+
+        assert sorted(document["activities"]) == ["1", "2"]
+
+        # An existing document is not seeded again
+        mock_get_cosmosdb_items.reset_mock()
+        container.read_item.side_effect = None
+        container.read_item.return_value = {**document, "_etag": "a"}
+        container.replace_item.side_effect = lambda **kwargs: kwargs["body"]
+        aggregate_helpers.update_aggregates(
+            {**self.stored_activity, "id": "3", "userId": "123"}
+        )
+        mock_get_cosmosdb_items.assert_not_called()
+
+
+class TestCacheHelpers:
+    """Test cache_helpers.py"""
+
+    def test_lru_cache(self):
+        """Test the least recently used values are evicted"""
+        evicted = []
+        cache = cache_helpers.LRUCache(5, len, lambda key, value: evicted.append(key))
+
+        cache.set("a", "aa")
+        cache.set("b", "bb")
+        assert cache.get("a") == "aa"
+        cache.set("c", "cc")
+
+        assert evicted == ["b"]
+        assert cache.size == 4
+        assert cache.get("b") is None
+        assert cache.values() == ["aa", "cc"]
+
+        cache.set("d", "dddddd")
+        assert evicted == ["b", "d"]
+        assert "d" not in cache
+
+
+class TestStreamCache:
+    """Test stream_cache.py"""
+
+    streams = {
+        "time": np.arange(100),
+        "heartrate": np.full(100, 150),
+        "distance": np.arange(100) * 3.0,
+    }
+
+    def read_streams(self, _activity_id, _user_id, columns=None):
+        """Read the streams like stream_store"""
+        names = self.streams if columns is None else columns
+        return {name: self.streams[name] for name in names if name in self.streams}
+
+    def teardown_method(self):
+        """Reset the caches"""
+        stream_cache.clear()
+        stream_cache.caches.cache_clear()
+
+    def setup_cache(self, settings: dict):
+        """Create the caches with the given settings"""
+        stream_cache.caches.cache_clear()
+        with mock.patch(
+            "shared_code.get_config.get_stream_cache", return_value=settings
+        ):
+            stream_cache.caches()
+
+    def test_read_streams(self):
+        """Test the streams are read once per version"""
+        self.setup_cache(
+            {"max_memory_bytes": 10_000, "max_disk_bytes": 0, "directory": None}
+        )
+        version = {"userId": "123", "_etag": "1"}
+
+        with (
+            mock.patch(
+                "shared_code.stream_store.read_stream_version", return_value=version
+            ),
+            mock.patch(
+                "shared_code.stream_store.read_streams", side_effect=self.read_streams
+            ) as mock_read_streams,
+        ):
+            stream_cache.read_streams("1", "123", ["time", "heartrate"])
+            output = stream_cache.read_streams("1", "123", ["heartrate"])
+            assert list(output) == ["heartrate"]
+            assert mock_read_streams.call_count == 1
+
+            stream_cache.read_streams("1", "123", ["time", "distance"])
+            mock_read_streams.assert_called_with("1", "123", ["distance"])
+
+            version["_etag"] = "2"
+            stream_cache.read_streams("1", "123", ["heartrate"])
+            assert mock_read_streams.call_count == 3
+
+            stream_cache.invalidate("1")
+            stream_cache.read_streams("1", "123", ["heartrate"])
+            assert mock_read_streams.call_count == 4
+
+            assert stream_cache.read_streams("1", "456") is None
+
+    def test_spill(self, tmp_path):
+        """Test entries evicted from memory are memory-mapped from disk"""
+        self.setup_cache(
+            {
+                "max_memory_bytes": 1_000,
+                "max_disk_bytes": 100_000,
+                "directory": str(tmp_path),
+            }
+        )
+
+        with (
+            mock.patch(
+                "shared_code.stream_store.read_stream_version",
+                return_value={"userId": "123", "_etag": "1"},
+            ),
+            mock.patch(
+                "shared_code.stream_store.read_streams", side_effect=self.read_streams
+            ) as mock_read_streams,
+        ):
+            stream_cache.read_streams("1", "123", ["time"])
+            stream_cache.read_streams("2", "123", ["time"])
+            assert len(list((tmp_path / "stream_cache").iterdir())) == 1
+
+            output = stream_cache.read_streams("1", "123", ["time"])
+            assert isinstance(output["time"], np.memmap)
+            assert output["time"].tolist() == list(range(100))
+            assert mock_read_streams.call_count == 2
+
+            # The spilled entry moved back to memory and stays cached
+            assert "1" in stream_cache.caches()["memory"]
+            output = stream_cache.read_streams("1", "123", ["time"])
+            assert isinstance(output["time"], np.memmap)
+            stream_cache.read_streams("2", "123", ["time"])
+            stream_cache.read_streams("1", "123", ["time"])
+            assert mock_read_streams.call_count == 2
+
+            stream_cache.invalidate("1")
+            stream_cache.invalidate("2")
+            assert list((tmp_path / "stream_cache").iterdir()) == []
+
+
+class TestCurveHelpers:
+    """Test curve_helpers.py"""
+
+    def test_update_curves_document(self):
+        """Test update curves document"""
+        document = curve_helpers.default_curves_document("123")
+        activities = [
+            {
+                "id": "1",
+                "type": "Run",
+                "start_date_local": "2022-06-01T08:00:00Z",
+                "mean_max_curves": {"durations": [5, 10], "speed": [5.0, 4.0]},
+            },
+            {
+                "id": "2",
+                "type": "Run",
+                "start_date_local": "2023-06-01T08:00:00Z",
+                "mean_max_curves": {"durations": [5, 10], "speed": [4.5, 4.2]},
+            },
+        ]
+        for activity in activities:
+            document = curve_helpers.update_curves_document(document, activity)
+
+        runs = document["types"]["Run"]
+        all_time = curve_helpers.envelope_to_curves(runs["all_time"])
+        assert [(x["value"], x["activity_id"]) for x in all_time["speed"]] == [
+            (5.0, "1"),
+            (4.2, "2"),
+        ]
+        season = curve_helpers.envelope_to_curves(runs["seasons"]["2023"])
+        assert [x["value"] for x in season["speed"]] == [4.5, 4.2]
+
+        # A recalculated activity replaces its own values and the runner-up
+        # takes over when the best value drops
+        activities[0]["mean_max_curves"]["speed"] = [4.0, 3.0]
+        document = curve_helpers.update_curves_document(document, activities[0])
+        all_time = curve_helpers.envelope_to_curves(runs["all_time"])
+        assert [(x["value"], x["activity_id"]) for x in all_time["speed"]] == [
+            (4.5, "2"),
+            (4.2, "2"),
+        ]
+        assert len(runs["all_time"]["speed"]["5"]) == 2
+
+    def test_curves_per_type(self):
+        """Test rides do not change the run curves and old documents are reset"""
+        document = {"id": "curves_123", "all_time": {"speed": {}}, "seasons": {}}
+        for activity_id, activity_type, speed in [
+            ("1", "Run", 4.0),
+            ("2", "Ride", 9.0),
+        ]:
+            document = curve_helpers.update_curves_document(
+                document,
+                {
+                    "id": activity_id,
+                    "type": activity_type,
+                    "start_date_local": "2023-06-01T08:00:00Z",
+                    "mean_max_curves": {"durations": [5], "speed": [speed]},
+                },
+            )
+
+        assert "all_time" not in document
+        assert set(document["types"]) == {"Run", "Ride"}
+        runs = curve_helpers.envelope_to_curves(document["types"]["Run"]["all_time"])
+        assert [x["value"] for x in runs["speed"]] == [4.0]
+
+    def test_merge_curves_grid(self):
+        """Test the full activity duration is not merged and old keys are dropped"""
+        envelope = {
+            "speed": {
+                "5": {"value": 3.0, "activity_id": "0", "date": "2023-01-01"},
+                "12": {"value": 3.0, "activity_id": "0", "date": "2023-01-01"},
+            }
+        }
+        curves = {"durations": [5, 10, 12], "speed": [4.0, 3.5, 3.4]}
+
+        envelope = curve_helpers.merge_curves(envelope, curves, "1", "2023-02-01")
+
+        assert list(envelope["speed"]) == ["5", "10"]
+        assert [x["activity_id"] for x in envelope["speed"]["5"]] == ["1", "0"]
+
+
+class TestCalculators:
+    """Test calculators.py"""
+
+    def test_resolve_calculators(self):
+        """Test dependent calculators are included"""
+        assert calculators.resolve_calculators() == list(calculators.calculators())
+        assert calculators.resolve_calculators(["hr_reserve"]) == [
+            "hr_reserve",
+            "hr_trimp",
+        ]
+        assert calculators.resolve_calculators(["pace_trimp"]) == ["pace_trimp"]
+
+    def test_get_stream_columns(self):
+        """Test get stream columns"""
+        assert calculators.get_stream_columns(["pace_reserve", "pace_trimp"]) == []
+        assert calculators.get_stream_columns(["hr_reserve", "hr_trimp"]) == [
+            "time",
+            "heartrate",
+        ]
+
+    def test_get_outdated_calculators(self):
+        """Test get outdated calculators"""
+        versions = {
+            name: calculator["version"]
+            for name, calculator in calculators.calculators().items()
+        }
+        assert not calculators.get_outdated_calculators(
+            {"calculation_versions": versions}
+        )
+
+        versions["hr_trimp"] = 0
+        assert calculators.get_outdated_calculators(
+            {"calculation_versions": versions}
+        ) == ["hr_trimp"]
+        assert calculators.get_outdated_calculators({}) == list(
+            calculators.calculators()
+        )
+
+    def test_outdated_calculations_filter(self):
+        """Test outdated calculations filter"""
+        query_filter, parameters = calculators.outdated_calculations_filter()
+        assert "NOT IS_DEFINED(c.calculation_versions.hr_trimp)" in query_filter
+        assert {"name": "@hr_trimp_version", "value": 1} in parameters
+
+
 class TestQueueHelpers:
     """Test queue helpers"""
 
@@ -445,3 +1584,199 @@ class TestQueueHelpers:
 
         # Assert that container_function_with_back_off was called once
         mock_back_off.assert_called_once()
+
+
+class TestResponseCache:
+    """Test response_cache.py"""
+
+    def setup_cache(self, directory=None, ttl_seconds=30):
+        """Create the cache with the given settings"""
+        response_cache.cache_state.cache_clear()
+        settings = {
+            "max_bytes": 1024,
+            "ttl_seconds": ttl_seconds,
+            "directory": str(directory) if directory else None,
+        }
+        with mock.patch(
+            "shared_code.get_config.get_response_cache", return_value=settings
+        ):
+            response_cache.cache_state()
+
+    def cache_response(self, user_id="123", body="[1, 2]"):
+        """Cache a response like the endpoints do"""
+        generation = response_cache.user_generation(user_id)
+        response = func.HttpResponse(
+            body, status_code=200, mimetype="application/json", headers={"ETag": "1"}
+        )
+        response_cache.set_response(
+            user_id, "data/activities", {"a": "1"}, response, generation
+        )
+
+    def test_hit(self):
+        """Test a cached response is returned for the same parameters"""
+        self.setup_cache()
+        self.cache_response()
+
+        response = response_cache.get_response("123", "data/activities", {"a": "1"})
+        assert response.get_body() == b"[1, 2]"
+        assert response.mimetype == "application/json"
+        assert response.headers["ETag"] == "1"
+        assert response_cache.get_response("123", "data/activities", {}) is None
+        assert response_cache.get_response("456", "data/activities", {"a": "1"}) is None
+
+    def test_invalidate(self):
+        """Test a write invalidates the responses of that user only"""
+        self.setup_cache()
+        self.cache_response("123")
+        self.cache_response("456")
+
+        response_cache.invalidate_user("123")
+        assert response_cache.get_response("123", "data/activities", {"a": "1"}) is None
+        assert response_cache.get_response("456", "data/activities", {"a": "1"})
+
+    def test_stale_generation(self):
+        """Test a response created during a write is not served"""
+        self.setup_cache()
+        generation = response_cache.user_generation("123")
+        response_cache.invalidate_user("123")
+        response_cache.set_response(
+            "123", "user", {}, func.HttpResponse("{}", status_code=200), generation
+        )
+        assert response_cache.get_response("123", "user", {}) is None
+
+    def test_errors_not_cached(self):
+        """Test only successful responses are cached"""
+        self.setup_cache()
+        response_cache.set_response(
+            "123", "user", {}, func.HttpResponse("{}", status_code=400), 0
+        )
+        assert response_cache.get_response("123", "user", {}) is None
+
+    def test_ttl(self):
+        """Test responses expire"""
+        self.setup_cache(ttl_seconds=0)
+        self.cache_response()
+        with mock.patch("time.time", return_value=time.time() + 1):
+            assert (
+                response_cache.get_response("123", "data/activities", {"a": "1"})
+                is None
+            )
+
+    def test_shared_directory(self, tmp_path):
+        """Test responses and invalidations are shared through the directory"""
+        self.setup_cache(tmp_path)
+        self.cache_response()
+
+        # A new process only sees the shared directory
+        self.setup_cache(tmp_path)
+        response = response_cache.get_response("123", "data/activities", {"a": "1"})
+        assert response.get_body() == b"[1, 2]"
+
+        self.setup_cache(tmp_path)
+        response_cache.invalidate_user("123")
+        self.setup_cache(tmp_path)
+        assert response_cache.get_response("123", "data/activities", {"a": "1"}) is None
+
+
+class TestOrchestrationIndex:
+    """Test orchestration_index.py"""
+
+    def instance(self, instance_id: str, created_time: str) -> dict:
+        """Create an indexed instance"""
+        return {
+            "instanceId": instance_id,
+            "runtimeStatus": "Running",
+            "createdTime": created_time,
+            "lastUpdatedTime": created_time,
+            "output": None,
+        }
+
+    @time_machine.travel(datetime.datetime(2024, 6, 1, tzinfo=datetime.timezone.utc))
+    def test_set_instances_document(self):
+        """Test instances are added and old instances are dropped"""
+        document = orchestration_index.default_index_document("123")
+        assert document["since"] == "2024-06-01 00:00:00"
+        document["instances"]["old"] = self.instance("old", "2023-05-01 10:00:00")
+
+        orchestration_index.set_instances_document(
+            document, [self.instance("new", "2024-05-31 10:00:00")]
+        )
+        assert list(document["instances"]) == ["new"]
+
+    def test_complete_and_remove_instance(self):
+        """Test the output is recorded and purged instances are removed"""
+        document = orchestration_index.default_index_document("123")
+        document["instances"]["1"] = self.instance("1", "2024-05-31 10:00:00")
+
+        with mock.patch(
+            "shared_code.cosmosdb_module.update_cosmosdb_item",
+            side_effect=lambda _id, _container, update, _default: update(document),
+        ):
+            orchestration_index.complete_instance("123", "1", {"status": "success"})
+            assert document["instances"]["1"]["runtimeStatus"] == "Completed"
+            assert document["instances"]["1"]["output"] == {"status": "success"}
+
+            orchestration_index.remove_instance("123", "1")
+            assert document["instances"] == {}
+
+
+class TestHttpHelpers:
+    """Test http_helpers.py"""
+
+    def request(self, accept_encoding: str | None = None) -> func.HttpRequest:
+        """Create a request with an Accept-Encoding header"""
+        headers = {"Accept-Encoding": accept_encoding} if accept_encoding else {}
+        return func.HttpRequest(
+            method="GET", url="/api/data/activities", body=None, headers=headers
+        )
+
+    def test_dumps(self):
+        """Test datetimes, numpy values and non finite floats are serialized"""
+        value = {
+            "date": datetime.datetime(2023, 11, 5, 9, 48, 49),
+            "values": np.array([1.5, np.nan]),
+            "strided": np.arange(6)[::2],
+            "count": np.int64(3),
+            "infinite": float("inf"),
+        }
+        assert json.loads(http_helpers.dumps(value)) == {
+            "date": "2023-11-05T09:48:49",
+            "values": [1.5, None],
+            "strided": [0, 2, 4],
+            "count": 3,
+            "infinite": None,
+        }
+
+    @pytest.mark.parametrize(
+        ("accept_encoding", "expected"),
+        [
+            (None, None),
+            ("gzip, deflate", "gzip"),
+            ("gzip, deflate, br", "br"),
+            ("br;q=0, gzip", "gzip"),
+            ("*", "br"),
+            ("identity", None),
+        ],
+    )
+    def test_accepted_encoding(self, accept_encoding, expected):
+        """Test the preferred encoding is selected"""
+        assert http_helpers.accepted_encoding(self.request(accept_encoding)) == expected
+
+    def test_json_response(self):
+        """Test large bodies are compressed with a weak ETag"""
+        value = [{"id": str(i), "distance": 10000.0} for i in range(100)]
+        response = http_helpers.json_response(
+            self.request("gzip"), value, headers={"ETag": '"abc"'}
+        )
+
+        assert response.headers["Content-Encoding"] == "gzip"
+        assert response.headers["Vary"] == "Accept-Encoding"
+        assert response.headers["ETag"] == 'W/"abc"'
+        assert json.loads(gzip.decompress(response.get_body())) == value
+
+    def test_small_response(self):
+        """Test small bodies are not compressed"""
+        response = http_helpers.json_response(self.request("gzip"), {"result": "done"})
+
+        assert response.headers.get("Content-Encoding") is None
+        assert response.get_body() == b'{"result":"done"}'
@@ -1,4 +1,5 @@
 """Test http_user_add"""
+import copy
 import json
 from pathlib import Path
 from unittest.mock import AsyncMock, MagicMock, patch
@@ -45,7 +46,13 @@ class TestPostUser:
         func_call = post_user.build().get_user_function()
         response = await func_call(req)
         assert response.status_code == 400
-        assert response.get_body() == b'{"result": "Schema validation failed"}'
+        body = json.loads(response.get_body())
+        assert body["result"] == "Schema validation failed"
+        assert {
+            "path": "/",
+            "message": "Additional properties are not allowed ('invalid' was unexpected)",
+            "validator": "additionalProperties",
+        } in body["errors"]
 
     @patch("shared_code.user_helpers.get_user")
     @patch("shared_code.cosmosdb_module.cosmosdb_container")
@@ -131,6 +138,43 @@ class TestGetUser:
         assert result.status_code == 200
         assert body == self.mock_container_response[0]
 
+    @patch("shared_code.user_helpers.get_user")
+    @patch("shared_code.cosmosdb_module.cosmosdb_container")
+    def test_not_modified(self, cosmosdb_container, mock_get_user):
+        """Test a matching ETag returns 304"""
+        user = {
+            "id": "123",
+            "dark_mode": True,
+            "_rid": "rid",
+            "_self": "self",
+            "_etag": '"1"',
+            "_attachments": "attachments/",
+            "_ts": 1682629624,
+        }
+        cosmosdb_container.return_value.query_items.side_effect = [
+            [copy.deepcopy(user)],
+            [copy.deepcopy(user)],
+        ]
+        mock_get_user.return_value = mock_get_user_data
+        func_call = get_user.build().get_user_function()
+
+        req = create_params_func_request(
+            url="http://localhost:7071/api/user",
+            method="GET",
+            params={},
+        )
+        etag = func_call(req).headers["ETag"]
+
+        req = func.HttpRequest(
+            method="GET",
+            url="http://localhost:7071/api/user",
+            body=None,
+            headers={"If-None-Match": etag},
+        )
+        result = func_call(req)
+        assert result.status_code == 304
+        assert result.get_body() == b""
+
     @patch("shared_code.user_helpers.get_user")
     @patch("shared_code.cosmosdb_module.cosmosdb_container")
     def test_no_data_in_cosmosdb(self, cosmosdb_container, mock_get_user):